@@ -0,0 +1,61 @@
+"""
+Contention benchmark for LRUTTLCache.
+
+Usage: python benchmarks/bench_cache.py [--threads 32] [--ops 20000]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+from flask_app.cache import LRUTTLCache  # noqa: E402
+
+
+def run(threads: int, ops: int, keys: int, max_size: int, write_ratio: float):
+    cache = LRUTTLCache(max_size=max_size, default_ttl=30)
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        barrier.wait()
+        for _ in range(ops):
+            key = f"julius:{rng.randrange(keys)}"
+            if rng.random() < write_ratio:
+                cache.set(key, {"response": key}, ttl=rng.uniform(0.01, 5))
+            else:
+                cache.get(key)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+
+    total_ops = threads * ops
+    stats = cache.get_stats()
+    print(f"threads={threads} ops={total_ops} elapsed={elapsed:.2f}s "
+          f"throughput={total_ops / elapsed:,.0f} ops/s")
+    print(f"hits={stats['hits']} misses={stats['misses']} "
+          f"evictions={stats['evictions']} expirations={stats['expirations']} "
+          f"size={stats['size']}/{stats['max_size']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--ops', type=int, default=20000, help='operations per thread')
+    parser.add_argument('--keys', type=int, default=5000)
+    parser.add_argument('--max-size', type=int, default=1000)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    args = parser.parse_args()
+
+    run(args.threads, args.ops, args.keys, args.max_size, args.write_ratio)
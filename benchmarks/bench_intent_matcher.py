@@ -0,0 +1,90 @@
+"""
+Intent matching benchmark: compiled IntentMatcher vs the first-keyword loop
+it replaced, on a labeled corpus of Portuguese questions.
+
+Expected intent None means the question should escalate (LLM) rather than
+run a predefined pattern.
+
+Usage: python benchmarks/bench_intent_matcher.py [--repeat 200]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+from flask_app.intent_matcher import MIN_INTENT_CONFIDENCE  # noqa: E402
+from flask_app.smart_query_generator import (  # noqa: E402
+    BrazilianFinancialQueryGenerator, INTENT_MATCHER, QUERY_PATTERNS)
+
+CORPUS = [
+    ("Quais foram meus maiores gastos?", "maiores_gastos"),
+    ("onde mais gastei dinheiro", "maiores_gastos"),
+    ("quanto gastei este mês", "total_gasto"),
+    ("qual o total de gastos", "total_gasto"),
+    ("últimas transações", "ultimas_transacoes"),
+    ("mostre os gastos recentes", "ultimas_transacoes"),
+    ("gastos acima de 500", "gastos_acima_valor"),
+    ("transações acima de R$ 100", "gastos_acima_valor"),
+    ("compras do mês passado", "transacoes_periodo"),
+    ("transações dos últimos 30 dias", "transacoes_periodo"),
+    ("quanto gastei com ifood", None),
+    ("meus pedidos de delivery", "gastos_delivery"),
+    ("maiores gastos com delivery", "gastos_delivery"),
+    ("gastos no supermercado", "gastos_supermercado"),
+    ("compras de mercado este mês", "gastos_supermercado"),
+    ("gastos com uber", "gastos_transporte"),
+    ("quanto gastei de gasolina", None),
+    ("minhas assinaturas", "gastos_assinaturas"),
+    ("quanto pago de netflix e spotify", "gastos_assinaturas"),
+    ("total por categoria", "total_por_categoria"),
+    ("transações acima de 100 com uber", "gastos_transporte"),
+    ("quanto gastei acima de 200", "total_gasto"),
+    ("me dê uma estratégia para economizar", None),
+    ("comparar meus gastos de janeiro e fevereiro", None),
+]
+
+
+def legacy_match(question):
+    """The previous behaviour: first keyword hit in dict order"""
+    for name, config in QUERY_PATTERNS.items():
+        for keyword in config["keywords"]:
+            if keyword in question:
+                return name
+    return None
+
+
+def compiled_match(generator, question):
+    value_info = generator._extract_value_from_question(question)
+    match = INTENT_MATCHER.match(question, amount=value_info["min_amount"])
+    if match is None or match.confidence < MIN_INTENT_CONFIDENCE:
+        return None
+    return match.intent
+
+
+def evaluate(name, matcher, questions, repeat):
+    correct = sum(1 for q, expected in questions if matcher(q) == expected)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for q, _ in questions:
+            matcher(q)
+    elapsed = time.perf_counter() - start
+
+    per_question = elapsed / (repeat * len(questions)) * 1e6
+    print(f"{name:<10} accuracy={correct}/{len(questions)} "
+          f"({correct / len(questions) * 100:.0f}%) {per_question:.1f} µs/question")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    generator = BrazilianFinancialQueryGenerator(0, session_factory=None)
+    questions = [(generator._normalize_question(q), expected) for q, expected in CORPUS]
+
+    evaluate("legacy", legacy_match, questions, args.repeat)
+    evaluate("compiled", lambda q: compiled_match(generator, q), questions, args.repeat)
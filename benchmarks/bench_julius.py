@@ -0,0 +1,139 @@
+"""
+Offline end-to-end Julius benchmark.
+
+Replays a labeled set of Portuguese questions through
+JuliusAI.ask_with_context on a temporary SQLite database, with the fake
+LLM/embedding provider, and reports p50/p95 latency, LLM calls and the
+pattern-hit rate per optimization level.
+
+Expected route "pattern" means the question should be answered by a
+predefined query without the LLM; "agent" means it needs the agent.
+
+Usage: python benchmarks/bench_julius.py [--rounds 3] [--llm-latency 0.3]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask  # noqa: E402
+
+from flask_app.conversation_memory import conversation_summarizer  # noqa: E402
+from flask_app.julius_ai import JuliusAI  # noqa: E402
+from flask_app.julius_metrics import percentile  # noqa: E402
+from flask_app.llm_providers import FakeProvider  # noqa: E402
+from flask_app.models import db, User, Card, PDFExtractable, Transaction  # noqa: E402
+
+QUESTIONS = [
+    ("Quais foram meus maiores gastos?", "pattern"),
+    ("quanto gastei este mês", "pattern"),
+    ("últimas transações", "pattern"),
+    ("gastos acima de 500", "pattern"),
+    ("compras do mês passado", "pattern"),
+    ("meus pedidos de delivery", "pattern"),
+    ("gastos no supermercado", "pattern"),
+    ("gastos com uber", "pattern"),
+    ("minhas assinaturas", "pattern"),
+    ("total por categoria", "pattern"),
+    ("me dê uma estratégia para economizar", "agent"),
+    ("comparar meus gastos de janeiro e fevereiro", "agent"),
+    ("como posso planejar melhor meu orçamento?", "agent"),
+    ("quanto gastei de gasolina", "agent"),
+]
+
+MERCHANTS = [
+    ("IFOOD *RESTAURANTE", 62.5, "delivery"),
+    ("UBER *TRIP", 23.9, "transporte"),
+    ("NETFLIX.COM", 55.9, "assinaturas"),
+    ("SUPERMERCADO DIA", 312.4, "supermercado"),
+    ("POSTO SHELL", 180.0, "combustivel"),
+    ("AMAZON MARKETPLACE", 649.0, "compras"),
+]
+
+
+def seed(transactions_per_month: int) -> int:
+    user = User(username="bench", email="bench@example.com", password="x")
+    db.session.add(user)
+    db.session.flush()
+    card = Card(user_id=user.id, number="4111", expiration_date="12/30",
+                card_type="credit", name="Bench")
+    db.session.add(card)
+    db.session.flush()
+    pdf = PDFExtractable(card_id=card.id, file_name="fatura.pdf")
+    db.session.add(pdf)
+    db.session.flush()
+
+    today = date.today()
+    for i in range(transactions_per_month * 2):
+        description, amount, category = MERCHANTS[i % len(MERCHANTS)]
+        db.session.add(Transaction(
+            pdf_id=pdf.id, description=description, amount=amount + i % 7,
+            category=category, date=(today - timedelta(days=i * 30 // transactions_per_month)).isoformat()))
+    db.session.commit()
+    return user.id
+
+
+def run_level(user_id, level: str, provider: FakeProvider, rounds: int, keep_cache: bool):
+    ai = JuliusAI(user_id, optimization_level=level, provider=provider)
+    ai.clear_cache()
+
+    latencies, llm_calls, pattern_hits, correct, total = [], 0, 0, 0, 0
+    for _ in range(rounds):
+        session_id = None
+        for question, expected in QUESTIONS:
+            if not keep_cache:
+                ai.clear_cache()
+            start = time.perf_counter()
+            result = ai.ask_with_context(question, session_id=session_id)
+            latencies.append((time.perf_counter() - start) * 1000)
+            session_id = result['session_id']
+
+            usage = ai._get_last_usage() or {}
+            llm_calls += usage.get('llm_calls', 0)
+            route = 'pattern' if result.get('query_type', '').startswith('pattern:') else 'agent'
+            pattern_hits += route == 'pattern'
+            correct += route == expected or result.get('query_type') in ('cache', 'semantic_cache')
+            total += 1
+
+    print(f"{level:<11} n={total} p50={percentile(latencies, 50):.1f}ms "
+          f"p95={percentile(latencies, 95):.1f}ms llm_calls={llm_calls} "
+          f"pattern_hit_rate={pattern_hits / total * 100:.0f}% "
+          f"route_accuracy={correct / total * 100:.0f}%")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--llm-latency', type=float, default=0.3,
+                        help='seconds per fake LLM call')
+    parser.add_argument('--completion-tokens', type=int, default=60)
+    parser.add_argument('--transactions', type=int, default=60,
+                        help='transactions per month')
+    parser.add_argument('--levels', default='aggressive,balanced,quality')
+    parser.add_argument('--keep-cache', action='store_true',
+                        help='let repeated questions hit the response caches')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_julius_')
+    os.chdir(workdir)  # vector store files
+
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db.init_app(app)
+    conversation_summarizer.enabled = False
+
+    provider = FakeProvider(latency=args.llm_latency,
+                            completion_tokens=args.completion_tokens)
+
+    with app.app_context():
+        db.create_all()
+        user_id = seed(args.transactions)
+        for level in args.levels.split(','):
+            run_level(user_id, level, provider, args.rounds, args.keep_cache)
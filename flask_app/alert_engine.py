@@ -0,0 +1,165 @@
+import logging
+import math
+import os
+from typing import Dict, Iterable, List
+
+from .models import db, CategorySpendingStats, SpendingAlert
+from .budgets import budget_breaches, drop_resolved_breaches
+
+logger = logging.getLogger(__name__)
+
+# Minimum history in a category before outliers are flagged
+MIN_SAMPLES = 5
+# Standard deviations above the category mean to count as unusual
+OUTLIER_Z_SCORE = 3.0
+# Absolute amount (R$) that always raises a large_transaction alert
+LARGE_TRANSACTION_THRESHOLD = float(
+    os.getenv('LARGE_TRANSACTION_THRESHOLD', 1000))
+
+
+def _welford_add(stats: CategorySpendingStats, amount: float):
+    """Add one observation to the running mean/variance"""
+    stats.count += 1
+    delta = amount - stats.mean
+    stats.mean += delta / stats.count
+    stats.m2 += delta * (amount - stats.mean)
+
+
+def _welford_remove(stats: CategorySpendingStats, amount: float):
+    """Remove one observation from the running mean/variance"""
+    if stats.count <= 1:
+        stats.count, stats.mean, stats.m2 = 0, 0.0, 0.0
+        return
+    old_mean = (stats.count * stats.mean - amount) / (stats.count - 1)
+    stats.m2 = max(stats.m2 - (amount - old_mean) * (amount - stats.mean), 0.0)
+    stats.mean = old_mean
+    stats.count -= 1
+
+
+def _std_dev(stats: CategorySpendingStats) -> float:
+    if stats.count < 2:
+        return 0.0
+    return math.sqrt(stats.m2 / (stats.count - 1))
+
+
+def _load_stats(user_id: int, categories: Iterable[str]) -> Dict[str, CategorySpendingStats]:
+    """Load (or create) the running stats for the given categories"""
+    categories = set(categories)
+    stats = {
+        s.category: s for s in db.session.query(CategorySpendingStats).filter(
+            CategorySpendingStats.user_id == user_id,
+            CategorySpendingStats.category.in_(categories)
+        ).all()
+    } if categories else {}
+
+    for category in categories - stats.keys():
+        stats[category] = CategorySpendingStats(
+            user_id=user_id, category=category, count=0, mean=0.0, m2=0.0)
+        db.session.add(stats[category])
+
+    return stats
+
+
+def _expenses(transactions: Iterable) -> List:
+    """Only positive amounts are expenses on credit card statements"""
+    return sorted(
+        (t for t in transactions if t.amount and t.amount > 0),
+        key=lambda t: (t.date or '', t.id or 0)
+    )
+
+
+def evaluate_new_transactions(user_id: int, transactions: Iterable) -> List[SpendingAlert]:
+    """
+    Evaluate only the newly ingested transactions against the user's
+    per-category running statistics, persist the resulting alerts and
+    fold the new amounts into the statistics.
+    """
+    expenses = _expenses(transactions)
+    if not expenses:
+        return []
+
+    stats = _load_stats(user_id, (t.category or 'others' for t in expenses))
+    alerts = []
+
+    for t in expenses:
+        category = t.category or 'others'
+        category_stats = stats[category]
+        amount = float(t.amount)
+
+        # Compare against history *before* this transaction is folded in
+        std_dev = _std_dev(category_stats)
+        if category_stats.count >= MIN_SAMPLES and std_dev > 0:
+            z_score = (amount - category_stats.mean) / std_dev
+            if z_score >= OUTLIER_Z_SCORE:
+                alerts.append(SpendingAlert(
+                    user_id=user_id,
+                    alert_type='unusual_spending',
+                    severity='high' if z_score >= 2 * OUTLIER_Z_SCORE else 'medium',
+                    message=f"Gasto incomum em {category}: R$ {amount:.2f} "
+                            f"(média R$ {category_stats.mean:.2f})",
+                    amount=amount,
+                    category=category,
+                    date=t.date,
+                    transaction_id=t.id
+                ))
+
+        if amount >= LARGE_TRANSACTION_THRESHOLD:
+            alerts.append(SpendingAlert(
+                user_id=user_id,
+                alert_type='large_transaction',
+                severity='high' if amount >= 3 * LARGE_TRANSACTION_THRESHOLD else 'medium',
+                message=f"Transação de valor alto: R$ {amount:.2f} - {t.description}"[:300],
+                amount=amount,
+                category=category,
+                date=t.date,
+                transaction_id=t.id
+            ))
+
+        _welford_add(category_stats, amount)
+
+    # Budgets are checked once per touched month/category, not per transaction
+    alerts.extend(budget_breaches(user_id, expenses))
+
+    db.session.add_all(alerts)
+    db.session.commit()
+
+    logger.info(
+        f"Alert engine evaluated {len(expenses)} transactions for user {user_id}: {len(alerts)} alerts")
+    return alerts
+
+
+def forget_transactions(user_id: int, transactions: Iterable):
+    """
+    Remove deleted transactions from the running statistics and drop the
+    alerts they raised, including budget breaches that no longer hold.
+    The caller is responsible for committing.
+    """
+    expenses = _expenses(transactions)
+    if not expenses:
+        return
+
+    stats = _load_stats(user_id, (t.category or 'others' for t in expenses))
+    for t in expenses:
+        _welford_remove(stats[t.category or 'others'], float(t.amount))
+
+    db.session.query(SpendingAlert).filter(
+        SpendingAlert.user_id == user_id,
+        SpendingAlert.transaction_id.in_([t.id for t in expenses])
+    ).delete(synchronize_session=False)
+    drop_resolved_breaches(user_id, expenses)
+
+
+def get_alerts(user_id: int, limit: int = 50) -> List[Dict]:
+    """Read persisted alerts, newest first"""
+    alerts = db.session.query(SpendingAlert).filter(
+        SpendingAlert.user_id == user_id
+    ).order_by(SpendingAlert.created_at.desc(), SpendingAlert.id.desc()).limit(limit).all()
+
+    return [{
+        'type': alert.alert_type,
+        'message': alert.message,
+        'severity': alert.severity,
+        'date': alert.date or (alert.created_at.strftime('%Y-%m-%d') if alert.created_at else None),
+        'amount': alert.amount,
+        'category': alert.category
+    } for alert in alerts]
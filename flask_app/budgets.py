@@ -0,0 +1,210 @@
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .models import db, Budget, SpendingAlert
+from .spending_rollup import spending_by_category
+
+logger = logging.getLogger(__name__)
+
+# Share of the budget after which a category is reported as "on_track"
+ON_TRACK_THRESHOLD = 80.0
+
+# Years budgets can be set for
+MIN_BUDGET_YEAR = 2000
+MAX_BUDGET_YEAR = 2100
+
+
+def _budget_status(percentage: float) -> str:
+    if percentage > 100:
+        return 'over'
+    if percentage >= ON_TRACK_THRESHOLD:
+        return 'on_track'
+    return 'under'
+
+
+def get_budget_comparison(user_id: int, start_month: str, end_month: str) -> Dict[str, Any]:
+    """
+    Compare budgets against actual spending for a range of months.
+
+    Actuals come from the spending rollup, so the cost depends on the
+    number of months and categories, not on the transaction history.
+    """
+    budget_rows = db.session.query(Budget.category, db.func.sum(Budget.amount)).filter(
+        Budget.user_id == user_id,
+        Budget.month >= start_month,
+        Budget.month <= end_month
+    ).group_by(Budget.category).all()
+    budgets = {category: float(amount or 0) for category, amount in budget_rows}
+
+    actuals = spending_by_category(user_id, start_month, end_month)
+
+    categories = []
+    for category, budget in sorted(budgets.items()):
+        actual = round(actuals.get(category, 0.0), 2)
+        if budget > 0:
+            percentage = round(actual / budget * 100, 2)
+            status = _budget_status(percentage)
+        else:
+            # A zero budget is only exceeded by actual spending
+            percentage = 0.0
+            status = 'over' if actual > 0 else 'under'
+        categories.append({
+            'category': category,
+            'budget': round(budget, 2),
+            'actual': actual,
+            'percentage': percentage,
+            'status': status
+        })
+
+    return {
+        'categories': categories,
+        'total_budget': round(sum(budgets.values()), 2),
+        # Budgeted categories only, comparable with total_budget
+        'total_spent': round(sum(c['actual'] for c in categories), 2)
+    }
+
+
+def set_year_budgets(user_id: int, year: int, budgets: Dict[str, Any]) -> int:
+    """
+    Upsert a full year of budgets in one transaction.
+
+    Each category maps either to a single amount (same budget every month)
+    or to a list of 12 monthly amounts (January first). A None amount
+    removes that month's budget.
+    """
+    months = [f"{year}-{month:02d}" for month in range(1, 13)]
+
+    wanted: Dict[Tuple[str, str], Optional[float]] = {}
+    for category, amounts in budgets.items():
+        if not isinstance(amounts, list):
+            amounts = [amounts] * 12
+        if len(amounts) != 12:
+            raise ValueError(
+                f"Category '{category}' must have 1 or 12 monthly amounts")
+        for month, amount in zip(months, amounts):
+            if amount is not None and float(amount) < 0:
+                raise ValueError(
+                    f"Budget for '{category}' in {month} can't be negative")
+            wanted[(month, category)] = float(
+                amount) if amount is not None else None
+
+    existing = {
+        (row.month, row.category): row
+        for row in db.session.query(Budget).filter(
+            Budget.user_id == user_id,
+            Budget.month.in_(months),
+            Budget.category.in_(list(budgets.keys()))
+        ).all()
+    }
+
+    saved = 0
+    for (month, category), amount in wanted.items():
+        row = existing.get((month, category))
+        if amount is None:
+            if row is not None:
+                db.session.delete(row)
+            continue
+        if row is None:
+            db.session.add(Budget(user_id=user_id, month=month,
+                                  category=category, amount=amount))
+        else:
+            row.amount = amount
+        saved += 1
+
+    db.session.commit()
+    logger.info(f"Saved {saved} budgets for user {user_id} in {year}")
+    return saved
+
+
+def _touched_months(transactions: Iterable) -> Dict[Tuple[str, str], str]:
+    """Latest expense date per (month, category) of the given transactions"""
+    touched: Dict[Tuple[str, str], str] = {}
+    for t in transactions:
+        if not t.date or len(t.date) < 7 or not t.amount or t.amount <= 0:
+            continue
+        key = (t.date[:7], t.category or '')
+        touched[key] = max(touched.get(key, ''), t.date)
+    return touched
+
+
+def _month_budgets(user_id: int, months: Iterable[str]) -> Dict[Tuple[str, str], float]:
+    return {
+        (row.month, row.category): row.amount
+        for row in db.session.query(Budget).filter(
+            Budget.user_id == user_id,
+            Budget.month.in_(set(months))
+        ).all()
+    }
+
+
+def budget_breaches(user_id: int, transactions: Iterable) -> List[SpendingAlert]:
+    """
+    Build budget_exceeded alerts for the (month, category) pairs touched by
+    new transactions whose rollup actual now exceeds the budget. At most
+    one alert is raised per month and category.
+    """
+    touched = _touched_months(transactions)
+    if not touched:
+        return []
+
+    budgets = _month_budgets(user_id, (month for month, _ in touched))
+
+    alerts = []
+    for (month, category), last_date in sorted(touched.items()):
+        budget = budgets.get((month, category))
+        if budget is None:
+            continue
+
+        actual = spending_by_category(user_id, month, month).get(category, 0.0)
+        if actual <= budget:
+            continue
+
+        already_alerted = db.session.query(SpendingAlert.id).filter(
+            SpendingAlert.user_id == user_id,
+            SpendingAlert.alert_type == 'budget_exceeded',
+            SpendingAlert.category == category,
+            SpendingAlert.date.like(f"{month}%")
+        ).first()
+        if already_alerted:
+            continue
+
+        overrun = (actual / budget * 100) if budget > 0 else None
+        alerts.append(SpendingAlert(
+            user_id=user_id,
+            alert_type='budget_exceeded',
+            severity='high' if overrun is None or overrun >= 120 else 'medium',
+            message=f"Orçamento de {category} estourado em {month}: "
+                    f"R$ {actual:.2f} de R$ {budget:.2f}",
+            amount=round(actual, 2),
+            category=category,
+            date=last_date
+        ))
+
+    return alerts
+
+
+def drop_resolved_breaches(user_id: int, transactions: Iterable) -> int:
+    """
+    Delete the budget_exceeded alerts of the (month, category) pairs touched
+    by removed transactions that are no longer over budget. The rollup
+    must already exclude them; the caller is responsible for committing.
+    """
+    touched = _touched_months(transactions)
+    if not touched:
+        return 0
+
+    budgets = _month_budgets(user_id, (month for month, _ in touched))
+    dropped = 0
+    for month, category in sorted(touched):
+        budget = budgets.get((month, category))
+        actual = spending_by_category(user_id, month, month).get(category, 0.0)
+        if budget is not None and actual > budget:
+            continue
+        dropped += db.session.query(SpendingAlert).filter(
+            SpendingAlert.user_id == user_id,
+            SpendingAlert.alert_type == 'budget_exceeded',
+            SpendingAlert.category == category,
+            SpendingAlert.date.like(f"{month}%")
+        ).delete(synchronize_session=False)
+
+    return dropped
@@ -0,0 +1,147 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+
+class LRUTTLCache:
+    """
+    Thread-safe LRU cache with per-entry TTL.
+
+    get/set are O(1) on an OrderedDict; expiry uses a min-heap of deadlines
+    that is drained lazily on writes, so expiring entries costs amortized
+    O(log n) instead of a full scan on every lookup.
+
+    With a `weigher` (value -> size) the cache is also bounded by the total
+    weight of its entries: LRU entries are evicted until it fits
+    `max_weight`, and a single value heavier than that is not stored.
+    """
+
+    def __init__(self, max_size: int = 500, default_ttl: Optional[float] = None,
+                 max_weight: Optional[int] = None,
+                 weigher: Optional[Callable[[Any], int]] = None):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.max_weight = max_weight
+        self.weigher = weigher
+        # key -> (value, expires_at or None, weight)
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._weight = 0
+        # (expires_at, key) deadlines; stale ones are skipped when popped
+        self._deadlines: List[tuple] = []
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0,
+                      'oversized': 0}
+
+    def _remove(self, key):
+        entry = self._data.pop(key)
+        self._weight -= entry[2]
+
+    def _expire(self, now: float):
+        """Drop entries whose deadline has passed"""
+        heap = self._deadlines
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            entry = self._data.get(key)
+            # The key may have been overwritten with a later deadline
+            if entry is not None and entry[1] == expires_at:
+                self._remove(key)
+                self.stats['expirations'] += 1
+
+        # Overwrites leave stale deadlines behind; rebuild once they dominate
+        if len(heap) > 2 * len(self._data) + 64:
+            self._deadlines = [
+                (entry[1], key) for key, entry in self._data.items()
+                if entry[1] is not None
+            ]
+            heapq.heapify(self._deadlines)
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return default
+
+            if entry[1] is not None and entry[1] <= now:
+                self._remove(key)
+                self.stats['expirations'] += 1
+                self.stats['misses'] += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        now = time.time()
+        ttl = ttl if ttl is not None else self.default_ttl
+        expires_at = now + ttl if ttl is not None else None
+        weight = self.weigher(value) if self.weigher is not None else 0
+
+        with self._lock:
+            self._expire(now)
+
+            if key in self._data:
+                self._remove(key)
+            if self.max_weight is not None and weight > self.max_weight:
+                self.stats['oversized'] += 1
+                return
+
+            self._data[key] = (value, expires_at, weight)
+            self._weight += weight
+            if expires_at is not None:
+                heapq.heappush(self._deadlines, (expires_at, key))
+
+            while len(self._data) > self.max_size or (
+                    self.max_weight is not None and self._weight > self.max_weight):
+                self._remove(next(iter(self._data)))
+                self.stats['evictions'] += 1
+
+    def delete(self, key) -> bool:
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._remove(key)
+            return True
+
+    def delete_where(self, predicate: Callable[[Any], bool]) -> int:
+        """Remove every entry whose key matches predicate (O(n))"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def values(self) -> List[Any]:
+        """Snapshot of the live values"""
+        now = time.time()
+        with self._lock:
+            return [
+                value for value, expires_at, _ in self._data.values()
+                if expires_at is None or expires_at > now
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._weight = 0
+            self._deadlines = []
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = self.stats.copy()
+            stats['size'] = len(self._data)
+            stats['weight'] = self._weight
+        stats['max_size'] = self.max_size
+        stats['max_weight'] = self.max_weight
+        return stats
+
+    def __contains__(self, key) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and (entry[1] is None or entry[1] > time.time())
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,68 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import func
+
+from .models import db, ConversationMessage
+from .smart_query_generator import QUERY_PATTERNS
+
+logger = logging.getLogger(__name__)
+
+# Most asked questions (across users) warmed after each upload
+WARM_TOP_N = int(os.getenv('JULIUS_WARM_TOP_N', 10))
+WARM_LOOKBACK_DAYS = 30
+# Longer messages are conversation, not recurring questions
+MAX_QUESTION_LENGTH = 200
+# Periods each pattern question is warmed with: most questions name one
+WARM_PERIODS = ['', 'este mês', 'mês passado']
+# Optimization levels whose caches are warmed (comma separated)
+WARM_LEVELS = [level.strip() for level in
+               os.getenv('JULIUS_WARM_LEVELS', 'aggressive').split(',') if level.strip()]
+
+
+def frequent_questions(limit: int = WARM_TOP_N, days: int = WARM_LOOKBACK_DAYS) -> List[str]:
+    """The questions users asked most in the last days"""
+    since = datetime.utcnow() - timedelta(days=days)
+    asked = func.count(ConversationMessage.id)
+    rows = db.session.query(
+        ConversationMessage.content, asked
+    ).filter(
+        ConversationMessage.message_type == 'user',
+        ConversationMessage.created_at >= since,
+        func.length(ConversationMessage.content) <= MAX_QUESTION_LENGTH
+    ).group_by(ConversationMessage.content).order_by(
+        asked.desc()).limit(limit).all()
+    return [content for content, _ in rows]
+
+
+def pattern_questions() -> List[str]:
+    """
+    The first keyword of each built-in pattern, alone and with the common
+    periods. Other phrasings ("Quais foram meus maiores gastos?") reach
+    these answers through the semantic cache.
+    """
+    return [f"{config['keywords'][0]} {period}".strip()
+            for config in QUERY_PATTERNS.values() if config.get('keywords')
+            for period in WARM_PERIODS]
+
+
+def warm_user_caches(user_id, levels: Optional[List[str]] = None,
+                     limit: int = WARM_TOP_N) -> int:
+    """
+    Answer the frequent and canonical questions for a user whose data just
+    changed, so the first questions after an upload are cache hits. Only
+    pattern questions are warmed: no LLM call is made.
+    """
+    from .julius_pool import julius_pool
+
+    questions = frequent_questions(limit) + pattern_questions()
+    warmed = 0
+    for level in levels or WARM_LEVELS:
+        # Also rebuilds the pooled instance dropped by the julius_pool stage
+        ai = julius_pool.get(user_id, level)
+        warmed += ai.warm_cache(questions)
+
+    logger.info(f"Warmed {warmed} Julius answers for user {user_id}")
+    return warmed
@@ -0,0 +1,308 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from flask import current_app, has_app_context
+
+from .models import db, ConversationSession, ConversationMessage
+from .prompt_registry import get_text_prompt
+
+logger = logging.getLogger(__name__)
+
+# Recent turns sent verbatim to the agent, within this many tokens
+CONTEXT_TURNS = int(os.getenv('JULIUS_CONTEXT_TURNS', 3))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('JULIUS_CONTEXT_TOKEN_BUDGET', 600))
+SUMMARY_MAX_WORDS = 120
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), no tokenizer download"""
+    return len(text) // 4 + 1
+
+
+class ConversationMemory:
+    """
+    Conversation persistence for one user/session.
+
+    Kept separate from JuliusAI so history and clear requests never need
+    to build the agent, vector store or LLM clients. One instance serves
+    one request: the session is resolved once, and staged messages are
+    written together by flush().
+    """
+
+    def __init__(self, user_id, session_id: Optional[str] = None,
+                 optimization_level: Optional[str] = None):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.optimization_level = optimization_level
+        self._session_resolved = False
+        self._pending: List[Dict[str, Any]] = []
+        self.summary: Optional[str] = None
+
+    def get_or_create_session(self) -> str:
+        """Get or create active conversation session for user"""
+        if not self._session_resolved:
+            self.session_id = self._resolve_session()
+            self._session_resolved = True
+        return self.session_id
+
+    def _resolve_session(self) -> str:
+        if self.session_id:
+            # Check if provided session exists and is active
+            session = ConversationSession.query.filter_by(
+                session_id=self.session_id,
+                user_id=self.user_id,
+                is_active=True
+            ).first()
+            if session:
+                self.summary = session.summary
+                return self.session_id
+
+        # Create new session or get existing active one
+        active_session = ConversationSession.query.filter_by(
+            user_id=self.user_id,
+            is_active=True
+        ).first()
+
+        if active_session:
+            self.summary = active_session.summary
+            return active_session.session_id
+
+        # Create new session
+        new_session_id = str(uuid.uuid4())
+        new_session = ConversationSession(
+            user_id=self.user_id,
+            session_id=new_session_id,
+            is_active=True
+        )
+        db.session.add(new_session)
+        db.session.commit()
+
+        return new_session_id
+
+    def get_history(self, limit: int = 10, include_staged: bool = True) -> List[Dict[str, Any]]:
+        """Get recent conversation history for context"""
+        history = []
+        if self.session_id:
+            # Only the columns we return, walking idx_session_created
+            rows = db.session.query(
+                ConversationMessage.id,
+                ConversationMessage.message_type,
+                ConversationMessage.content,
+                ConversationMessage.created_at,
+                ConversationMessage.query_type,
+                ConversationMessage.optimization_level,
+                ConversationMessage.response_time_ms,
+                ConversationMessage.cost_estimate
+            ).filter(
+                ConversationMessage.session_id == self.session_id
+            ).order_by(ConversationMessage.created_at.desc(),
+                       ConversationMessage.id.desc()).limit(limit * 2).all()
+
+            # Return in chronological order (oldest first)
+            for row in reversed(rows):
+                message = row._asdict()
+                message['created_at'] = row.created_at.isoformat()
+                history.append(message)
+
+        if include_staged:
+            history.extend(
+                {**{k: v for k, v in message.items() if k != 'usage'}, 'id': None}
+                for message in self._pending)
+        return history[-(limit * 2):]
+
+    def build_context(self, turns: int = CONTEXT_TURNS,
+                      token_budget: int = CONTEXT_TOKEN_BUDGET) -> Optional[str]:
+        """
+        Conversation context for the agent: the rolling session summary plus
+        the most recent turns that fit in the token budget. Staged messages
+        (the question being answered) are left out.
+        """
+        self.get_or_create_session()
+        recent = self.get_history(limit=turns, include_staged=False)
+
+        parts = []
+        budget = token_budget
+        if self.summary:
+            parts.append(f"Resumo da conversa: {self.summary}")
+            budget -= estimate_tokens(parts[0])
+
+        lines = []
+        for message in reversed(recent):
+            if budget <= 0:
+                break
+            speaker = "Usuário" if message['message_type'] == 'user' else "Julius"
+            line = f"{speaker}: {message['content']}"
+            cost = estimate_tokens(line)
+            if cost > budget:
+                if lines:
+                    break
+                # Always keep the last message, cut to what fits
+                line = line[:budget * 4].rstrip() + "…"
+                cost = budget
+            lines.append(line)
+            budget -= cost
+
+        if lines:
+            parts.append("Mensagens recentes:\n" + "\n".join(reversed(lines)))
+        return "\n\n".join(parts) or None
+
+    def stage_message(self, message_type: str, content: str,
+                      query_type: str = None, response_time_ms: int = None,
+                      cost_estimate: float = None, usage: Optional[Dict[str, Any]] = None):
+        """Queue a message for the next flush()"""
+        self._pending.append({
+            'usage': usage or {},
+            'message_type': message_type,  # 'user' or 'assistant'
+            'content': content,
+            'created_at': datetime.utcnow().isoformat(),
+            'query_type': query_type,
+            'optimization_level': self.optimization_level,
+            'response_time_ms': response_time_ms,
+            'cost_estimate': cost_estimate
+        })
+
+    def flush(self):
+        """Write staged messages in one transaction"""
+        if not self._pending:
+            return
+        session_id = self.get_or_create_session()
+
+        db.session.add_all([
+            ConversationMessage(
+                session_id=session_id,
+                message_type=message['message_type'],
+                content=message['content'],
+                query_type=message['query_type'],
+                optimization_level=message['optimization_level'],
+                response_time_ms=message['response_time_ms'],
+                cost_estimate=message['cost_estimate'],
+                prompt_tokens=message['usage'].get('prompt_tokens'),
+                completion_tokens=message['usage'].get('completion_tokens'),
+                llm_calls=message['usage'].get('llm_calls'),
+                model_name=message['usage'].get('model_name'),
+                tool_latency_ms=json.dumps(message['usage']['tool_latency_ms'])
+                if message['usage'].get('tool_latency_ms') else None
+            )
+            for message in self._pending
+        ])
+        db.session.commit()
+        self._pending = []
+
+    def save_message(self, message_type: str, content: str,
+                     query_type: str = None, response_time_ms: int = None,
+                     cost_estimate: float = None, usage: Optional[Dict[str, Any]] = None):
+        """Save message to conversation history (with any staged ones)"""
+        self.stage_message(message_type, content, query_type,
+                           response_time_ms, cost_estimate, usage)
+        self.flush()
+
+    def clear(self) -> bool:
+        """Clear current conversation and start fresh"""
+        if self.session_id:
+            session = ConversationSession.query.filter_by(
+                session_id=self.session_id,
+                user_id=self.user_id
+            ).first()
+
+            if session:
+                session.is_active = False
+                db.session.commit()
+                self.session_id = None
+                self._session_resolved = False
+                self._pending = []
+                self.summary = None
+                return True
+
+        return False
+
+
+class ConversationSummarizer:
+    """
+    Keeps ConversationSession.summary rolling: after each turn, messages
+    older than the last few turns and not yet summarized are folded into
+    the summary by the LLM, off the request thread.
+    """
+
+    def __init__(self, keep_turns: int = CONTEXT_TURNS, min_batch_turns: int = 2,
+                 max_workers: int = 2, enabled: bool = True):
+        self.keep_turns = keep_turns
+        self.min_batch_turns = min_batch_turns
+        self.enabled = enabled
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='julius-summary')
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, session_id: str, llm):
+        """Update the summary in the background (skipped if one is already running)"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if session_id in self._running:
+                return None
+            self._running.add(session_id)
+
+        app = current_app._get_current_object() if has_app_context() else None
+
+        def run():
+            try:
+                if app is not None:
+                    with app.app_context():
+                        self.update(session_id, llm)
+                else:
+                    self.update(session_id, llm)
+            except Exception as e:
+                logger.error(f"Conversation summary failed for session {session_id}: {e}")
+            finally:
+                with self._lock:
+                    self._running.discard(session_id)
+
+        return self._executor.submit(run)
+
+    def update(self, session_id: str, llm) -> bool:
+        """Fold unsummarized messages outside the recent window into the summary"""
+        session = ConversationSession.query.filter_by(session_id=session_id).first()
+        if session is None:
+            return False
+
+        query = ConversationMessage.query.filter(
+            ConversationMessage.session_id == session_id)
+        if session.summary_message_id:
+            query = query.filter(ConversationMessage.id > session.summary_message_id)
+        messages = query.order_by(ConversationMessage.id).all()
+
+        # The last turns still go to the agent verbatim; fold the rest a few
+        # turns at a time rather than one LLM call per turn
+        messages = messages[:-(self.keep_turns * 2)] if self.keep_turns else messages
+        if not messages or len(messages) < self.min_batch_turns * 2:
+            return False
+
+        formatted = "\n".join(
+            f"{'Usuário' if m.message_type == 'user' else 'Julius'}: {m.content}"
+            for m in messages)
+        prompt = get_text_prompt("conversation_summary").format(
+            summary=session.summary or "(vazio)",
+            messages=formatted,
+            max_words=SUMMARY_MAX_WORDS)
+
+        result = llm.invoke(prompt)
+        summary = getattr(result, 'content', str(result)).strip()
+        if not summary:
+            return False
+
+        session.summary = ' '.join(summary.split()[:SUMMARY_MAX_WORDS * 2])
+        session.summary_message_id = messages[-1].id
+        db.session.commit()
+        logger.info(
+            f"Conversation summary updated for session {session_id} ({len(messages)} messages)")
+        return True
+
+
+conversation_summarizer = ConversationSummarizer(
+    enabled=os.getenv('JULIUS_CONVERSATION_SUMMARY', 'true').lower() == 'true')
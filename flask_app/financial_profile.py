@@ -0,0 +1,234 @@
+import json
+import logging
+import re
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func
+
+from .models import (db, Card, PDFExtractable, SpendingRollup, Transaction,
+                     UserFinancialProfile)
+from .response_cache import get_data_version
+
+logger = logging.getLogger(__name__)
+
+# Months of history summarized in the profile
+PROFILE_MONTHS = 6
+# Months used to rank categories and merchants
+RECENT_MONTHS = 3
+TOP_N = 5
+# A merchant charged in this many months with a stable amount is a subscription
+SUBSCRIPTION_MIN_MONTHS = 3
+SUBSCRIPTION_MAX_SPREAD = 0.15
+# Digest is sent with every agent question, keep it short
+MAX_DIGEST_CHARS = 1200
+
+_INSTALLMENT = re.compile(r'(\d{1,2})/(\d{1,2})')
+
+
+def _brl(value: float) -> str:
+    return f"R$ {value:.2f}"
+
+
+def _monthly_totals(user_id: int) -> Dict[str, float]:
+    rows = db.session.query(
+        SpendingRollup.month,
+        func.sum(SpendingRollup.total_amount)
+    ).filter(
+        SpendingRollup.user_id == user_id
+    ).group_by(SpendingRollup.month).order_by(
+        SpendingRollup.month.desc()).limit(PROFILE_MONTHS).all()
+    return {month: round(float(total or 0), 2) for month, total in reversed(rows)}
+
+
+def _top(user_id: int, column, since_month: str) -> List[Dict[str, Any]]:
+    rows = db.session.query(
+        column,
+        func.sum(SpendingRollup.total_amount),
+        func.sum(SpendingRollup.transaction_count)
+    ).filter(
+        SpendingRollup.user_id == user_id,
+        SpendingRollup.month >= since_month,
+        column != ''
+    ).group_by(column).order_by(
+        func.sum(SpendingRollup.total_amount).desc()).limit(TOP_N).all()
+    return [{'name': name, 'total': round(float(total or 0), 2), 'count': int(count or 0)}
+            for name, total, count in rows]
+
+
+def _subscriptions(user_id: int, months: List[str]) -> List[Dict[str, Any]]:
+    """Merchants charged about the same amount, about once, in most months"""
+    rows = db.session.query(
+        SpendingRollup.merchant,
+        SpendingRollup.month,
+        func.sum(SpendingRollup.total_amount),
+        func.sum(SpendingRollup.transaction_count)
+    ).filter(
+        SpendingRollup.user_id == user_id,
+        SpendingRollup.month.in_(months),
+        SpendingRollup.merchant != ''
+    ).group_by(SpendingRollup.merchant, SpendingRollup.month).all()
+
+    by_merchant = defaultdict(list)
+    for merchant, _, total, count in rows:
+        if count == 1 and total and total > 0:
+            by_merchant[merchant].append(float(total))
+
+    subscriptions = []
+    for merchant, amounts in by_merchant.items():
+        if len(amounts) < SUBSCRIPTION_MIN_MONTHS:
+            continue
+        average = sum(amounts) / len(amounts)
+        if (max(amounts) - min(amounts)) / average <= SUBSCRIPTION_MAX_SPREAD:
+            subscriptions.append({'merchant': merchant, 'monthly': round(average, 2),
+                                  'months': len(amounts)})
+    return sorted(subscriptions, key=lambda s: s['monthly'], reverse=True)
+
+
+def _installments(user_id: int) -> List[Dict[str, Any]]:
+    """Open installment plans, from the latest installment seen of each purchase"""
+    rows = db.session.query(
+        Transaction.description,
+        Transaction.merchant,
+        Transaction.amount,
+        Transaction.installment_info
+    ).join(
+        PDFExtractable, Transaction.pdf_id == PDFExtractable.id
+    ).join(
+        Card, PDFExtractable.card_id == Card.id
+    ).filter(
+        Card.user_id == user_id,
+        Transaction.is_installment.is_(True),
+        Transaction.installment_info.isnot(None)
+    ).all()
+
+    plans = {}
+    for description, merchant, amount, info in rows:
+        match = _INSTALLMENT.search(info or '')
+        if not match:
+            continue
+        current, total = int(match.group(1)), int(match.group(2))
+        name = merchant or _INSTALLMENT.sub('', description).strip()
+        key = (name.lower(), total, round(float(amount), 2))
+        if key not in plans or plans[key]['current'] < current:
+            plans[key] = {'name': name, 'amount': round(float(amount), 2),
+                          'current': current, 'total': total}
+
+    open_plans = []
+    for plan in plans.values():
+        remaining = plan['total'] - plan['current']
+        if remaining > 0:
+            plan['remaining'] = remaining
+            plan['remaining_amount'] = round(plan['amount'] * remaining, 2)
+            open_plans.append(plan)
+    return sorted(open_plans, key=lambda p: p['remaining_amount'], reverse=True)
+
+
+def _cards(user_id: int) -> List[Dict[str, Any]]:
+    cards = db.session.query(Card).filter(Card.user_id == user_id).all()
+    return [{
+        'name': card.name or card.brand or f"final {card.number[-4:]}",
+        'available_limit': card.available_limit,
+        'used_limit': card.used_limit
+    } for card in cards]
+
+
+def build_profile(user_id: int) -> Dict[str, Any]:
+    """Aggregate facts about the user's finances, from the rollup and cards"""
+    monthly = _monthly_totals(user_id)
+    months = list(monthly)
+    recent_since = months[-RECENT_MONTHS] if len(months) >= RECENT_MONTHS else (
+        months[0] if months else '')
+
+    return {
+        'monthly_totals': monthly,
+        'top_categories': _top(user_id, SpendingRollup.category, recent_since),
+        'top_merchants': _top(user_id, SpendingRollup.merchant, recent_since),
+        'subscriptions': _subscriptions(user_id, months),
+        'installments': _installments(user_id),
+        'cards': _cards(user_id)
+    }
+
+
+def render_digest(profile: Dict[str, Any]) -> str:
+    """Short Portuguese digest of a profile, for the agent context"""
+    lines = []
+
+    monthly = profile.get('monthly_totals') or {}
+    if monthly:
+        lines.append("Gastos mensais: " + ", ".join(
+            f"{month} {_brl(total)}" for month, total in monthly.items()))
+
+    if profile.get('top_categories'):
+        lines.append(f"Principais categorias (últimos {RECENT_MONTHS} meses): " + ", ".join(
+            f"{c['name']} {_brl(c['total'])}" for c in profile['top_categories']))
+
+    if profile.get('top_merchants'):
+        lines.append(f"Principais estabelecimentos (últimos {RECENT_MONTHS} meses): " + ", ".join(
+            f"{m['name']} {_brl(m['total'])} ({m['count']}x)" for m in profile['top_merchants']))
+
+    if profile.get('subscriptions'):
+        lines.append("Assinaturas recorrentes: " + ", ".join(
+            f"{s['merchant']} {_brl(s['monthly'])}/mês" for s in profile['subscriptions']))
+
+    if profile.get('installments'):
+        total = sum(p['remaining_amount'] for p in profile['installments'])
+        lines.append(f"Parcelamentos em aberto ({_brl(total)} a pagar): " + ", ".join(
+            f"{p['name']} {p['current']}/{p['total']} de {_brl(p['amount'])}"
+            for p in profile['installments']))
+
+    for card in profile.get('cards') or []:
+        limits = []
+        if card.get('used_limit') is not None:
+            limits.append(f"usado {_brl(card['used_limit'])}")
+        if card.get('available_limit') is not None:
+            limits.append(f"disponível {_brl(card['available_limit'])}")
+        if limits:
+            lines.append(f"Cartão {card['name']}: limite " + ", ".join(limits))
+
+    digest = "\n".join(lines)
+    if len(digest) > MAX_DIGEST_CHARS:
+        digest = digest[:MAX_DIGEST_CHARS].rsplit("\n", 1)[0]
+    return digest
+
+
+def refresh_profile(user_id: int) -> UserFinancialProfile:
+    """Rebuild and store the user's profile for the current data version"""
+    profile = build_profile(user_id)
+    row = db.session.query(UserFinancialProfile).filter(
+        UserFinancialProfile.user_id == user_id).first()
+    if row is None:
+        row = UserFinancialProfile(user_id=user_id)
+        db.session.add(row)
+
+    row.profile_json = json.dumps(profile, ensure_ascii=False)
+    row.digest = render_digest(profile)
+    row.data_version = get_data_version(user_id)
+    db.session.commit()
+
+    logger.info(f"Financial profile refreshed for user {user_id} ({len(row.digest)} chars)")
+    return row
+
+
+def get_profile_digest(user_id: int, data_version: Optional[int] = None) -> str:
+    """
+    Stored digest for the user, rebuilt when the data changed since it was
+    generated (e.g. a statement was deleted). Empty string without data.
+    """
+    if data_version is None:
+        data_version = get_data_version(user_id)
+
+    row = db.session.query(
+        UserFinancialProfile.digest,
+        UserFinancialProfile.data_version
+    ).filter(UserFinancialProfile.user_id == user_id).first()
+    if row is not None and row.data_version == data_version:
+        return row.digest or ''
+
+    try:
+        return refresh_profile(user_id).digest or ''
+    except Exception as e:
+        # e.g. a concurrent request inserted the profile first
+        db.session.rollback()
+        logger.warning(f"Financial profile refresh failed for user {user_id}: {e}")
+        return (row.digest or '') if row is not None else ''
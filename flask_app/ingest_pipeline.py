@@ -0,0 +1,74 @@
+import logging
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from .models import db
+
+logger = logging.getLogger(__name__)
+
+# Stages run in registration order after a statement has been committed
+_POST_INGEST_STAGES: List[Tuple[str, Callable]] = []
+
+
+def post_ingest_stage(name: str):
+    """Register a function as a post-ingest stage"""
+    def decorator(func):
+        _POST_INGEST_STAGES.append((name, func))
+        return func
+    return decorator
+
+
+def run_post_ingest(user_id: int, pdf_id: int, transactions: List) -> Dict[str, Any]:
+    """
+    Run every post-ingest stage for a freshly committed statement.
+
+    A failing stage is logged and skipped so it never fails the upload
+    that has already been persisted; its session changes are rolled back
+    so the next stages start from a usable session.
+    """
+    results = {}
+    for name, stage in _POST_INGEST_STAGES:
+        start_time = time.time()
+        try:
+            results[name] = stage(user_id, pdf_id, transactions)
+            logger.info(
+                f"Post-ingest stage '{name}' finished for user {user_id} in {time.time() - start_time:.2f}s")
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(
+                f"Post-ingest stage '{name}' failed for user {user_id}: {str(e)}")
+            results[name] = None
+    return results
+
+
+@post_ingest_stage('embeddings')
+def _update_embeddings(user_id, pdf_id, transactions):
+    from .julius_ai import update_embeddings_for_user
+    return update_embeddings_for_user(user_id, pdf_id)
+
+
+@post_ingest_stage('julius_pool')
+def _invalidate_julius(user_id, pdf_id, transactions):
+    # Pooled agents hold the old FAISS index in memory. Right after the
+    # embeddings: the profile and warmed caches use the new data version
+    from .julius_pool import invalidate_user
+    return invalidate_user(user_id)
+
+
+@post_ingest_stage('alerts')
+def _evaluate_alerts(user_id, pdf_id, transactions):
+    from .alert_engine import evaluate_new_transactions
+    return len(evaluate_new_transactions(user_id, transactions))
+
+
+@post_ingest_stage('financial_profile')
+def _refresh_financial_profile(user_id, pdf_id, transactions):
+    from .financial_profile import refresh_profile
+    return len(refresh_profile(user_id).digest or '')
+
+
+@post_ingest_stage('cache_warming')
+def _warm_julius_caches(user_id, pdf_id, transactions):
+    # After julius_pool: warms a fresh instance on the new data version
+    from .cache_warming import warm_user_caches
+    return warm_user_caches(user_id)
@@ -0,0 +1,178 @@
+import logging
+import unicodedata
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Below this confidence the question escalates instead of running a pattern
+MIN_INTENT_CONFIDENCE = 0.6
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, strip accents and collapse whitespace"""
+    text = unicodedata.normalize('NFD', text.lower())
+    text = ''.join(c for c in text if unicodedata.category(c) != 'Mn')
+    return ' '.join(text.split())
+
+
+class AhoCorasick:
+    """Multi-keyword automaton: finds every keyword in one pass over the text"""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, Any]]] = [[]]
+
+    def add(self, keyword: str, payload: Any):
+        state = 0
+        for char in keyword:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._out[state].append((len(keyword), payload))
+
+    def build(self):
+        """Compute failure links breadth-first (root children fail to root)"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                if state:
+                    self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find_all(self, text: str) -> List[Tuple[int, int, Any]]:
+        """Return (start, end, payload) for every keyword occurrence"""
+        matches = []
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, payload in self._out[state]:
+                matches.append((i - length + 1, i + 1, payload))
+        return matches
+
+
+@dataclass
+class IntentMatch:
+    intent: str
+    score: float
+    confidence: float
+    keywords: List[str] = field(default_factory=list)
+    period: Optional[str] = None
+
+
+class IntentMatcher:
+    """
+    Scored intent selection over the smart query patterns.
+
+    Every pattern keyword and period term is compiled into one Aho-Corasick
+    automaton. Matches contained in a longer match are dropped ("ultimas
+    transacoes" does not also count as "transacoes"), each intent scores the
+    words of its keywords times its weight plus slot bonuses, and the
+    confidence drops when the runner-up is close or when a category in the
+    question can't be honoured by the chosen pattern.
+    """
+
+    def __init__(self, patterns: Dict[str, Dict], period_terms: Dict[str, str]):
+        self.patterns = patterns
+        self._automaton = AhoCorasick()
+
+        for name, config in patterns.items():
+            weight = config.get("weight", 1.0)
+            for keyword in config["keywords"]:
+                keyword = normalize_text(keyword)
+                self._automaton.add(
+                    keyword, ('intent', name, keyword, len(keyword.split()) * weight))
+
+        for term, period in period_terms.items():
+            self._automaton.add(normalize_text(term), ('period', period))
+
+        self._automaton.build()
+
+    @staticmethod
+    def _on_word_boundary(text: str, start: int, end: int) -> bool:
+        return ((start == 0 or not text[start - 1].isalnum()) and
+                (end == len(text) or not text[end].isalnum()))
+
+    def _find(self, text: str) -> List[Tuple[int, int, Any]]:
+        matches = [m for m in self._automaton.find_all(text)
+                   if self._on_word_boundary(text, m[0], m[1])]
+
+        # A keyword cut by a period term loses to it
+        # ("compras do mes passado" is not "compras do mes")
+        periods = [m for m in matches if m[2][0] == 'period']
+        matches = [
+            m for m in matches
+            if m[2][0] == 'period' or not any(
+                o[0] < m[1] and m[0] < o[1] and not (m[0] <= o[0] and o[1] <= m[1])
+                for o in periods)
+        ]
+
+        # Keep only maximal matches
+        return [
+            m for m in matches
+            if not any(o[0] <= m[0] and m[1] <= o[1] and
+                       (o[1] - o[0]) > (m[1] - m[0]) for o in matches)
+        ]
+
+    def match(self, question: str, amount: Optional[float] = None) -> Optional[IntentMatch]:
+        """Return the best intent for a question, or None if no keyword matched"""
+        text = normalize_text(question)
+
+        scores: Dict[str, float] = {}
+        keywords: Dict[str, List[str]] = {}
+        period = None
+        for _, _, payload in self._find(text):
+            if payload[0] == 'period':
+                period = period or payload[1]
+                continue
+            _, name, keyword, weight = payload
+            scores[name] = scores.get(name, 0.0) + weight
+            keywords.setdefault(name, []).append(keyword)
+
+        if not scores:
+            return None
+
+        slots = {'amount': amount is not None, 'period': period is not None}
+        for name in list(scores):
+            config = self.patterns[name]
+            for slot, bonus in config.get("slot_bonus", {}).items():
+                if slots.get(slot):
+                    scores[name] += bonus
+            for slot in config.get("requires", []):
+                if not slots.get(slot):
+                    scores[name] *= 0.5
+
+        # Category patterns also answer the generic lists they subsume
+        # ("maiores gastos com delivery" is gastos_delivery)
+        for name in list(scores):
+            for subsumed in self.patterns[name].get("subsumes", []):
+                if subsumed in scores and name in scores:
+                    scores[name] += scores.pop(subsumed)
+                    keywords[name] += keywords.pop(subsumed)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        intent, best = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        confidence = best / (best + runner_up)
+
+        config = self.patterns[intent]
+        has_category = any(
+            "category" in self.patterns[name].get("slots", []) for name in scores)
+        if has_category and "category" not in config.get("slots", []):
+            # e.g. "quanto gastei com uber" must not sum every category
+            confidence *= 0.5
+
+        return IntentMatch(intent=intent, score=best, confidence=confidence,
+                           keywords=keywords[intent], period=period)
@@ -1,14 +1,14 @@
-import os
 import json
 import logging
+import os
 import time
 import hashlib
+import queue
+import threading
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Iterator, Optional, List
 
-from langchain_openai import ChatOpenAI
-from langchain import hub
-from langchain.agents import Tool, AgentExecutor, create_structured_chat_agent
+from flask import current_app, has_app_context
 from langchain.chains import RetrievalQA
 from langchain.tools import StructuredTool
 from pydantic import BaseModel, Field
@@ -16,70 +16,31 @@ from pydantic import BaseModel, Field
 from .vector_store import FinancialVectorStore
 from .query_executor import FinancialQueryExecutor
 from .smart_query_generator import BrazilianFinancialQueryGenerator
+from .conversation_memory import ConversationMemory, conversation_summarizer
+from .prompt_registry import get_chat_prompt, get_text_prompt
+from .response_cache import response_cache, get_data_version
+from .semantic_cache import semantic_cache
+from .sql_result_cache import sql_result_cache
+from .julius_streaming import StreamingEventHandler
+from .julius_router import FunctionCallingRouter
+from .llm_limits import (CircuitOpenError, llm_breaker, llm_deadline, llm_flight,
+                         llm_limiter)
+from .llm_providers import LLMProvider, get_provider
+from .julius_metrics import UsageCallbackHandler
+from .financial_profile import get_profile_digest
 
 
 logger = logging.getLogger(__name__)
 
+# Seconds an /ask may spend before Julius gives up on the LLM and answers
+# in degraded (pattern/profile only) mode
+LATENCY_BUDGET = float(os.getenv('JULIUS_LATENCY_BUDGET', 20))
 
-class InMemoryCache:
-    """Simple in-memory cache for Julius AI responses"""
 
-    def __init__(self, max_size: int = 500, default_ttl: int = 1800):
-        self.cache = {}
-        self.access_times = {}
-        self.max_size = max_size
-        self.default_ttl = default_ttl
-
-    def _cleanup_expired(self):
-        """Remove expired items"""
-        current_time = time.time()
-        expired_keys = [
-            key for key, item in self.cache.items()
-            if current_time > item['expires']
-        ]
-        for key in expired_keys:
-            del self.cache[key]
-            self.access_times.pop(key, None)
-
-    def _evict_lru(self):
-        """Evict least recently used items if cache is full"""
-        if len(self.cache) >= self.max_size:
-            # Remove 20% of least recently used items
-            sorted_keys = sorted(self.access_times.items(), key=lambda x: x[1])
-            keys_to_remove = [
-                k for k, _ in sorted_keys[:int(self.max_size * 0.2)]]
-            for key in keys_to_remove:
-                self.cache.pop(key, None)
-                self.access_times.pop(key, None)
-
-    def get(self, key: str) -> Optional[Dict]:
-        """Get cached item"""
-        self._cleanup_expired()
-
-        if key in self.cache:
-            current_time = time.time()
-            if current_time <= self.cache[key]['expires']:
-                self.access_times[key] = current_time
-                return self.cache[key]['data']
-            else:
-                del self.cache[key]
-                self.access_times.pop(key, None)
-        return None
-
-    def set(self, key: str, value: Dict, ttl: Optional[int] = None):
-        """Set cached item"""
-        self._cleanup_expired()
-        self._evict_lru()
-
-        ttl = ttl or self.default_ttl
-        current_time = time.time()
-
-        self.cache[key] = {
-            'data': value,
-            'expires': current_time + ttl,
-            'created': current_time
-        }
-        self.access_times[key] = current_time
+def get_shared_llm(model: str, temperature: float, max_tokens: int,
+                   provider: Optional[LLMProvider] = None):
+    """Return a process-wide chat model for the given settings"""
+    return (provider or get_provider()).chat(model, temperature, max_tokens)
 
 
 class SmartQueryInput(BaseModel):
@@ -87,6 +48,11 @@ class SmartQueryInput(BaseModel):
         description="The financial question in Portuguese. Examples: 'Quais meus maiores gastos?', 'Quanto gastei este mês?', 'Últimas transações'")
 
 
+class KnowledgeBaseInput(BaseModel):
+    query: str = Field(
+        description="Question about the user's statements (PDFs) or general financial advice, in Portuguese.")
+
+
 class FinancialQueryInput(BaseModel):
     query_type: str = Field(
         description="The type of query. Supported: 'largest_expenses', 'transactions_by_amount', 'spending_by_category', 'total_spending'.")
@@ -101,13 +67,23 @@ class FinancialQueryInput(BaseModel):
 
 
 class JuliusAI:
-    def __init__(self, user_id, optimization_level: str = "aggressive", session_id: Optional[str] = None):
+    def __init__(self, user_id, optimization_level: str = "aggressive", session_id: Optional[str] = None,
+                 provider: Optional[LLMProvider] = None):
         self.user_id = user_id
         self.optimization_level = optimization_level
         self.session_id = session_id
-
-        # Initialize cost optimization components
-        self.response_cache = InMemoryCache(max_size=500, default_ttl=1800)
+        # Chat models and embeddings (OpenAI unless JULIUS_LLM_PROVIDER says otherwise)
+        self.provider = provider or get_provider()
+
+        # Per-request state (conversation memory) for pooled instances
+        self._request = threading.local()
+
+        # Initialize cost optimization components (response cache is process-wide)
+        self.response_cache = response_cache
+        self.semantic_cache = semantic_cache
+        self.llm_flight = llm_flight
+        self.llm_breaker = llm_breaker
+        self.latency_budget = LATENCY_BUDGET
         self.cost_stats = {
             'total_queries': 0,
             'cache_hits': 0,
@@ -120,38 +96,38 @@ class JuliusAI:
         }
 
         try:
-            self.vector_store = FinancialVectorStore(user_id)
+            self.vector_store = FinancialVectorStore(
+                user_id, embeddings=self.provider.embeddings())
             self.query_executor = FinancialQueryExecutor(user_id)
 
             # Add the new smart query generator
             self.smart_query_generator = BrazilianFinancialQueryGenerator(
                 user_id,
-                self._get_session_factory()
+                self._get_session_factory(),
+                llm_factory=lambda: get_shared_llm(
+                    "gpt-3.5-turbo", temperature=0, max_tokens=300, provider=self.provider)
             )
 
             # Configure models based on optimization level
             self.models = self._configure_models()
 
             # Primary LLM (cost-optimized based on level)
-            self.llm = ChatOpenAI(
-                temperature=0,
-                model=self.models['primary'],
-                max_tokens=400,  # Cost control
-                openai_api_key=os.getenv("OPENAI_API_KEY")
-            )
+            self.llm = get_shared_llm(
+                self.models['primary'], temperature=0, max_tokens=400,
+                provider=self.provider)
 
             # Secondary LLM for complex queries (if different from primary)
             if self.models['secondary'] != self.models['primary']:
-                self.llm_complex = ChatOpenAI(
-                    temperature=0.1,
-                    model=self.models['secondary'],
-                    max_tokens=600,
-                    openai_api_key=os.getenv("OPENAI_API_KEY")
-                )
+                self.llm_complex = get_shared_llm(
+                    self.models['secondary'], temperature=0.1, max_tokens=600,
+                    provider=self.provider)
             else:
                 self.llm_complex = self.llm
 
             self.agent = self._create_agent()
+            # Same tools on the secondary model, for complex questions
+            self.agent_complex = (self._create_agent(self.llm_complex)
+                                  if self.llm_complex is not self.llm else self.agent)
         except Exception as e:
             logger.exception(f"JuliusAI initialization failed: {str(e)}")
             raise
@@ -259,19 +235,20 @@ class JuliusAI:
             logger.error(f"Error handling conversation history question: {e}")
             return "Desculpe, não consegui acessar o histórico da conversa no momento."
 
-    def _get_cache_key(self, question: str) -> str:
-        """Generate cache key for question"""
+    def _get_cache_key(self, question: str, data_version: int = 0) -> str:
+        """Generate cache key for question, level and data version"""
         normalized = self._normalize_question(question)
-        key_data = f"julius:{self.user_id}:{normalized}"
+        key_data = f"julius:{self.user_id}:{self.optimization_level}:{data_version}:{normalized}"
         return hashlib.md5(key_data.encode()).hexdigest()
 
     def _get_session_factory(self):
         """Return session factory for the smart query generator"""
         return self.query_executor._get_session
 
-    def _create_agent(self):
+    def _create_agent(self, llm=None):
         """
-        Creates a more robust agent using Pydantic schemas and modern LangChain components.
+        Single-completion router over the Julius tools (native function
+        calling with the Pydantic schemas as tool arguments).
         """
         try:
             tools = [
@@ -284,10 +261,11 @@ class JuliusAI:
                 ),
 
                 # Moderate cost document search
-                Tool(
-                    name="FinancialKnowledgeBase",
+                StructuredTool.from_function(
                     func=self._cost_aware_retrieval_qa,
-                    description="Use ONLY for questions about financial documents, PDFs, or general financial advice that SmartPortugueseQuery cannot answer. Moderate API cost."
+                    name="FinancialKnowledgeBase",
+                    description="Use ONLY for questions about financial documents, PDFs, or general financial advice that SmartPortugueseQuery cannot answer. Moderate API cost.",
+                    args_schema=KnowledgeBaseInput
                 ),
 
                 # Expensive structured query (discouraged)
@@ -299,19 +277,10 @@ class JuliusAI:
                 )
             ]
 
-            # This prompt is specifically designed for structured chat agents and contains
-            # the required 'tools' and 'tool_names' variables.
-            prompt = hub.pull("hwchase17/structured-chat-agent")
-
-            agent = create_structured_chat_agent(self.llm, tools, prompt)
+            # Compiled once per process
+            prompt = get_chat_prompt("julius_router")
 
-            return AgentExecutor(
-                agent=agent,
-                tools=tools,
-                verbose=True,
-                max_iterations=5,
-                handle_parsing_errors=True
-            )
+            return FunctionCallingRouter(llm or self.llm, tools, prompt)
 
         except Exception as e:
             logger.exception(f"Agent creation failed: {str(e)}")
@@ -340,58 +309,63 @@ class JuliusAI:
                 return self._handle_conversation_history_question(actual_question)
 
             result = self.smart_query_generator.execute_smart_query(
-                actual_question)
+                actual_question, data_version=getattr(self._request, 'data_version', None))
 
             if result.get("error"):
                 return f"Erro na consulta: {result['error']}"
 
-            data = result.get("data", [])
-            if not data:
+            if not result.get("data"):
                 return "Nenhum resultado encontrado para sua consulta."
 
             # Track pattern match success
             self.cost_stats['pattern_matches'] += 1
 
-            query_type = result.get("query_type", "list")
-            pattern_matched = result.get("pattern_matched", "unknown")
+            return self._format_smart_result(result)
 
-            # Format response based on query type
-            if query_type == "aggregation":
-                if len(data) == 1 and "total_gasto" in data[0]:
-                    row = data[0]
-                    total = row.get("total_gasto", 0)
-                    count = row.get("num_transacoes", 0)
-                    avg = row.get("gasto_medio", 0)
+        except Exception as e:
+            logger.exception(f"Enhanced smart query failed: {e}")
+            return f"Erro na consulta inteligente: {str(e)}"
 
-                    response = f"💰 Total gasto: R$ {total:.2f}\n"
-                    response += f"🔢 Transações: {count}\n"
-                    response += f"📊 Média: R$ {avg:.2f} por transação"
-                else:
-                    response = json.dumps(data, ensure_ascii=False, indent=2)
+    def _format_smart_result(self, result: Dict[str, Any]) -> str:
+        """Format the rows of a smart query for the user"""
+        data = result.get("data", [])
+        query_type = result.get("query_type", "list")
+        pattern_matched = result.get("pattern_matched", "unknown")
+
+        # Format response based on query type
+        if query_type == "aggregation":
+            if len(data) == 1 and "total_gasto" in data[0]:
+                row = data[0]
+                # SUM/AVG are NULL for a period without transactions
+                total = row.get("total_gasto") or 0
+                count = row.get("num_transacoes") or 0
+                avg = row.get("gasto_medio") or 0
+
+                response = f"💰 Total gasto: R$ {total:.2f}\n"
+                response += f"🔢 Transações: {count}\n"
+                response += f"📊 Média: R$ {avg:.2f} por transação"
             else:
-                # Handle list results with better formatting
-                response = f"📋 Encontrei {len(data)} transações:\n\n"
+                response = json.dumps(data, ensure_ascii=False, indent=2)
+        else:
+            # Handle list results with better formatting
+            response = f"📋 Encontrei {len(data)} transações:\n\n"
 
-                display_data = data[:8]  # Show top 8 for better readability
-                for i, transaction in enumerate(display_data, 1):
-                    date = transaction.get(
-                        'date_formatted', transaction.get('date', 'N/A'))
-                    # Truncate long descriptions
-                    desc = transaction.get('description', 'N/A')[:50]
-                    amount = transaction.get('amount', 0)
-                    response += f"{i}. R$ {amount:.2f} - {desc} ({date})\n"
+            display_data = data[:8]  # Show top 8 for better readability
+            for i, transaction in enumerate(display_data, 1):
+                date = transaction.get(
+                    'date_formatted', transaction.get('date', 'N/A'))
+                # Truncate long descriptions
+                desc = transaction.get('description', 'N/A')[:50]
+                amount = transaction.get('amount', 0)
+                response += f"{i}. R$ {amount:.2f} - {desc} ({date})\n"
 
-                if len(data) > 8:
-                    response += f"\n... e mais {len(data) - 8} transações."
+            if len(data) > 8:
+                response += f"\n... e mais {len(data) - 8} transações."
 
-            # Add cost optimization notice
-            response += f"\n\n✅ Consulta otimizada (padrão: {pattern_matched}) - economia de API ✅"
+        # Add cost optimization notice
+        response += f"\n\n✅ Consulta otimizada (padrão: {pattern_matched}) - economia de API ✅"
 
-            return response
-
-        except Exception as e:
-            logger.exception(f"Enhanced smart query failed: {e}")
-            return f"Erro na consulta inteligente: {str(e)}"
+        return response
 
     def _cost_aware_retrieval_qa(self, query: str):
         """Cost-aware retrieval QA with usage tracking"""
@@ -407,16 +381,11 @@ class JuliusAI:
 
             result = qa_chain.invoke({"query": query})
 
-            # Track moderate cost usage
+            # Tokens and cost of the chain are recorded by the usage callbacks
             self.cost_stats['llm_cheap_queries'] += 1
-            estimated_cost = 0.008  # Rough estimate for GPT-3.5
-            self.cost_stats['total_api_cost'] += estimated_cost
 
-            response = result.get(
+            return result.get(
                 "result", "Não encontrei resposta na base de conhecimento.")
-            response += f"\n\n💰 Custo estimado: ~${estimated_cost:.3f}"
-
-            return response
 
         except Exception as e:
             logger.exception(f"Cost-aware retrieval QA failed: {e}")
@@ -442,8 +411,6 @@ class JuliusAI:
 
             # Track expensive operation
             self.cost_stats['llm_expensive_queries'] += 1
-            estimated_cost = 0.025  # Higher cost estimate
-            self.cost_stats['total_api_cost'] += estimated_cost
 
             if isinstance(result, list):
                 if not result:
@@ -453,12 +420,12 @@ class JuliusAI:
                 response += "\n".join(
                     f"Em {t['date']}, transação '{t['description']}' custou R${t['amount']}" for t in result
                 )
-                response += f"\n\n⚠️ Consulta cara utilizada (${estimated_cost:.3f}) - considere usar SmartPortugueseQuery para economia"
+                response += "\n\n⚠️ Consulta cara utilizada - considere usar SmartPortugueseQuery para economia"
                 return response
 
             response = json.dumps(result) if isinstance(
                 result, dict) else str(result)
-            response += f"\n\n⚠️ Consulta cara utilizada (${estimated_cost:.3f})"
+            response += "\n\n⚠️ Consulta cara utilizada"
             return response
 
         except Exception as e:
@@ -475,73 +442,145 @@ class JuliusAI:
                    response_time) / total_queries
         self.cost_stats['avg_response_time'] = round(new_avg, 3)
 
-    def ask(self, question: str, use_cache: bool = True):
+    def _route_deterministic(self, question: str) -> Optional[str]:
+        """
+        Answer without the agent when a predefined pattern matches.
+        Returns None when the question needs the LLM agent.
+        """
+        if self._is_conversation_history_question(question):
+            self._set_last_query('conversation_history')
+            self._emit('route', {'query_type': 'conversation_history'})
+            return self._handle_conversation_history_question(question)
+
+        query_plan = self.smart_query_generator.match_pattern(question)
+        if query_plan is None:
+            return None
+
+        response = self._enhanced_smart_query(question)
+        if response.startswith("Erro"):
+            logger.warning(
+                f"Pattern route failed for user {self.user_id}, falling back to agent: {response}")
+            return None
+
+        query_type = f"pattern:{query_plan.get('pattern_matched', 'unknown')}"
+        self._set_last_query(query_type)
+        self._emit('route', {'query_type': query_type})
+        self._emit('tool', {'tool': 'SmartPortugueseQuery', 'output': response})
+        return response
+
+    def ask(self, question: str, use_cache: bool = True,
+            conversation_context: Optional[str] = None):
         """
         Main interface with full cost optimization pipeline
         """
         start_time = time.time()
         self.cost_stats['total_queries'] += 1
+        self._set_last_query('unknown')
+        # Tokens, cost and tool latency of this request
+        self._request.usage = UsageCallbackHandler()
+        self._request.degraded = None
+        # Looked up once, reused by the cache keys and the SQL result cache
+        self._request.data_version = data_version = get_data_version(self.user_id)
 
         try:
             # 1. Check cache first
             if use_cache:
-                cache_key = self._get_cache_key(question)
-                cached_response = self.response_cache.get(cache_key)
+                cache_key = self._get_cache_key(question, data_version)
+                cached_response = self.response_cache.get(
+                    self.user_id, cache_key)
+                query_type = 'cache'
+                if not cached_response:
+                    # Paraphrase of a question already answered on the same data
+                    cached_response = self.semantic_cache.lookup(
+                        self.user_id, self.optimization_level, data_version, question)
+                    query_type = 'semantic_cache'
                 if cached_response:
                     self.cost_stats['cache_hits'] += 1
+                    self._set_last_query(query_type)
+                    self._emit('route', {'query_type': query_type})
                     response_time = time.time() - start_time
                     self._update_avg_response_time(response_time)
 
                     return f"{cached_response['response']}\n\n🚀 Resposta em cache - economia total de custo ✅"
 
-            # 2. Classify query complexity for model selection
+            # 2. Deterministic route: pattern matches never reach the agent
+            routed_response = self._route_deterministic(question)
+            if routed_response is not None:
+                response_time = time.time() - start_time
+                self._update_avg_response_time(response_time)
+
+                if "✅" in routed_response:
+                    routed_response += f"\n\n⚡ Tempo de resposta: {response_time:.2f}s"
+                return routed_response
+
+            # 3. Classify query complexity for model selection
             complexity = self._classify_query_complexity(question)
 
-            # 3. Create context with cost optimization guidance
-            context = """Você é Julius, assistente financeiro brasileiro. SEMPRE use SmartPortugueseQuery PRIMEIRO para consultas em português. 
-            Esse tool tem custo ZERO e responde 80%+ das perguntas financeiras. Use outros tools apenas se SmartPortugueseQuery não conseguir responder."""
+            # 4. Create context with cost optimization guidance
+            context = get_text_prompt("julius_context")
+
+            # Aggregates precomputed at ingest, so analytic questions need
+            # neither retrieval nor extra tool calls
+            profile_digest = self._get_profile_digest(data_version)
+            if profile_digest:
+                context = f"{context}\n\nPerfil financeiro do usuário:\n{profile_digest}"
 
-            augmented_question = f"{context}\n\nPergunta: {question}"
+            if conversation_context:
+                augmented_question = (f"{context}\n\nContexto da conversa: {conversation_context}"
+                                      f"\n\nPergunta atual: {question}")
+            else:
+                augmented_question = f"{context}\n\nPergunta: {question}"
 
-            # 4. Process with appropriate model
+            # 5. Process with appropriate model
             if not self.agent:
                 return "Sistema não inicializado corretamente. Tente novamente."
 
-            # Use complex model only for complex queries in balanced/quality modes
-            if (complexity == "complex" and
-                self.optimization_level in ["balanced", "quality"] and
-                    hasattr(self, 'llm_complex')):
-
-                # Temporarily switch to complex model
-                original_llm = self.agent.agent.llm_chain.llm
-                self.agent.agent.llm_chain.llm = self.llm_complex
+            self._emit('route', {'query_type': 'agent', 'complexity': complexity})
 
-                response = self.agent.invoke({"input": augmented_question})
+            # What is left of the latency budget bounds the agent run
+            remaining = self.latency_budget - (time.time() - start_time)
 
-                # Restore original model
-                self.agent.agent.llm_chain.llm = original_llm
+            def run_agent():
+                return self._run_agent_guarded(augmented_question, complexity, remaining)
 
-                # Track expensive usage
-                self.cost_stats['llm_expensive_queries'] += 1
+            try:
+                if use_cache:
+                    # Identical questions already in flight (double clicks,
+                    # several tabs) wait for that run instead of starting another
+                    response, shared = self.llm_flight.do(cache_key, run_agent)
+                else:
+                    response, shared = run_agent(), False
+            except CircuitOpenError:
+                return self._degraded_answer(question, 'circuit_open')
+            except TimeoutError:
+                return self._degraded_answer(question, 'latency_budget')
+            except Exception as e:
+                logger.warning(f"Agent failed for user {self.user_id}, degrading: {e}")
+                return self._degraded_answer(question, 'llm_error')
 
+            if shared:
+                self._set_last_query('agent:coalesced')
             else:
-                # Use primary (cheaper) model
-                response = self.agent.invoke({"input": augmented_question})
-                self.cost_stats['llm_cheap_queries'] += 1
+                cost = self._request.usage.cost
+                self.cost_stats['total_api_cost'] += cost
+                self._set_last_query('agent', cost)
 
             final_response = response.get(
                 "output", "Não consegui encontrar uma resposta.")
 
-            # 5. Cache successful responses
+            # 6. Cache successful responses
             if use_cache and "erro" not in final_response.lower():
-                cache_key = self._get_cache_key(question)
-                self.response_cache.set(cache_key, {
+                cached_value = {
                     'response': final_response,
                     'timestamp': datetime.now().isoformat(),
                     'complexity': complexity
-                }, ttl=1800)  # 30 minutes cache
+                }
+                self.response_cache.set(
+                    self.user_id, cache_key, cached_value, ttl=1800)  # 30 minutes cache
+                self.semantic_cache.add(
+                    self.user_id, self.optimization_level, data_version, question, cached_value)
 
-            # 6. Update performance metrics
+            # 7. Update performance metrics
             response_time = time.time() - start_time
             self._update_avg_response_time(response_time)
 
@@ -555,6 +594,162 @@ class JuliusAI:
             logger.exception(f"Optimized ask method failed: {e}")
             return f"Desculpe, ocorreu um erro ao processar sua pergunta: {str(e)}"
 
+    def warm_cache(self, questions: List[str]) -> int:
+        """
+        Precompute the answers of pattern questions for the current data
+        version. Questions that need the agent are skipped (no LLM call).
+        """
+        data_version = get_data_version(self.user_id)
+        seen = set()
+        warmed = 0
+
+        for question in questions:
+            cache_key = self._get_cache_key(question, data_version)
+            if cache_key in seen:
+                continue
+            seen.add(cache_key)
+
+            if (self._is_conversation_history_question(question) or
+                    self.smart_query_generator.match_pattern(question) is None or
+                    self.response_cache.get(self.user_id, cache_key)):
+                continue
+
+            result = self.smart_query_generator.execute_smart_query(
+                question, data_version=data_version)
+            if result.get("error"):
+                logger.warning(f"Cache warming skipped '{question}': {result['error']}")
+                continue
+
+            response = (self._format_smart_result(result) if result.get("data")
+                        else "Nenhum resultado encontrado para sua consulta.")
+            cached_value = {
+                'response': response,
+                'timestamp': datetime.now().isoformat(),
+                'complexity': 'simple',
+                'warmed': True
+            }
+            self.response_cache.set(self.user_id, cache_key, cached_value, ttl=1800)
+            # Paraphrases of the warmed question hit as well
+            self.semantic_cache.add(
+                self.user_id, self.optimization_level, data_version, question, cached_value)
+            warmed += 1
+
+        return warmed
+
+    def _get_profile_digest(self, data_version: Optional[int] = None) -> str:
+        """The user's financial profile digest (empty when unavailable)"""
+        try:
+            return get_profile_digest(self.user_id, data_version)
+        except Exception as e:
+            logger.warning(f"Financial profile unavailable for user {self.user_id}: {e}")
+            return ''
+
+    def _run_agent_guarded(self, augmented_question: str, complexity: str,
+                           timeout: float) -> Dict[str, Any]:
+        """
+        Agent run behind the LLM circuit breaker, abandoned after `timeout`
+        seconds. Failures and timeouts count against the breaker.
+        """
+        if timeout <= 0:
+            raise TimeoutError("Latency budget spent before the agent run")
+        if not self.llm_breaker.allow():
+            raise CircuitOpenError("LLM circuit open")
+
+        try:
+            response = self._call_with_timeout(
+                lambda: self._run_agent(augmented_question, complexity), timeout)
+        except Exception:
+            self.llm_breaker.record_failure()
+            raise
+        self.llm_breaker.record_success()
+        return response
+
+    def _call_with_timeout(self, fn, timeout: float):
+        """
+        Run fn in a worker thread that sees this request's state, waiting at
+        most `timeout` seconds. The worker's LLM calls share that deadline
+        (queueing, HTTP timeouts, streamed responses), so a late run stops
+        at its next call instead of holding a limiter slot.
+        """
+        state = {name: getattr(self._request, name, None)
+                 for name in ('memory', 'stream', 'usage', 'data_version')}
+        app = current_app._get_current_object() if has_app_context() else None
+        outcome = queue.Queue(maxsize=1)
+        deadline = time.monotonic() + timeout
+
+        def run():
+            for name, value in state.items():
+                setattr(self._request, name, value)
+            try:
+                with llm_deadline(deadline - time.monotonic()):
+                    if app is not None:
+                        with app.app_context():
+                            outcome.put((fn(), None))
+                    else:
+                        outcome.put((fn(), None))
+            except Exception as e:
+                outcome.put((None, e))
+
+        threading.Thread(target=run, daemon=True).start()
+        try:
+            result, error = outcome.get(timeout=timeout)
+        except queue.Empty:
+            logger.warning(f"Agent run exceeded the {timeout:.1f}s latency budget")
+            raise TimeoutError(f"Agent run exceeded {timeout:.1f}s")
+        if error is not None:
+            raise error
+        return result
+
+    def _degraded_answer(self, question: str, reason: str) -> str:
+        """
+        Answer without the LLM: a best-effort predefined pattern, else the
+        precomputed financial profile. Never cached.
+        """
+        self._request.degraded = reason
+        self._emit('route', {'query_type': 'degraded', 'reason': reason})
+        notice = "⚠️ O assistente está instável no momento, respondi em modo simplificado."
+
+        try:
+            result = self.smart_query_generator.execute_pattern_only(
+                question, data_version=getattr(self._request, 'data_version', None))
+        except Exception as e:
+            logger.warning(f"Pattern-only answer failed: {e}")
+            result = None
+        if result and result.get("data"):
+            self._set_last_query('degraded:pattern')
+            return f"{notice}\n\n{self._format_smart_result(result)}"
+
+        digest = self._get_profile_digest()
+        if digest:
+            self._set_last_query('degraded:profile')
+            return f"{notice} Veja um resumo das suas finanças:\n\n{digest}"
+
+        self._set_last_query('degraded')
+        return "⚠️ O assistente está indisponível no momento. Tente novamente em instantes."
+
+    def _run_agent(self, augmented_question: str, complexity: str) -> Dict[str, Any]:
+        """Invoke the agent, on the complex model when the level allows it"""
+        agent_config = self._agent_config()
+
+        # Use complex model only for complex queries in balanced/quality modes
+        if (complexity == "complex" and
+            self.optimization_level in ["balanced", "quality"] and
+                self.agent_complex is not None):
+
+            response = self.agent_complex.invoke(
+                {"input": augmented_question}, config=agent_config)
+
+            # Track expensive usage
+            self.cost_stats['llm_expensive_queries'] += 1
+
+        else:
+            # Use primary (cheaper) model
+            response = self.agent.invoke(
+                {"input": augmented_question}, config=agent_config)
+            self.cost_stats['llm_cheap_queries'] += 1
+
+        return response
+
     def get_optimization_report(self) -> Dict[str, Any]:
         """Get comprehensive cost optimization report"""
         try:
@@ -592,7 +787,13 @@ class JuliusAI:
                 'cost_efficiency': round((cost_saved / potential_total_cost) * 100, 1) if potential_total_cost > 0 else 0,
                 'optimization_level': self.optimization_level,
                 'user_id': self.user_id,
-                'models_used': self.models
+                'models_used': self.models,
+                'response_cache': self.response_cache.get_stats(),
+                'semantic_cache': self.semantic_cache.get_stats(),
+                'sql_result_cache': sql_result_cache.get_stats(),
+                'llm_concurrency': llm_limiter.get_stats(),
+                'llm_coalescing': self.llm_flight.get_stats(),
+                'llm_breaker': self.llm_breaker.get_stats()
             })
 
             return stats
@@ -602,8 +803,10 @@ class JuliusAI:
             return {"error": str(e)}
 
     def clear_cache(self):
-        """Clear response cache"""
-        self.response_cache = InMemoryCache(max_size=500, default_ttl=1800)
+        """Clear this user's cached responses"""
+        self.response_cache.invalidate_user(self.user_id)
+        self.semantic_cache.invalidate(self.user_id)
+        sql_result_cache.clear(self.user_id)
         logger.info(f"Cache cleared for user {self.user_id}")
 
     def update_optimization_level(self, level: str):
@@ -624,134 +827,83 @@ class JuliusAI:
 
     # === Conversation Memory System ===
 
+    def _memory(self) -> ConversationMemory:
+        """Conversation memory of the request being served by this thread"""
+        memory = getattr(self._request, 'memory', None)
+        if memory is None:
+            memory = ConversationMemory(
+                self.user_id, self.session_id, self.optimization_level)
+            self._request.memory = memory
+        return memory
+
     def get_or_create_conversation_session(self) -> str:
         """Get or create active conversation session for user"""
-        from .models import db, ConversationSession
-        import uuid
-
-        if self.session_id:
-            # Check if provided session exists and is active
-            session = ConversationSession.query.filter_by(
-                session_id=self.session_id,
-                user_id=self.user_id,
-                is_active=True
-            ).first()
-            if session:
-                return self.session_id
-
-        # Create new session or get existing active one
-        active_session = ConversationSession.query.filter_by(
-            user_id=self.user_id,
-            is_active=True
-        ).first()
-
-        if active_session:
-            self.session_id = active_session.session_id
-            return self.session_id
-
-        # Create new session
-        new_session_id = str(uuid.uuid4())
-        new_session = ConversationSession(
-            user_id=self.user_id,
-            session_id=new_session_id,
-            is_active=True
-        )
-        db.session.add(new_session)
-        db.session.commit()
-
-        self.session_id = new_session_id
-        return self.session_id
+        return self._memory().get_or_create_session()
 
     def get_conversation_history(self, limit: int = 10) -> List[Dict[str, Any]]:
         """Get recent conversation history for context"""
-        from .models import ConversationMessage
-
-        if not self.session_id:
-            return []
-
-        messages = ConversationMessage.query.filter_by(
-            session_id=self.session_id
-        ).order_by(ConversationMessage.created_at.desc()).limit(limit * 2).all()
-
-        # Return in chronological order (oldest first)
-        history = []
-        for message in reversed(messages):
-            history.append({
-                'id': message.id,
-                'message_type': message.message_type,
-                'content': message.content,
-                'created_at': message.created_at.isoformat(),
-                'query_type': message.query_type,
-                'optimization_level': message.optimization_level,
-                'response_time_ms': message.response_time_ms,
-                'cost_estimate': message.cost_estimate
-            })
-
-        return history
+        return self._memory().get_history(limit=limit)
 
     def save_conversation_message(self, message_type: str, content: str,
                                   query_type: str = None, response_time_ms: int = None,
-                                  cost_estimate: float = None):
+                                  cost_estimate: float = None,
+                                  usage: Optional[Dict[str, Any]] = None):
         """Save message to conversation history"""
-        from .models import db, ConversationMessage
-
-        session_id = self.get_or_create_conversation_session()
-
-        message = ConversationMessage(
-            session_id=session_id,
-            message_type=message_type,  # 'user' or 'assistant'
-            content=content,
-            query_type=query_type,
-            optimization_level=self.optimization_level,
-            response_time_ms=response_time_ms,
-            cost_estimate=cost_estimate
-        )
-
-        db.session.add(message)
-        db.session.commit()
+        self._memory().save_message(
+            message_type, content, query_type, response_time_ms, cost_estimate, usage)
+
+    def _finish_turn(self):
+        """Write messages still staged by the request and roll the summary forward"""
+        memory = getattr(self._request, 'memory', None)
+        self._request.memory = None
+        if memory is None:
+            return
+        try:
+            memory.flush()
+        except Exception as e:
+            logger.error(f"Failed to save conversation messages: {e}")
+            return
+        if memory.session_id:
+            conversation_summarizer.schedule(memory.session_id, self.llm)
 
     def clear_conversation(self) -> bool:
         """Clear current conversation and start fresh"""
-        from .models import db, ConversationSession
-
-        if self.session_id:
-            session = ConversationSession.query.filter_by(
-                session_id=self.session_id,
-                user_id=self.user_id
-            ).first()
-
-            if session:
-                session.is_active = False
-                db.session.commit()
-                self.session_id = None
-                return True
+        return self._memory().clear()
 
-        return False
-
-    def ask_with_context(self, question: str) -> Dict[str, Any]:
+    def ask_with_context(self, question: str, session_id: Optional[str] = None) -> Dict[str, Any]:
         """Enhanced ask method with conversation context and memory"""
-        import time
-        start_time = time.time()
+        # Pooled instances serve many sessions: memory is per request
+        self._request.memory = ConversationMemory(
+            self.user_id, session_id or self.session_id, self.optimization_level)
+        try:
+            return self._ask_with_context(question)
+        finally:
+            self._finish_turn()
 
+    def _start_exchange(self, question: str):
+        """Stage the user message and return (session_id, context summary)"""
         # Ensure we have an active session
         session_id = self.get_or_create_conversation_session()
 
-        # Save user message
-        self.save_conversation_message('user', question)
+        # The user message is written with the answer, in one transaction
+        self._memory().stage_message('user', question)
 
-        # Get conversation history for context
-        history = self.get_conversation_history(limit=5)  # Last 5 exchanges
+        # Rolling summary plus the last turns, within the token budget.
+        # Conversation context only goes to the agent: cache keys and the
+        # pattern router work on the question itself
+        context_summary = self._memory().build_context()
 
-        # Build context-aware question if we have history
-        contextual_question = question
-        if len(history) > 2:  # If we have previous conversation
-            context_summary = self._build_context_summary(history)
-            contextual_question = f"Contexto da conversa: {context_summary}\n\nPergunta atual: {question}"
+        return session_id, context_summary
+
+    def _ask_with_context(self, question: str) -> Dict[str, Any]:
+        start_time = time.time()
+        session_id, context_summary = self._start_exchange(question)
 
         # Process the question
         try:
-            response = self.ask(contextual_question)
-            query_type = self._get_last_query_type()  # We'll need to track this
+            response = self.ask(
+                question, conversation_context=context_summary)
+            query_type = self._get_last_query_type()
 
             # Calculate metrics
             response_time_ms = int((time.time() - start_time) * 1000)
@@ -763,7 +915,8 @@ class JuliusAI:
                 response,
                 query_type,
                 response_time_ms,
-                cost_estimate
+                cost_estimate,
+                self._get_last_usage()
             )
 
             return {
@@ -771,7 +924,9 @@ class JuliusAI:
                 'session_id': session_id,
                 'response_time_ms': response_time_ms,
                 'query_type': query_type,
-                'optimization_level': self.optimization_level
+                'optimization_level': self.optimization_level,
+                'degraded': self._get_degraded() is not None,
+                'degraded_reason': self._get_degraded()
             }
 
         except Exception as e:
@@ -788,33 +943,120 @@ class JuliusAI:
                 'error': True
             }
 
-    def _build_context_summary(self, history: List[Dict]) -> str:
-        """Build a concise context summary from conversation history"""
-        recent_topics = []
-        for msg in history[-4:]:  # Last 2 exchanges
-            if msg['type'] == 'user':
-                # Extract key topics from user questions
-                content = msg['content'].lower()
-                if any(word in content for word in ['gasto', 'gastei', 'despesa']):
-                    recent_topics.append('gastos')
-                if any(word in content for word in ['delivery', 'entrega', 'ifood', 'uber']):
-                    recent_topics.append('delivery')
-                if any(word in content for word in ['categoria', 'tipo', 'classificação']):
-                    recent_topics.append('categorias')
-
-        if recent_topics:
-            return f"Tópicos recentes: {', '.join(set(recent_topics))}"
-        return "Continuação da conversa anterior"
+    def ask_stream(self, question: str, session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of ask_with_context.
+
+        Yields {'event', 'data'} dicts: 'session' first, then 'route'
+        decisions, 'tool_start'/'tool' results and LLM 'token's as they
+        happen, and 'done' with the final answer once it is saved.
+        """
+        self._request.memory = ConversationMemory(
+            self.user_id, session_id or self.session_id, self.optimization_level)
+        try:
+            yield from self._ask_stream(question)
+        finally:
+            # Client gone mid-stream: still keep the question
+            self._finish_turn()
+
+    def _ask_stream(self, question: str) -> Iterator[Dict[str, Any]]:
+        start_time = time.time()
+        session_id, context_summary = self._start_exchange(question)
+        yield {'event': 'session', 'data': {'session_id': session_id}}
+
+        events = queue.Queue()
+        memory = self._memory()
+        app = current_app._get_current_object() if has_app_context() else None
+        result = {}
+
+        def run():
+            # The agent runs here so its callbacks can feed the queue while
+            # the request thread streams it out
+            self._request.memory = memory
+            self._request.stream = StreamingEventHandler(events)
+            try:
+                if app is not None:
+                    with app.app_context():
+                        result['response'] = self.ask(
+                            question, conversation_context=context_summary)
+                else:
+                    result['response'] = self.ask(
+                        question, conversation_context=context_summary)
+                result['query_type'] = self._get_last_query_type()
+                result['cost'] = self._estimate_last_query_cost()
+                result['usage'] = self._get_last_usage()
+                result['degraded'] = self._get_degraded()
+            except Exception as e:
+                logger.exception(f"Error in ask_stream: {e}")
+                result['error'] = str(e)
+            finally:
+                self._request.stream = None
+                self._request.memory = None
+                events.put(None)
+
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            yield event
+        worker.join()
+
+        response_time_ms = int((time.time() - start_time) * 1000)
+        if 'error' in result:
+            response = f"Desculpe, ocorreu um erro ao processar sua pergunta: {result['error']}"
+            self.save_conversation_message('assistant', response, 'error')
+            yield {'event': 'done', 'data': {
+                'response': response, 'session_id': session_id, 'error': True}}
+            return
+
+        self.save_conversation_message(
+            'assistant', result['response'], result['query_type'],
+            response_time_ms, result['cost'], result['usage'])
+        yield {'event': 'done', 'data': {
+            'response': result['response'],
+            'session_id': session_id,
+            'response_time_ms': response_time_ms,
+            'query_type': result['query_type'],
+            'optimization_level': self.optimization_level,
+            'degraded': result['degraded'] is not None,
+            'degraded_reason': result['degraded']
+        }}
+
+    def _emit(self, event: str, data: Dict[str, Any]):
+        """Send an event to the stream of the current request, if any"""
+        handler = getattr(self._request, 'stream', None)
+        if handler is not None:
+            handler.emit(event, data)
+
+    def _agent_config(self) -> Optional[Dict[str, Any]]:
+        """Agent run config: usage accounting plus the stream handler, if any"""
+        callbacks = [getattr(self._request, name, None) for name in ('usage', 'stream')]
+        callbacks = [handler for handler in callbacks if handler is not None]
+        return {"callbacks": callbacks} if callbacks else None
+
+    def _set_last_query(self, query_type: str, cost: float = 0.0):
+        """Record how the current request was answered"""
+        self._request.last_query_type = query_type
+        self._request.last_query_cost = cost
 
     def _get_last_query_type(self) -> str:
         """Get the type of the last query executed (for tracking)"""
-        # This would need to be set during query execution
-        return getattr(self, '_last_query_type', 'unknown')
+        return getattr(self._request, 'last_query_type', 'unknown')
 
     def _estimate_last_query_cost(self) -> float:
         """Estimate cost of the last query"""
-        # This would need to be calculated during query execution
-        return getattr(self, '_last_query_cost', 0.0)
+        return getattr(self._request, 'last_query_cost', 0.0)
+
+    def _get_degraded(self) -> Optional[str]:
+        """Why the current request was answered in degraded mode (None if it wasn't)"""
+        return getattr(self._request, 'degraded', None)
+
+    def _get_last_usage(self) -> Optional[Dict[str, Any]]:
+        """Tokens, model and tool latency recorded for the last query"""
+        usage = getattr(self._request, 'usage', None)
+        return usage.summary() if usage is not None else None
 
     # Backwards compatibility
     def get_performance_stats(self) -> Dict[str, Any]:
@@ -0,0 +1,230 @@
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .models import db, ConversationSession, ConversationMessage
+
+logger = logging.getLogger(__name__)
+
+# USD per 1K tokens: (prompt, completion)
+MODEL_PRICES = {
+    'gpt-3.5-turbo': (0.0005, 0.0015),
+    'gpt-4-turbo-preview': (0.01, 0.03),
+    'gpt-4-turbo': (0.01, 0.03),
+    'gpt-4o-mini': (0.00015, 0.0006),
+    'gpt-4o': (0.0025, 0.01),
+    'text-embedding-ada-002': (0.0001, 0.0),
+}
+
+# Most recent assistant messages aggregated by /julius/metrics
+MAX_METRIC_ROWS = 5000
+# Longest window /julius/metrics accepts
+MAX_METRIC_DAYS = 90
+
+
+def price_for(model: Optional[str]):
+    """Prices of a model, matching dated names (gpt-3.5-turbo-0125) by prefix"""
+    if not model:
+        return MODEL_PRICES['gpt-3.5-turbo']
+    matches = [name for name in MODEL_PRICES if model.startswith(name)]
+    return MODEL_PRICES[max(matches, key=len)] if matches else MODEL_PRICES['gpt-3.5-turbo']
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """
+    Collects what one /ask actually used: LLM calls, prompt and completion
+    tokens per model (and their cost), and the latency of each tool.
+    """
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+        self.cost = 0.0
+        self.models: Dict[str, int] = {}
+        self.tool_latency_ms: Dict[str, int] = {}
+        self._llm_models: Dict[Any, str] = {}
+        self._tool_starts: Dict[Any, tuple] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _model_from(serialized, invocation_params) -> Optional[str]:
+        params = invocation_params or {}
+        kwargs = (serialized or {}).get('kwargs', {})
+        return (params.get('model') or params.get('model_name') or
+                kwargs.get('model') or kwargs.get('model_name'))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id=None,
+                            invocation_params=None, **kwargs: Any) -> None:
+        with self._lock:
+            self._llm_models[run_id] = self._model_from(serialized, invocation_params)
+
+    def on_llm_start(self, serialized, prompts, *, run_id=None,
+                     invocation_params=None, **kwargs: Any) -> None:
+        with self._lock:
+            self._llm_models[run_id] = self._model_from(serialized, invocation_params)
+
+    def on_llm_end(self, response, *, run_id=None, **kwargs: Any) -> None:
+        prompt_tokens = completion_tokens = 0
+        model = None
+
+        # Chat models report usage on the message (streamed or not)
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, 'message', None)
+                usage = getattr(message, 'usage_metadata', None)
+                if usage:
+                    prompt_tokens += usage.get('input_tokens', 0)
+                    completion_tokens += usage.get('output_tokens', 0)
+                if message is not None:
+                    model = model or message.response_metadata.get('model_name')
+
+        llm_output = response.llm_output or {}
+        if not prompt_tokens and not completion_tokens:
+            token_usage = llm_output.get('token_usage') or {}
+            prompt_tokens = token_usage.get('prompt_tokens', 0)
+            completion_tokens = token_usage.get('completion_tokens', 0)
+
+        with self._lock:
+            model = (model or llm_output.get('model_name') or
+                     self._llm_models.pop(run_id, None) or 'unknown')
+            prompt_price, completion_price = price_for(model)
+            self.llm_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost += (prompt_tokens * prompt_price +
+                          completion_tokens * completion_price) / 1000
+            self.models[model] = self.models.get(model, 0) + 1
+
+    def on_tool_start(self, serialized, input_str, *, run_id=None, **kwargs: Any) -> None:
+        name = (serialized or {}).get('name') or kwargs.get('name', 'unknown')
+        with self._lock:
+            self._tool_starts[run_id] = (name, time.perf_counter())
+
+    def _tool_done(self, run_id):
+        with self._lock:
+            started = self._tool_starts.pop(run_id, None)
+            if started:
+                name, start = started
+                elapsed = int((time.perf_counter() - start) * 1000)
+                self.tool_latency_ms[name] = self.tool_latency_ms.get(name, 0) + elapsed
+
+    def on_tool_end(self, output, *, run_id=None, **kwargs: Any) -> None:
+        self._tool_done(run_id)
+
+    def on_tool_error(self, error, *, run_id=None, **kwargs: Any) -> None:
+        self._tool_done(run_id)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            model = max(self.models, key=self.models.get) if self.models else None
+            return {
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'llm_calls': self.llm_calls,
+                'model_name': model,
+                'cost': round(self.cost, 8),
+                'tool_latency_ms': dict(self.tool_latency_ms)
+            }
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Linear-interpolated percentile of a list (None when empty)"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return round(values[low] + (values[high] - values[low]) * (rank - low), 2)
+
+
+def _latency_stats(values: List[float]) -> Dict[str, Any]:
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99)
+    }
+
+
+def aggregate_metrics(rows) -> Dict[str, Any]:
+    """Routing, latency, token and cost figures from assistant message rows"""
+    counts: Dict[str, int] = {}
+    latencies: Dict[str, List[float]] = {}
+    tools: Dict[str, List[float]] = {}
+    models: Dict[str, int] = {}
+    totals = {'prompt_tokens': 0, 'completion_tokens': 0, 'llm_calls': 0, 'cost': 0.0}
+
+    for row in rows:
+        query_type = row.query_type or 'unknown'
+        # pattern:<name> routes count together
+        route = 'pattern' if query_type.startswith('pattern:') else query_type
+        counts[route] = counts.get(route, 0) + 1
+        if row.response_time_ms is not None:
+            latencies.setdefault(route, []).append(row.response_time_ms)
+
+        totals['prompt_tokens'] += row.prompt_tokens or 0
+        totals['completion_tokens'] += row.completion_tokens or 0
+        totals['llm_calls'] += row.llm_calls or 0
+        totals['cost'] += row.cost_estimate or 0.0
+        if row.model_name:
+            models[row.model_name] = models.get(row.model_name, 0) + 1
+
+        if row.tool_latency_ms:
+            try:
+                for tool, elapsed in json.loads(row.tool_latency_ms).items():
+                    tools.setdefault(tool, []).append(elapsed)
+            except ValueError:
+                logger.warning(f"Invalid tool latency on message {row.id}")
+
+    total = sum(counts.values())
+    all_latencies = [value for values in latencies.values() for value in values]
+    totals['cost'] = round(totals['cost'], 8)
+
+    return {
+        'total_answers': total,
+        'routing': {
+            route: {'count': count, 'rate': round(count / total * 100, 1)}
+            for route, count in counts.items()
+        },
+        'latency_ms': _latency_stats(all_latencies),
+        'latency_ms_by_route': {route: _latency_stats(values)
+                                for route, values in latencies.items()},
+        'tool_latency_ms': {tool: _latency_stats(values) for tool, values in tools.items()},
+        'tokens': totals,
+        'avg_llm_calls': round(totals['llm_calls'] / total, 2) if total else 0.0,
+        'models': models
+    }
+
+
+def collect_metrics(user_id, days: int = 7) -> Dict[str, Any]:
+    """Aggregate the user's recent Julius answers"""
+    since = datetime.utcnow() - timedelta(days=days)
+    rows = db.session.query(
+        ConversationMessage.id,
+        ConversationMessage.query_type,
+        ConversationMessage.response_time_ms,
+        ConversationMessage.cost_estimate,
+        ConversationMessage.prompt_tokens,
+        ConversationMessage.completion_tokens,
+        ConversationMessage.llm_calls,
+        ConversationMessage.model_name,
+        ConversationMessage.tool_latency_ms
+    ).join(
+        ConversationSession,
+        ConversationSession.session_id == ConversationMessage.session_id
+    ).filter(
+        ConversationSession.user_id == user_id,
+        ConversationMessage.message_type == 'assistant',
+        ConversationMessage.created_at >= since
+    ).order_by(ConversationMessage.id.desc()).limit(MAX_METRIC_ROWS).all()
+
+    metrics = aggregate_metrics(rows)
+    metrics['days'] = days
+    return metrics
@@ -0,0 +1,141 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from .models import db
+from .response_cache import bump_data_version, get_data_version
+
+logger = logging.getLogger(__name__)
+
+
+class JuliusPool:
+    """
+    Per-process pool of JuliusAI instances keyed by user and optimization
+    level, with LRU eviction and an idle TTL.
+
+    Building a JuliusAI loads the user's FAISS index and the agent, so
+    instances are reused across requests instead of rebuilt on each one.
+    Entries remember the user's data version they were built on and are
+    rebuilt once it changes, also when another worker changed it.
+    """
+
+    def __init__(self, max_size: int = 64, idle_ttl: int = 900,
+                 factory: Optional[Callable] = None,
+                 version: Optional[Callable] = None):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._factory = factory
+        self._version = version
+        self._entries: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        # Bumped by invalidate(): builds started before it are not pooled
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _build(self, user_id, optimization_level: str):
+        if self._factory is not None:
+            return self._factory(user_id, optimization_level)
+        from .julius_ai import JuliusAI
+        return JuliusAI(user_id, optimization_level=optimization_level)
+
+    def _data_version(self, user_id) -> int:
+        if self._version is not None:
+            return self._version(user_id)
+        return get_data_version(user_id)
+
+    def _evict_idle(self, now: float):
+        """Drop entries idle for longer than the TTL (oldest first)"""
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry['last_used'] <= self.idle_ttl:
+                break
+            del self._entries[key]
+            self.stats['evictions'] += 1
+
+    def get(self, user_id, optimization_level: str = "aggressive"):
+        """Return a pooled JuliusAI, building it on first use or new data"""
+        key = (str(user_id), optimization_level)
+        version = self._data_version(user_id)
+        now = time.time()
+
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is not None and entry['data_version'] == version:
+                entry['last_used'] = now
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry['instance']
+            if entry is not None and entry['data_version'] < version:
+                # The data changed since it was built (maybe in another worker)
+                del self._entries[key]
+            self.stats['misses'] += 1
+            generation = self._generations.get(key[0], 0)
+
+        # Build outside the lock so one slow user doesn't block the others
+        instance = self._build(user_id, optimization_level)
+
+        with self._lock:
+            if self._generations.get(key[0], 0) != generation:
+                # Invalidated while building: may hold the previous index,
+                # so it serves this request only
+                return instance
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry['data_version'] == version:
+                    # Another request built it concurrently: keep the first one
+                    entry['last_used'] = now
+                    self._entries.move_to_end(key)
+                    return entry['instance']
+                if entry['data_version'] > version:
+                    return instance
+
+            self._entries[key] = {'instance': instance, 'last_used': now,
+                                  'data_version': version}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+        logger.info(
+            f"JuliusAI built for user {user_id} ({optimization_level}), pool size {len(self._entries)}")
+        return instance
+
+    def invalidate(self, user_id) -> int:
+        """Drop this process's pooled instances of a user"""
+        user_key = str(user_id)
+        with self._lock:
+            self._generations[user_key] = self._generations.get(user_key, 0) + 1
+            keys = [key for key in self._entries if key[0] == user_key]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+julius_pool = JuliusPool(
+    max_size=int(os.getenv('JULIUS_POOL_MAX_SIZE', 64)),
+    idle_ttl=int(os.getenv('JULIUS_POOL_IDLE_TTL', 900))
+)
+
+
+def invalidate_user(user_id) -> int:
+    """
+    Invalidate a user's pooled instances in every worker once their FAISS
+    index was rewritten: the data version is bumped again, so entries of
+    other processes (even built while the index was being written) no
+    longer match it, and this process drops its entries right away.
+    """
+    bump_data_version(user_id)
+    db.session.commit()
+    return julius_pool.invalidate(user_id)
@@ -0,0 +1,51 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.tools import BaseTool
+
+logger = logging.getLogger(__name__)
+
+
+class FunctionCallingRouter:
+    """
+    Julius agent in one completion: the model picks a tool through native
+    function calling, with arguments typed by the tool's Pydantic schema,
+    and the tool's templated output is the answer. A reply without a tool
+    call is the answer itself.
+
+    Same interface as an AgentExecutor: invoke({"input": ...}) returns
+    {"output": ...}.
+    """
+
+    def __init__(self, llm: BaseChatModel, tools: List[BaseTool], prompt: ChatPromptTemplate):
+        self.tools = {tool.name: tool for tool in tools}
+        # One tool per question: its output already is the formatted answer
+        self.chain = prompt | llm.bind_tools(tools, parallel_tool_calls=False)
+
+    def invoke(self, inputs: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        message = self.chain.invoke(inputs, config=config)
+
+        if not message.tool_calls:
+            return {"output": message.content or "Não consegui encontrar uma resposta.",
+                    "tool": None}
+
+        call = message.tool_calls[0]
+        tool = self.tools.get(call['name'])
+        if tool is None:
+            logger.warning(f"Router chose unknown tool: {call['name']}")
+            return {"output": message.content or "Não consegui encontrar uma resposta.",
+                    "tool": None}
+
+        logger.info(f"Router chose {call['name']} with {call['args']}")
+        try:
+            # Runs with the request callbacks: tool events and tool latency
+            output = tool.invoke(call['args'], config=config)
+        except Exception as e:
+            # Invalid arguments (pydantic) or a failing tool: an answer for
+            # the user, not an LLM outage for the circuit breaker
+            logger.warning(f"Tool {call['name']} failed with {call['args']}: {e}")
+            return {"output": "Ocorreu um erro ao consultar seus dados. Tente reformular a pergunta.",
+                    "tool": call['name']}
+        return {"output": str(getattr(output, 'content', output)), "tool": call['name']}
@@ -0,0 +1,42 @@
+import json
+import logging
+import queue
+from typing import Any, Dict, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+class StreamingEventHandler(BaseCallbackHandler):
+    """
+    LangChain callback handler that turns agent activity into stream
+    events: LLM tokens as they arrive, tool calls and tool results.
+    """
+
+    def __init__(self, events: "queue.Queue"):
+        self.events = events
+
+    def emit(self, event: str, data: Dict[str, Any]):
+        self.events.put({'event': event, 'data': data})
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if token:
+            self.emit('token', {'text': token})
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str,
+                      **kwargs: Any) -> None:
+        name = (serialized or {}).get('name') or kwargs.get('name', 'unknown')
+        self.emit('tool_start', {'tool': name, 'input': input_str})
+
+    def on_tool_end(self, output: Any, name: Optional[str] = None, **kwargs: Any) -> None:
+        content = getattr(output, 'content', output)
+        self.emit('tool', {'tool': name or 'unknown', 'output': str(content)})
+
+    def on_tool_error(self, error: BaseException, **kwargs: Any) -> None:
+        self.emit('tool', {'tool': kwargs.get('name', 'unknown'), 'error': str(error)})
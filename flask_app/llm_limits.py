@@ -0,0 +1,378 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+class LLMQueueTimeout(RuntimeError):
+    """No LLM slot became free within the queue timeout"""
+
+
+class CircuitOpenError(RuntimeError):
+    """The LLM circuit breaker is open"""
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """The calling thread's LLM deadline passed"""
+
+
+_deadline = threading.local()
+
+
+@contextmanager
+def llm_deadline(timeout: float):
+    """
+    Bound every LLM HTTP call made by this thread in the block to `timeout`
+    seconds from now: queueing for a slot, each request and streamed
+    responses all stop at the deadline.
+    """
+    previous = getattr(_deadline, 'at', None)
+    _deadline.at = time.monotonic() + timeout
+    try:
+        yield
+    finally:
+        _deadline.at = previous
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency. After `failure_threshold`
+    consecutive failures the circuit opens; once `reset_timeout` seconds
+    have passed a single trial call is let through (half-open) and its
+    outcome closes or re-opens the circuit.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self.stats = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if (self._state == self.OPEN and
+                time.monotonic() - self._opened_at >= self.reset_timeout):
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow(self) -> bool:
+        """Whether a call may go out now (claims the trial call when half-open)"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.stats['successes'] += 1
+            self._failures = 0
+            self._state = self.CLOSED
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.stats['failures'] += 1
+            self._failures += 1
+            if (self._current_state() == self.HALF_OPEN or
+                    self._failures >= self.failure_threshold):
+                if self._state != self.OPEN:
+                    self.stats['opened'] += 1
+                    logger.warning(
+                        f"LLM circuit opened after {self._failures} consecutive failures")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def reset(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = self.stats.copy()
+            stats['state'] = self._current_state()
+            stats['consecutive_failures'] = self._failures
+        return stats
+
+
+class BreakerEmbeddings(Embeddings):
+    """
+    Embeddings client behind a circuit breaker: calls fail fast with
+    CircuitOpenError while it is open, and their outcome is recorded.
+    """
+
+    def __init__(self, embeddings: Embeddings, breaker: CircuitBreaker):
+        self.embeddings = embeddings
+        self.breaker = breaker
+
+    def __getattr__(self, name):
+        # size, model, dimensions... of the wrapped client
+        if name == 'embeddings':
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def _call(self, fn, *args):
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit open")
+        try:
+            result = fn(*args)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._call(self.embeddings.embed_documents, texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._call(self.embeddings.embed_query, text)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the
+    function, callers arriving while it is in flight wait and share its
+    result (or exception). Nothing is kept once the call returns.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error: Optional[BaseException] = None
+            self.waiters = 0
+
+    def __init__(self):
+        self._calls: Dict[Any, "SingleFlight._Call"] = {}
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'coalesced': 0}
+
+    def do(self, key, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Return (result, shared); shared is True for callers that waited"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.stats['coalesced'] += 1
+                leader = False
+            else:
+                call = self._calls[key] = self._Call()
+                self.stats['calls'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = self.stats.copy()
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+
+class ConcurrencyLimiter:
+    """Process-wide cap on concurrent outbound calls, with queueing metrics"""
+
+    def __init__(self, max_concurrent: int = 8, timeout: Optional[float] = 30.0):
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.stats = {
+            'acquired': 0,
+            'queued': 0,
+            'timeouts': 0,
+            'in_flight': 0,
+            'waiting': 0,
+            'max_waiting': 0,
+            'total_wait_time': 0.0,
+            'max_wait_time': 0.0
+        }
+
+    def acquire(self, timeout: Optional[float] = None):
+        """Take a slot, queueing at most the limiter timeout (or `timeout` if shorter)"""
+        if timeout is not None and self.timeout is not None:
+            timeout = min(timeout, self.timeout)
+        elif timeout is None:
+            timeout = self.timeout
+
+        if self._semaphore.acquire(blocking=False):
+            with self._lock:
+                self.stats['acquired'] += 1
+                self.stats['in_flight'] += 1
+            return
+
+        start = time.monotonic()
+        with self._lock:
+            self.stats['queued'] += 1
+            self.stats['waiting'] += 1
+            self.stats['max_waiting'] = max(
+                self.stats['max_waiting'], self.stats['waiting'])
+
+        acquired = self._semaphore.acquire(timeout=timeout)
+        waited = time.monotonic() - start
+
+        with self._lock:
+            self.stats['waiting'] -= 1
+            self.stats['total_wait_time'] += waited
+            self.stats['max_wait_time'] = max(self.stats['max_wait_time'], waited)
+            if acquired:
+                self.stats['acquired'] += 1
+                self.stats['in_flight'] += 1
+            else:
+                self.stats['timeouts'] += 1
+
+        if not acquired:
+            logger.warning(f"LLM queue timeout after {waited:.1f}s")
+            raise LLMQueueTimeout(
+                f"Nenhuma vaga para chamadas ao modelo em {waited:.0f}s")
+
+    def release(self):
+        with self._lock:
+            self.stats['in_flight'] -= 1
+        self._semaphore.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = self.stats.copy()
+        stats['max_concurrent'] = self.max_concurrent
+        stats['avg_wait_time'] = round(
+            stats['total_wait_time'] / stats['queued'], 3) if stats['queued'] else 0.0
+        return stats
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """
+    Response body that frees the limiter slot once fully read or closed,
+    and stops reading at the caller's deadline
+    """
+
+    def __init__(self, stream, release: Callable[[], None],
+                 deadline: Optional[float] = None):
+        self._stream = stream
+        self._release = release
+        self._released = False
+        self._deadline = deadline
+
+    def __iter__(self):
+        for chunk in self._stream:
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                raise LLMDeadlineExceeded("LLM deadline exceeded while streaming")
+            yield chunk
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if not self._released:
+                self._released = True
+                self._release()
+
+
+class LimitedTransport(httpx.BaseTransport):
+    """
+    httpx transport that holds a limiter slot for the whole request,
+    including streamed responses (SSE tokens), so the cap counts calls
+    actually open against the provider.
+    """
+
+    def __init__(self, limiter: ConcurrencyLimiter,
+                 transport: Optional[httpx.BaseTransport] = None):
+        self.limiter = limiter
+        self._transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        deadline = getattr(_deadline, 'at', None)
+        if deadline is not None and deadline <= time.monotonic():
+            raise LLMDeadlineExceeded("LLM deadline exceeded before the request")
+
+        self.limiter.acquire(
+            timeout=None if deadline is None else deadline - time.monotonic())
+        try:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LLMDeadlineExceeded("LLM deadline exceeded while queued")
+                # httpx reads per-request timeouts from the extensions
+                timeouts = request.extensions.get('timeout') or {}
+                request.extensions['timeout'] = {
+                    key: remaining if value is None else min(value, remaining)
+                    for key, value in {'connect': None, 'read': None, 'write': None,
+                                       'pool': None, **timeouts}.items()
+                }
+            response = self._transport.handle_request(request)
+        except BaseException:
+            self.limiter.release()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, self.limiter.release, deadline),
+            extensions=response.extensions
+        )
+
+    def close(self):
+        self._transport.close()
+
+
+def limited_http_client(limiter: Optional[ConcurrencyLimiter] = None) -> httpx.Client:
+    """httpx client for OpenAI SDK clients (chat and embeddings)"""
+    return httpx.Client(
+        transport=LimitedTransport(limiter or llm_limiter),
+        timeout=httpx.Timeout(60.0, connect=5.0))
+
+
+llm_limiter = ConcurrencyLimiter(
+    max_concurrent=int(os.getenv('JULIUS_LLM_MAX_CONCURRENCY', 8)),
+    timeout=float(os.getenv('JULIUS_LLM_QUEUE_TIMEOUT', 30)))
+llm_flight = SingleFlight()
+llm_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv('JULIUS_LLM_BREAKER_FAILURES', 5)),
+    reset_timeout=float(os.getenv('JULIUS_LLM_BREAKER_RESET', 30)))
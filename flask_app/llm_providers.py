@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from .llm_limits import limited_http_client
+
+logger = logging.getLogger(__name__)
+
+
+class LLMProvider(ABC):
+    """
+    Source of chat models and embeddings for Julius. Chat models are
+    stateless clients, so one per (model, temperature, max_tokens) is
+    shared by every JuliusAI in the process. Providers implement
+    _create_chat() and embeddings().
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self._llms: Dict[tuple, BaseChatModel] = {}
+        self._lock = threading.Lock()
+
+    def chat(self, model: str, temperature: float, max_tokens: int) -> BaseChatModel:
+        key = (model, temperature, max_tokens)
+        with self._lock:
+            if key not in self._llms:
+                self._llms[key] = self._create_chat(model, temperature, max_tokens)
+            return self._llms[key]
+
+    @abstractmethod
+    def _create_chat(self, model: str, temperature: float, max_tokens: int) -> BaseChatModel:
+        """Build the chat model for one (model, temperature, max_tokens)"""
+
+    @abstractmethod
+    def embeddings(self):
+        """Embeddings client for the user's vector store"""
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    def _create_chat(self, model: str, temperature: float, max_tokens: int) -> BaseChatModel:
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(
+            temperature=temperature,
+            model=model,
+            max_tokens=max_tokens,
+            # Tokens reach callback handlers as they arrive (SSE endpoint);
+            # invoke() still returns the complete message
+            streaming=True,
+            stream_usage=True,
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            # Every call holds a slot of the process-wide LLM limiter
+            http_client=limited_http_client()
+        )
+
+    def embeddings(self):
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(http_client=limited_http_client())
+
+
+FAKE_GENERATED_SQL = (
+    'SELECT t.date, t.description, t.amount FROM "transaction" t '
+    'JOIN pdf_extractable p ON t.pdf_id = p.id JOIN card c ON p.card_id = c.id '
+    'WHERE c.user_id = :user_id '
+    'AND (:start_date IS NULL OR t.date >= :start_date) '
+    'AND (:end_date IS NULL OR t.date <= :end_date) '
+    'ORDER BY t.amount DESC LIMIT 10'
+)
+
+
+class FakeJuliusChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for the Julius agent LLM.
+
+    With tools bound (the Julius router) it calls SmartPortugueseQuery with
+    the question. SQL generation prompts get a fixed, guard-compliant
+    query; other prompts (summaries) get `default_answer`.
+    Latency and token counts are fixed; `error` makes every call fail.
+    """
+
+    model_name: str = "fake-julius"
+    latency: float = 0.0
+    prompt_tokens: Optional[int] = None
+    completion_tokens: int = 20
+    default_answer: str = "Resposta simulada."
+    error: Optional[str] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-julius"
+
+    def bind_tools(self, tools, **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _respond(self, messages: List[BaseMessage], tools: Optional[List[Dict]]) -> AIMessage:
+        if tools:
+            turn = str(messages[-1].content)
+            match = re.search(r"Pergunta(?: atual)?: (.+)", turn)
+            question = match.group(1).strip() if match else turn.strip().splitlines()[0]
+            return AIMessage(content="", tool_calls=[{
+                "name": "SmartPortugueseQuery", "args": {"question": question},
+                "id": "call_fake"}])
+
+        prompt = "\n".join(str(message.content) for message in messages)
+        if "Gere SQL" in prompt:
+            return AIMessage(content=json.dumps({
+                "sql_query": FAKE_GENERATED_SQL, "query_type": "list",
+                "expected_format": "table"}))
+        return AIMessage(content=self.default_answer)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error:
+            raise RuntimeError(self.error)
+
+        message = self._respond(messages, kwargs.get("tools"))
+        prompt_chars = sum(len(str(message.content)) for message in messages)
+        prompt_tokens = self.prompt_tokens if self.prompt_tokens is not None else prompt_chars // 4 + 1
+
+        message.usage_metadata = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": self.completion_tokens,
+            "total_tokens": prompt_tokens + self.completion_tokens
+        }
+        message.response_metadata = {"model_name": self.model_name}
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class FakeEmbeddings(DeterministicFakeEmbedding):
+    """Hash-seeded embeddings with a fixed latency per call"""
+
+    latency: float = 0.0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latency:
+            time.sleep(self.latency)
+        return super().embed_query(text)
+
+
+class FakeProvider(LLMProvider):
+    """Offline provider for tests and benchmarks (no network, no API key)"""
+
+    name = "fake"
+
+    def __init__(self, latency: float = 0.0, prompt_tokens: Optional[int] = None,
+                 completion_tokens: int = 20, embedding_latency: float = 0.0,
+                 embedding_size: int = 256, error: Optional[str] = None):
+        super().__init__()
+        self.latency = latency
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.embedding_latency = embedding_latency
+        self.embedding_size = embedding_size
+        self.error = error
+
+    def _create_chat(self, model: str, temperature: float, max_tokens: int) -> BaseChatModel:
+        return FakeJuliusChatModel(
+            model_name=model, latency=self.latency, prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens, error=self.error)
+
+    def embeddings(self):
+        return FakeEmbeddings(size=self.embedding_size, latency=self.embedding_latency)
+
+
+PROVIDERS = {'openai': OpenAIProvider, 'fake': FakeProvider}
+
+_default_provider: Optional[LLMProvider] = None
+_default_lock = threading.Lock()
+
+
+def get_provider() -> LLMProvider:
+    """Process-wide provider, chosen by JULIUS_LLM_PROVIDER (default openai)"""
+    global _default_provider
+    with _default_lock:
+        if _default_provider is None:
+            name = os.getenv('JULIUS_LLM_PROVIDER', 'openai')
+            if name not in PROVIDERS:
+                raise ValueError(f"Unknown JULIUS_LLM_PROVIDER: {name}")
+            _default_provider = PROVIDERS[name]()
+            logger.info(f"Using LLM provider: {name}")
+        return _default_provider
+
+
+def set_provider(provider: Optional[LLMProvider]):
+    """Replace the process-wide provider (None goes back to the environment)"""
+    global _default_provider
+    with _default_lock:
+        _default_provider = provider
@@ -8,6 +8,9 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(256), nullable=False)
+    # Bumped whenever the user's transactions change, used to invalidate caches
+    data_version = db.Column(db.Integer, nullable=False,
+                             default=0, server_default='0')
 
 
 class Card(db.Model):
@@ -75,6 +78,136 @@ class Transaction(db.Model):
     updated_at = db.Column(
         db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
 
+    # Index for merchant aggregations over a user's statements
+    __table_args__ = (
+        db.Index('idx_transaction_pdf_merchant', 'pdf_id', 'merchant'),)
+
+
+class SpendingRollup(db.Model):
+    """Monthly spending aggregates per user, category and merchant"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    month = db.Column(db.String(7), nullable=False)  # "2025-08"
+    # Empty string when the transaction has no category/merchant
+    category = db.Column(db.String(50), nullable=False, default='')
+    merchant = db.Column(db.String(200), nullable=False, default='')
+    total_amount = db.Column(db.Float, nullable=False, default=0.0)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(
+        db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'month', 'category', 'merchant',
+                            name='uq_rollup_user_month_category_merchant'),
+        db.Index('idx_rollup_user_merchant', 'user_id', 'merchant'),
+        db.Index('idx_rollup_user_month', 'user_id', 'month'),
+    )
+
+
+class Budget(db.Model):
+    """Monthly spending budget per user and category"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    month = db.Column(db.String(7), nullable=False)  # "2025-08"
+    amount = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    updated_at = db.Column(
+        db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'month', 'category',
+                            name='uq_budget_user_month_category'),)
+
+
+class CategorySpendingStats(db.Model):
+    """Running mean/variance of transaction amounts per category (Welford)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    mean = db.Column(db.Float, nullable=False, default=0.0)
+    # Sum of squared differences from the mean
+    m2 = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(
+        db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'category',
+                            name='uq_category_stats_user_category'),)
+
+
+class SpendingAlert(db.Model):
+    """Alerts raised by the post-ingest alert engine"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # 'budget_exceeded', 'unusual_spending' or 'large_transaction'
+    alert_type = db.Column(db.String(30), nullable=False)
+    # 'low', 'medium' or 'high'
+    severity = db.Column(db.String(10), nullable=False)
+    message = db.Column(db.String(300), nullable=False)
+    amount = db.Column(db.Float, nullable=True)
+    category = db.Column(db.String(50), nullable=True)
+    date = db.Column(db.String(20), nullable=True)  # ISO format
+    # Transaction that triggered the alert (not a FK: alerts outlive bulk deletes)
+    transaction_id = db.Column(db.Integer, nullable=True, index=True)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+    __table_args__ = (
+        db.Index('idx_alert_user_created', 'user_id', 'created_at'),)
+
+
+class QueryPlan(db.Model):
+    """LLM-generated SQL shared by every user, keyed by normalized question"""
+    id = db.Column(db.Integer, primary_key=True)
+    # MD5 of the normalized question
+    question_hash = db.Column(db.String(32), nullable=False, unique=True)
+    question = db.Column(db.Text, nullable=False)
+    # Parameterized over :user_id, :start_date and :end_date
+    sql_query = db.Column(db.Text, nullable=True)
+    query_type = db.Column(db.String(20), nullable=True)
+    expected_format = db.Column(db.String(20), nullable=True)
+    # 'valid', 'rejected' (by the SQL guard) or 'failed' (at execution)
+    status = db.Column(db.String(20), nullable=False)
+    error = db.Column(db.String(300), nullable=True)
+    prompt_version = db.Column(db.Integer, nullable=True)
+    hit_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    last_used_at = db.Column(db.DateTime, server_default=db.func.now())
+
+
+class UserFinancialProfile(db.Model):
+    """Precomputed financial digest injected into Julius agent questions"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+                        nullable=False, unique=True)
+    # Monthly totals, top categories/merchants, subscriptions, installments, cards
+    profile_json = db.Column(db.Text, nullable=True)
+    # Short Portuguese text rendered from profile_json
+    digest = db.Column(db.Text, nullable=True)
+    # User.data_version the profile was built from
+    data_version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(
+        db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+
+class EmbeddedDocument(db.Model):
+    """Document embedded in a user's FAISS index; its id is the vector id"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # 'summary:<pdf_id>' or 'transaction:<transaction_id>' (FAISS docstore id)
+    doc_key = db.Column(db.String(64), nullable=False)
+    # Statement the document came from (not a FK: rows outlive the PDF
+    # until the next sync removes their vectors)
+    pdf_id = db.Column(db.Integer, nullable=False, index=True)
+    # SHA-256 of the embedded text
+    content_hash = db.Column(db.String(64), nullable=False)
+    updated_at = db.Column(
+        db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'doc_key', name='uq_embedded_document_user_key'),)
+
 
 class ConversationSession(db.Model):
     """Chat session for Julius AI conversations"""
@@ -86,6 +219,9 @@ class ConversationSession(db.Model):
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(
         db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+    # Rolling summary of the messages up to summary_message_id
+    summary = db.Column(db.Text, nullable=True)
+    summary_message_id = db.Column(db.Integer, nullable=True)
 
     # Relationships
     messages = db.relationship(
@@ -113,6 +249,12 @@ class ConversationMessage(db.Model):
     response_time_ms = db.Column(
         db.Integer, nullable=True)  # Performance tracking
     cost_estimate = db.Column(db.Float, nullable=True)  # Cost tracking
+    # LLM usage recorded by the callback handler
+    prompt_tokens = db.Column(db.Integer, nullable=True)
+    completion_tokens = db.Column(db.Integer, nullable=True)
+    llm_calls = db.Column(db.Integer, nullable=True)
+    model_name = db.Column(db.String(50), nullable=True)
+    tool_latency_ms = db.Column(db.Text, nullable=True)  # JSON {tool: ms}
 
     created_at = db.Column(db.DateTime, server_default=db.func.now())
 
@@ -0,0 +1,70 @@
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+import yaml
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+logger = logging.getLogger(__name__)
+
+# One directory per prompt, one "v<N>.yaml" file per version
+PROMPTS_DIR = os.path.join(os.path.dirname(__file__), 'prompts')
+
+_VERSION_FILE = re.compile(r'^v(\d+)\.yaml$')
+
+
+def _latest_version(name: str) -> int:
+    prompt_dir = os.path.join(PROMPTS_DIR, name)
+    if not os.path.isdir(prompt_dir):
+        raise KeyError(f"Unknown prompt: {name}")
+
+    versions = [
+        int(match.group(1)) for match in
+        (_VERSION_FILE.match(f) for f in os.listdir(prompt_dir)) if match
+    ]
+    if not versions:
+        raise KeyError(f"Prompt {name} has no versions")
+    return max(versions)
+
+
+@lru_cache(maxsize=None)
+def load_prompt(name: str, version: Optional[int] = None) -> Dict[str, Any]:
+    """Load a prompt definition (latest version when none is given)"""
+    version = version or _latest_version(name)
+    path = os.path.join(PROMPTS_DIR, name, f"v{version}.yaml")
+    if not os.path.exists(path):
+        raise KeyError(f"Unknown prompt version: {name} v{version}")
+
+    with open(path, encoding='utf-8') as f:
+        definition = yaml.safe_load(f)
+
+    logger.info(f"Loaded prompt {name} v{version}")
+    return definition
+
+
+@lru_cache(maxsize=None)
+def get_chat_prompt(name: str, version: Optional[int] = None) -> ChatPromptTemplate:
+    """Compile a chat prompt once per process"""
+    definition = load_prompt(name, version)
+    if definition.get('type') != 'chat':
+        raise ValueError(f"Prompt {name} is not a chat prompt")
+
+    messages = []
+    for message in definition['messages']:
+        if message['role'] == 'placeholder':
+            messages.append(MessagesPlaceholder(
+                message['variable'], optional=message.get('optional', False)))
+        else:
+            messages.append((message['role'], message['template']))
+
+    return ChatPromptTemplate.from_messages(messages)
+
+
+def get_text_prompt(name: str, version: Optional[int] = None) -> str:
+    """Return the raw template of a text prompt"""
+    definition = load_prompt(name, version)
+    if definition.get('type') != 'text':
+        raise ValueError(f"Prompt {name} is not a text prompt")
+    return definition['template']
@@ -0,0 +1,107 @@
+import hashlib
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+
+from .models import QueryPlan
+from .prompt_registry import load_prompt
+from .sql_guard import SQLGuardError, validate_sql
+
+logger = logging.getLogger(__name__)
+
+
+def plan_key(normalized_question: str) -> str:
+    """Cache key of a normalized question (the same for every user)"""
+    return hashlib.md5(normalized_question.encode()).hexdigest()
+
+
+def _prompt_version() -> int:
+    return load_prompt("sql_generation")["version"]
+
+
+def _execute_outside(session, statement):
+    """Run a write on its own connection, leaving the caller's session untouched"""
+    bind = session.get_bind()
+    if isinstance(bind, Engine):
+        with bind.begin() as conn:
+            conn.execute(statement)
+    else:
+        # Session bound to a connection (tests): already inside its transaction
+        bind.execute(statement)
+
+
+def get_plan(session, question_hash: str) -> Optional[Dict[str, Any]]:
+    """Return a valid plan generated with the current prompt, counting the hit"""
+    plan = session.query(QueryPlan).filter_by(
+        question_hash=question_hash, status='valid',
+        prompt_version=_prompt_version()).first()
+    if plan is None:
+        return None
+
+    # Plans are replayed for every user: check them against the current
+    # guard, not the one they were stored under
+    try:
+        sql_query = validate_sql(plan.sql_query or "")
+    except SQLGuardError as e:
+        logger.warning(f"Stored query plan {question_hash} rejected: {e}")
+        _execute_outside(session, update(QueryPlan).where(QueryPlan.id == plan.id).values(
+            status='rejected', error=f"Consulta rejeitada: {e}"[:300]))
+        return None
+
+    _execute_outside(session, update(QueryPlan).where(QueryPlan.id == plan.id).values(
+        hit_count=QueryPlan.hit_count + 1, last_used_at=datetime.utcnow()))
+
+    return {
+        "sql_query": sql_query,
+        "query_type": plan.query_type,
+        "expected_format": plan.expected_format
+    }
+
+
+def save_plan(session, question_hash: str, question: str, plan: Dict[str, Any]):
+    """
+    Store (or replace) the plan generated for a question. Plans rejected
+    by the SQL guard are kept as 'rejected'; other generation failures
+    (network errors, invalid JSON) are not stored.
+    """
+    if plan.get("guard_rejected"):
+        status = 'rejected'
+    elif plan.get("error"):
+        return
+    else:
+        status = 'valid'
+    values = dict(
+        question=question,
+        sql_query=plan.get("sql_query"),
+        query_type=plan.get("query_type"),
+        expected_format=plan.get("expected_format"),
+        status=status,
+        error=(plan.get("error") or "")[:300] or None,
+        prompt_version=_prompt_version()
+    )
+
+    try:
+        existing = session.query(QueryPlan).filter_by(
+            question_hash=question_hash).first()
+        if existing:
+            for key, value in values.items():
+                setattr(existing, key, value)
+        else:
+            session.add(QueryPlan(question_hash=question_hash, hit_count=0, **values))
+        session.commit()
+    except IntegrityError:
+        # Another worker planned the same question concurrently
+        session.rollback()
+        logger.info(f"Query plan {question_hash} already stored")
+
+
+def mark_failed(session, question_hash: str, error: str):
+    """Stop serving a plan that failed at execution"""
+    session.rollback()
+    session.query(QueryPlan).filter_by(question_hash=question_hash).update(
+        {"status": 'failed', "error": error[:300]})
+    session.commit()
@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from .cache import LRUTTLCache
+from .models import db, User
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """Process-local backend, shared by every JuliusAI in the worker"""
+
+    def __init__(self, max_size: int = 5000, default_ttl: int = 1800):
+        self._cache = LRUTTLCache(max_size=max_size, default_ttl=default_ttl)
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self._cache.get(key)
+
+    def set(self, key: str, value: Dict, ttl: int):
+        self._cache.set(key, value, ttl=ttl)
+
+    def delete_prefix(self, prefix: str) -> int:
+        return self._cache.delete_where(lambda key: key.startswith(prefix))
+
+
+class RedisBackend:
+    """Redis backend, shared by every worker pointing at the same server"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def get(self, key: str) -> Optional[Dict]:
+        raw = self._client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Dict, ttl: int):
+        self._client.set(key, json.dumps(value), ex=ttl)
+
+    def delete_prefix(self, prefix: str) -> int:
+        keys = list(self._client.scan_iter(match=f"{prefix}*", count=500))
+        if keys:
+            self._client.delete(*keys)
+        return len(keys)
+
+
+class ResponseCache:
+    """
+    Cross-request cache of Julius answers.
+
+    Keys are namespaced by user so a user's answers can be dropped on their
+    own; callers put the user's data version in the key so answers computed
+    before a new upload are never served again.
+    """
+
+    PREFIX = "julius:response:"
+
+    def __init__(self, backend=None, default_ttl: int = 1800):
+        self.backend = backend or MemoryBackend(default_ttl=default_ttl)
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'errors': 0}
+
+    def _key(self, user_id, key: str) -> str:
+        return f"{self.PREFIX}{user_id}:{key}"
+
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def get(self, user_id, key: str) -> Optional[Dict]:
+        try:
+            value = self.backend.get(self._key(user_id, key))
+        except Exception as e:
+            # A cache outage must never fail the question itself
+            logger.warning(f"Response cache get failed: {e}")
+            self._count('errors')
+            value = None
+
+        self._count('hits' if value is not None else 'misses')
+        return value
+
+    def set(self, user_id, key: str, value: Dict, ttl: Optional[int] = None):
+        try:
+            self.backend.set(self._key(user_id, key), value, ttl or self.default_ttl)
+        except Exception as e:
+            logger.warning(f"Response cache set failed: {e}")
+            self._count('errors')
+
+    def invalidate_user(self, user_id) -> int:
+        """Drop every cached answer of a user"""
+        try:
+            return self.backend.delete_prefix(f"{self.PREFIX}{user_id}:")
+        except Exception as e:
+            logger.warning(f"Response cache invalidation failed: {e}")
+            self._count('errors')
+            return 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = self.stats.copy()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups * 100, 1) if lookups else 0.0
+        stats['backend'] = type(self.backend).__name__
+        return stats
+
+
+def _create_backend():
+    redis_url = os.getenv('JULIUS_CACHE_REDIS_URL')
+    if redis_url:
+        try:
+            import redis
+            return RedisBackend(redis.Redis.from_url(redis_url))
+        except ImportError:
+            logger.warning(
+                "JULIUS_CACHE_REDIS_URL is set but redis is not installed, using in-memory cache")
+    return MemoryBackend(max_size=int(os.getenv('JULIUS_CACHE_MAX_SIZE', 5000)))
+
+
+response_cache = ResponseCache(_create_backend())
+
+
+def get_data_version(user_id) -> int:
+    """Current version of a user's financial data"""
+    version = db.session.query(User.data_version).filter(
+        User.id == int(user_id)).scalar()
+    return version or 0
+
+
+def bump_data_version(user_id):
+    """Mark a user's data as changed (caller commits)"""
+    User.query.filter(User.id == int(user_id)).update(
+        {User.data_version: db.func.coalesce(User.data_version, 0) + 1},
+        synchronize_session=False)
@@ -1,6 +1,10 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from ..models import db, Card, PDFExtractable, Transaction
+from ..models import db, Card, PDFExtractable, Transaction, SpendingRollup
+from ..spending_rollup import has_rollup, month_range
+from ..alert_engine import get_alerts
+from ..budgets import (MAX_BUDGET_YEAR, MIN_BUDGET_YEAR, get_budget_comparison,
+                       set_year_budgets)
 from sqlalchemy import func, and_, extract
 from datetime import datetime, timedelta
 from collections import defaultdict  # ← ADICIONAR AQUI NO TOPO
@@ -258,6 +262,116 @@ def get_subscriptions():
         print(f"Full traceback: {error_details}")
         return jsonify({'error': f'Failed to get subscriptions: {str(e)}'}), 500
 
+
+@dashboard_bp.route('/dashboard/merchants', methods=['GET'])
+@jwt_required()
+def get_merchants():
+    """Get top merchants by spending over the user's history"""
+    try:
+        user_id = get_jwt_identity()
+
+        limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+        category = request.args.get('category')
+
+        # Without dates the ranking covers the user's full history
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        start_date = datetime.strptime(
+            start_date, '%Y-%m-%d') if start_date else None
+        end_date = datetime.strptime(end_date, '%Y-%m-%d') if end_date else None
+
+        merchants = get_top_merchants(
+            user_id, limit, start_date, end_date, category)
+
+        return jsonify(merchants), 200
+
+    except ValueError as e:
+        return jsonify({'error': f'Invalid parameters: {str(e)}'}), 400
+    except Exception as e:
+        print(f"Top merchants error: {str(e)}")
+        traceback.print_exc()
+        return jsonify({'error': f'Failed to get top merchants: {str(e)}'}), 500
+
+@dashboard_bp.route('/dashboard/alerts', methods=['GET'])
+@jwt_required()
+def get_spending_alerts():
+    """Get spending alerts raised when statements were ingested"""
+    try:
+        user_id = get_jwt_identity()
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+
+        return jsonify({'alerts': get_alerts(user_id, limit)}), 200
+
+    except Exception as e:
+        print(f"Alerts error: {str(e)}")
+        traceback.print_exc()
+        return jsonify({'error': f'Failed to get alerts: {str(e)}'}), 500
+
+
+@dashboard_bp.route('/dashboard/budget', methods=['GET'])
+@jwt_required()
+def get_budget():
+    """Get budget vs actual spending per category"""
+    try:
+        user_id = get_jwt_identity()
+
+        # Budgets are monthly: the range covers every month it touches
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        now = datetime.now()
+        start_month = datetime.strptime(
+            start_date, '%Y-%m-%d').strftime('%Y-%m') if start_date else now.strftime('%Y-%m')
+        end_month = datetime.strptime(
+            end_date, '%Y-%m-%d').strftime('%Y-%m') if end_date else start_month
+
+        comparison = get_budget_comparison(user_id, start_month, end_month)
+        comparison['period'] = {
+            'start_month': start_month,
+            'end_month': end_month
+        }
+        return jsonify(comparison), 200
+
+    except ValueError as e:
+        return jsonify({'error': f'Invalid parameters: {str(e)}'}), 400
+    except Exception as e:
+        print(f"Budget error: {str(e)}")
+        traceback.print_exc()
+        return jsonify({'error': f'Failed to get budget comparison: {str(e)}'}), 500
+
+
+@dashboard_bp.route('/dashboard/budget', methods=['PUT'])
+@jwt_required()
+def set_budget():
+    """
+    Set a year of budgets in one call.
+
+    Body: {"year": 2025, "budgets": {"groceries": 800, "transport": [12 monthly amounts]}}
+    """
+    try:
+        user_id = int(get_jwt_identity())
+        data = request.get_json() or {}
+
+        year = data.get('year')
+        budgets = data.get('budgets')
+        if (not isinstance(year, int) or isinstance(year, bool) or
+                not MIN_BUDGET_YEAR <= year <= MAX_BUDGET_YEAR or
+                not isinstance(budgets, dict) or not budgets):
+            return jsonify({'error': f'year ({MIN_BUDGET_YEAR}-{MAX_BUDGET_YEAR}) '
+                                     f'and budgets (object) are required'}), 400
+
+        saved = set_year_budgets(user_id, year, budgets)
+        return jsonify({'year': year, 'saved': saved}), 200
+
+    except (ValueError, TypeError) as e:
+        db.session.rollback()
+        return jsonify({'error': f'Invalid budgets: {str(e)}'}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"Set budget error: {str(e)}")
+        traceback.print_exc()
+        return jsonify({'error': f'Failed to set budgets: {str(e)}'}), 500
+
+
 def get_cards_summary(user_id):
     """Get summary of user's credit cards"""
     cards = Card.query.filter_by(user_id=user_id).all()
@@ -377,6 +491,70 @@ def get_spending_by_category(user_id, start_date, end_date):
     return result
 
 
+def get_top_merchants(user_id, limit=10, start_date=None, end_date=None, category=None):
+    """
+    Rank merchants by total spending.
+
+    Month-aligned ranges are answered from the spending rollup; ranges that
+    cut a month fall back to aggregating the raw transactions.
+    """
+    months = month_range(start_date, end_date)
+
+    if months is not None and has_rollup(user_id):
+        start_month, end_month = months
+        total = func.sum(SpendingRollup.total_amount)
+        query = db.session.query(
+            SpendingRollup.merchant,
+            total.label('total_spent'),
+            func.sum(SpendingRollup.transaction_count).label('transaction_count')
+        ).filter(
+            SpendingRollup.user_id == user_id,
+            SpendingRollup.merchant != ''
+        )
+        if start_month:
+            query = query.filter(SpendingRollup.month >= start_month)
+        if end_month:
+            query = query.filter(SpendingRollup.month <= end_month)
+        if category:
+            query = query.filter(SpendingRollup.category == category)
+        query = query.group_by(SpendingRollup.merchant)
+    else:
+        total = func.sum(Transaction.amount)
+        query = db.session.query(
+            Transaction.merchant,
+            total.label('total_spent'),
+            func.count(Transaction.id).label('transaction_count')
+        ).join(PDFExtractable).join(Card).filter(
+            Card.user_id == user_id,
+            Transaction.merchant.isnot(None),
+            Transaction.merchant != ''
+        )
+        if start_date:
+            query = query.filter(
+                Transaction.date >= start_date.strftime('%Y-%m-%d'))
+        if end_date:
+            query = query.filter(
+                Transaction.date <= end_date.strftime('%Y-%m-%d'))
+        if category:
+            query = query.filter(Transaction.category == category)
+        query = query.group_by(Transaction.merchant)
+
+    rows = query.order_by(total.desc()).limit(limit).all()
+
+    result = []
+    for merchant, total_spent, transaction_count in rows:
+        total_spent = float(total_spent or 0)
+        transaction_count = int(transaction_count or 0)
+        result.append({
+            'merchant': merchant,
+            'total_spent': round(total_spent, 2),
+            'transaction_count': transaction_count,
+            'average_transaction': round(total_spent / transaction_count, 2) if transaction_count else 0.0
+        })
+
+    return result
+
+
 def detect_subscriptions(user_id, start_date, end_date):
     """
     Detecta assinaturas recorrentes baseado em:
@@ -1,7 +1,10 @@
 import logging
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from ..julius_ai import JuliusAI
+from ..julius_pool import invalidate_user, julius_pool
+from ..conversation_memory import ConversationMemory
+from ..julius_streaming import sse_event
+from ..julius_metrics import collect_metrics, MAX_METRIC_DAYS
 
 logger = logging.getLogger(__name__)
 julius_bp = Blueprint('julius', __name__)
@@ -21,12 +24,11 @@ def ask_julius():
         f"User question: {question} (User ID: {user_id}, Session: {session_id})")
 
     try:
-        # Create Julius AI instance with conversation memory support
-        ai = JuliusAI(
-            user_id, optimization_level=optimization_level, session_id=session_id)
+        # Reuse the process-wide instance for this user and level
+        ai = julius_pool.get(user_id, optimization_level)
 
         # Use new context-aware ask method
-        result = ai.ask_with_context(question)
+        result = ai.ask_with_context(question, session_id=session_id)
 
         logger.info(
             f"AI response: {result['response']} (Query type: {result.get('query_type', 'unknown')})")
@@ -37,6 +39,9 @@ def ask_julius():
             "response_time_ms": result.get('response_time_ms'),
             "query_type": result.get('query_type'),
             "optimization_level": result.get('optimization_level'),
+            # Answered without the LLM (circuit open or latency budget spent)
+            "degraded": result.get('degraded', False),
+            "degraded_reason": result.get('degraded_reason'),
             "error": result.get('error', False)
         }), 200
 
@@ -47,6 +52,55 @@ def ask_julius():
             "error": str(e)
         }), 500
 
+
+@julius_bp.route('/ask/stream', methods=['POST'])
+@jwt_required()
+def ask_julius_stream():
+    """Same as /ask, streamed as Server-Sent Events"""
+    user_id = get_jwt_identity()
+    data = request.get_json()
+    question = data.get('question')
+    session_id = data.get('session_id')
+    optimization_level = data.get('optimization_level', 'aggressive')
+
+    logger.info(
+        f"User question (stream): {question} (User ID: {user_id}, Session: {session_id})")
+
+    def generate():
+        try:
+            ai = julius_pool.get(user_id, optimization_level)
+            for event in ai.ask_stream(question, session_id=session_id):
+                yield sse_event(event['event'], event['data'])
+        except Exception as e:
+            logger.exception(f"Error in /ask/stream endpoint: {str(e)}")
+            yield sse_event('error', {
+                "answer": "Desculpe, ocorreu um erro ao processar sua pergunta. Tente novamente.",
+                "error": str(e)
+            })
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@julius_bp.route('/metrics', methods=['GET'])
+@jwt_required()
+def julius_metrics():
+    """Routing, latency percentiles, tokens and cost of the user's recent answers"""
+    user_id = get_jwt_identity()
+    days = request.args.get('days', '7')
+    if not days.isdigit() or not 1 <= int(days) <= MAX_METRIC_DAYS:
+        return jsonify({
+            "success": False,
+            "error": f"days deve ser um inteiro entre 1 e {MAX_METRIC_DAYS}"
+        }), 400
+    days = int(days)
+
+    try:
+        return jsonify({"success": True, "metrics": collect_metrics(user_id, days)}), 200
+    except Exception as e:
+        logger.exception(f"Error in /metrics: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
 # Add endpoint to update embeddings when new data is added
 
 
@@ -59,15 +113,15 @@ def get_conversation_history():
     limit = int(request.args.get('limit', 20))
 
     try:
-        ai = JuliusAI(user_id, session_id=session_id)
+        memory = ConversationMemory(user_id, session_id=session_id)
         # Ensure session is initialized to find existing conversations
-        ai.get_or_create_conversation_session()
-        history = ai.get_conversation_history(limit=limit)
+        memory.get_or_create_session()
+        history = memory.get_history(limit=limit)
 
         return jsonify({
             "success": True,
             "messages": history,
-            "session_id": ai.session_id,
+            "session_id": memory.session_id,
             "total_messages": len(history)
         }), 200
 
@@ -91,10 +145,10 @@ def clear_conversation():
     session_id = data.get('session_id')
 
     try:
-        ai = JuliusAI(user_id, session_id=session_id)
+        memory = ConversationMemory(user_id, session_id=session_id)
         # Ensure session is initialized to find existing conversations
-        ai.get_or_create_conversation_session()
-        cleared = ai.clear_conversation()
+        memory.get_or_create_session()
+        cleared = memory.clear()
 
         return jsonify({
             "success": cleared,
@@ -156,6 +210,8 @@ def update_embeddings():
         from ..vector_store import FinancialVectorStore
         vector_store = FinancialVectorStore(user_id)
         count = vector_store.update_user_data(pdf_id)
+        # Pooled instances hold the previous index in memory
+        invalidate_user(user_id)
         return jsonify({"message": f"Updated {count} documents"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1,8 +1,16 @@
-from flask import Blueprint, jsonify, request, current_app
+import logging
+from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_app.pdf_extractor.pdf_extractor import NubankExtractor
 from ..models import Card, PDFExtractable, Transaction, User, db
-from flask_app.julius_ai import update_embeddings_for_user
+from flask_app.spending_rollup import apply_transactions
+from flask_app.alert_engine import forget_transactions
+from flask_app.ingest_pipeline import run_post_ingest
+from flask_app.julius_pool import invalidate_user
+from flask_app.response_cache import bump_data_version
+from flask_app.vector_store import remove_pdf_embeddings
+
+logger = logging.getLogger(__name__)
 
 
 statements_bp = Blueprint('statements', __name__)
@@ -173,6 +181,7 @@ def upload_pdf():
             db.session.flush()
 
             # Add normalized transactions with enhanced data
+            new_transactions = []
             for t in normalized_transactions:
                 transaction = Transaction(
                     # Use normalized date format (YYYY-MM-DD)
@@ -187,13 +196,16 @@ def upload_pdf():
                     pdf_id=pdf.id
                 )
                 db.session.add(transaction)
+                new_transactions.append(transaction)
+
+            # Keep the monthly spending rollup in the same transaction
+            apply_transactions(user.id, new_transactions)
+            bump_data_version(user.id)
 
             db.session.commit()
-            try:
-                update_embeddings_for_user(user.id, pdf.id)
-            except Exception as e:
-                current_app.logger.error(
-                    f"Failed to update embeddings: {str(e)}")
+
+            # Embeddings, alerts, ... for the new statement only
+            run_post_ingest(user.id, pdf.id, new_transactions)
         return jsonify({"msg": f"{len(normalized_transactions)} transactions and PDF info saved"}), 201
     except Exception as e:
         db.session.rollback()
@@ -564,11 +576,28 @@ def delete_pdf(pdf_id):
             except Exception as e:
                 print(f" Error deleting Large Object: {e}")
 
+        # Remove the statement's transactions from the rollup and alert stats
+        pdf_transactions = Transaction.query.filter_by(pdf_id=pdf_id).all()
+        apply_transactions(int(current_user_id), pdf_transactions, sign=-1)
+        forget_transactions(int(current_user_id), pdf_transactions)
+        bump_data_version(current_user_id)
+
         transactions_deleted = Transaction.query.filter_by(pdf_id=pdf_id).delete()
         print(f"{transactions_deleted} transactions deleted")
 
         db.session.delete(pdf)
         db.session.commit()
+
+        # The delete is committed: index cleanup failures must not fail it
+        try:
+            # Drop the statement's vectors (no embedding calls)
+            remove_pdf_embeddings(int(current_user_id), pdf_id)
+        except Exception as e:
+            logger.exception(f"Removing embeddings of PDF {pdf_id} failed: {str(e)}")
+        try:
+            invalidate_user(current_user_id)
+        except Exception as e:
+            logger.exception(f"Invalidating Julius for user {current_user_id} failed: {str(e)}")
         
         print(f"PDF {pdf_id} deleted successfully")
         return jsonify({
@@ -0,0 +1,184 @@
+import logging
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from typing import Any, Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from .cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+# Words that don't change what is being asked
+STOPWORDS = {
+    'qual', 'quais', 'foi', 'foram', 'sao', 'ser', 'o', 'a', 'os', 'as',
+    'meu', 'minha', 'meus', 'minhas', 'de', 'do', 'da', 'dos', 'das', 'em',
+    'no', 'na', 'nos', 'nas', 'e', 'eu', 'me', 'que', 'quanto', 'quanta',
+    'quantos', 'esse', 'este', 'essa', 'esta', 'nesse', 'neste', 'nessa',
+    'nesta', 'por', 'favor', 'com', 'para', 'pra', 'um', 'uma', 'valor',
+    'total'
+}
+
+# Words that select a different slice of data: questions must agree on them
+PERIOD_TERMS = {
+    'janeiro', 'fevereiro', 'marco', 'abril', 'maio', 'junho', 'julho',
+    'agosto', 'setembro', 'outubro', 'novembro', 'dezembro', 'passado',
+    'passada', 'anterior', 'ultimo', 'ultima', 'semana', 'ano', 'hoje',
+    'ontem', 'dia', 'dias'
+}
+
+SUFFIXES = ('amos', 'aram', 'ando', 'ados', 'adas', 'ado', 'ada',
+            'ei', 'ou', 'os', 'as', 'es', 'o', 'a', 'e', 's')
+
+
+def _normalize(text: str) -> List[str]:
+    text = unicodedata.normalize('NFD', text.lower())
+    text = ''.join(c for c in text if unicodedata.category(c) != 'Mn')
+    return re.sub(r'[^\w\s]', ' ', text).split()
+
+
+def _stem(token: str) -> str:
+    """Very light Portuguese stemmer (gastei/gasto/gastos -> gast)"""
+    if len(token) <= 4 or token.isdigit():
+        return token
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            return token[:-len(suffix)]
+    return token
+
+
+class HashedNgramVectorizer:
+    """
+    Offline question embeddings: hashed stemmed words plus character
+    trigrams (for typos and accents), L2-normalized for cosine similarity.
+    """
+
+    def __init__(self, dim: int = 1024, trigram_weight: float = 0.3):
+        self.dim = dim
+        self.trigram_weight = trigram_weight
+
+    def _add(self, vector: np.ndarray, feature: str, weight: float):
+        h = zlib.crc32(feature.encode())
+        vector[h % self.dim] += weight if h & 0x80000000 else -weight
+
+    def transform(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in _normalize(text):
+            if token in STOPWORDS:
+                continue
+            token = _stem(token)
+            self._add(vector, f"w:{token}", 1.0)
+            padded = f" {token} "
+            for i in range(len(padded) - 2):
+                self._add(vector, f"c:{padded[i:i + 3]}", self.trigram_weight)
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def _signature(text: str) -> frozenset:
+    """Numbers and period words of a question"""
+    return frozenset(
+        token for token in _normalize(text)
+        if token.isdigit() or token in PERIOD_TERMS)
+
+
+class _QuestionIndex:
+    """Past questions of one user at one data version"""
+
+    def __init__(self, dim: int, data_version: int):
+        self.index = faiss.IndexFlatIP(dim)
+        self.entries: List[Dict[str, Any]] = []
+        self.data_version = data_version
+
+
+class SemanticCache:
+    """
+    Per-user nearest-neighbour cache of answered questions, so paraphrases
+    of a question already answered reuse that answer instead of calling
+    the agent again. An index is dropped as soon as the user's data
+    version changes.
+    """
+
+    def __init__(self, threshold: float = 0.9, max_entries: int = 200,
+                 max_users: int = 1000, vectorizer: Optional[HashedNgramVectorizer] = None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.vectorizer = vectorizer or HashedNgramVectorizer()
+        self._indexes = LRUTTLCache(max_size=max_users)
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def _get_index(self, key, data_version: int, create: bool) -> Optional[_QuestionIndex]:
+        index = self._indexes.get(key)
+        if index is not None and index.data_version != data_version:
+            index = None
+        if index is None and create:
+            index = _QuestionIndex(self.vectorizer.dim, data_version)
+            self._indexes.set(key, index)
+        return index
+
+    def lookup(self, user_id, optimization_level: str, data_version: int,
+               question: str) -> Optional[Dict[str, Any]]:
+        """Return the cached answer of the closest past question, if close enough"""
+        key = (str(user_id), optimization_level)
+        vector = self.vectorizer.transform(question).reshape(1, -1)
+        signature = _signature(question)
+
+        with self._lock:
+            index = self._get_index(key, data_version, create=False)
+            if index is not None and index.index.ntotal:
+                scores, ids = index.index.search(vector, min(5, index.index.ntotal))
+                for score, idx in zip(scores[0], ids[0]):
+                    if score < self.threshold:
+                        break
+                    entry = index.entries[idx]
+                    if entry['signature'] == signature:
+                        self.stats['hits'] += 1
+                        logger.info(
+                            f"Semantic cache hit for user {user_id} ({score:.2f}): '{entry['question']}'")
+                        return entry['value']
+            self.stats['misses'] += 1
+            return None
+
+    def add(self, user_id, optimization_level: str, data_version: int,
+            question: str, value: Dict[str, Any]):
+        key = (str(user_id), optimization_level)
+        vector = self.vectorizer.transform(question)
+        if not vector.any():
+            return
+
+        with self._lock:
+            index = self._get_index(key, data_version, create=True)
+            if len(index.entries) >= self.max_entries:
+                # Keep the most recent questions (IndexFlat has no cheap removal)
+                kept = index.entries[-(self.max_entries // 2):]
+                index.index.reset()
+                index.index.add(np.stack([e['vector'] for e in kept]))
+                index.entries = kept
+
+            index.index.add(vector.reshape(1, -1))
+            index.entries.append({
+                'question': question,
+                'signature': _signature(question),
+                'vector': vector,
+                'value': value
+            })
+
+    def invalidate(self, user_id) -> int:
+        return self._indexes.delete_where(lambda key: key[0] == str(user_id))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = self.stats.copy()
+        stats['threshold'] = self.threshold
+        stats['users'] = len(self._indexes)
+        return stats
+
+
+semantic_cache = SemanticCache(
+    threshold=float(os.getenv('JULIUS_SEMANTIC_CACHE_THRESHOLD', 0.9)))
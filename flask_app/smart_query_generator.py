@@ -6,17 +6,275 @@ from datetime import datetime, timedelta
 from sqlalchemy import text
 import hashlib
 
+from .cache import LRUTTLCache
+from .intent_matcher import IntentMatcher, MIN_INTENT_CONFIDENCE, normalize_text
+from .prompt_registry import get_text_prompt
+from .query_plan_cache import get_plan, mark_failed, plan_key, save_plan
+from .response_cache import get_data_version
+from .sql_result_cache import sql_result_cache
+from .sql_guard import SQLGuardError, execute_guarded, validate_sql
+
 logger = logging.getLogger(__name__)
 
+# Pre-defined query patterns for common Portuguese questions, shared by
+# every generator. Templates only use bound parameters (:limit, :min_amount,
+# :start_date/:end_date as ISO strings, NULL when not filtered) so the SQL
+# text is constant per pattern and periods are filtered by the database.
+#
+# Intent scoring: "weight" multiplies keyword matches, "requires" lists
+# slots a pattern is weak without, "slots" marks category patterns,
+# "slot_bonus" rewards a pattern when a slot is present and "subsumes"
+# lists generic patterns a category pattern answers as well.
+QUERY_PATTERNS: Dict[str, Dict] = {
+    # Gastos/Despesas queries
+    "maiores_gastos": {
+        "keywords": ["maiores gastos", "maiores despesas", "mais gastei", "maior gasto", "gastos mais altos"],
+        "sql_template": """
+            SELECT t.date, t.description, t.amount
+            FROM "transaction" t
+            JOIN pdf_extractable p ON t.pdf_id = p.id
+            JOIN card c ON p.card_id = c.id
+            WHERE c.user_id = :user_id
+            AND (:start_date IS NULL OR t.date >= :start_date)
+            AND (:end_date IS NULL OR t.date <= :end_date)
+            AND (:min_amount IS NULL OR t.amount >= :min_amount)
+            AND t.amount > 0.01
+            ORDER BY t.amount DESC
+            LIMIT :limit
+        """,
+        "query_type": "list",
+        "default_params": {"limit": 10}
+    },
+
+    "total_gasto": {
+        "keywords": ["quanto gastei", "total gasto", "soma dos gastos", "valor total", "total de gastos"],
+        "sql_template": """
+            SELECT 
+                SUM(t.amount) as total_gasto,
+                COUNT(*) as num_transacoes,
+                AVG(t.amount) as gasto_medio
+            FROM "transaction" t
+            JOIN pdf_extractable p ON t.pdf_id = p.id
+            JOIN card c ON p.card_id = c.id
+            WHERE c.user_id = :user_id
+            AND (:start_date IS NULL OR t.date >= :start_date)
+            AND (:end_date IS NULL OR t.date <= :end_date)
+            AND (:min_amount IS NULL OR t.amount >= :min_amount)
+            AND t.amount > 0.01
+        """,
+        "query_type": "aggregation",
+        "default_params": {}
+    },
+
+    "ultimas_transacoes": {
+        "keywords": ["últimas transações", "ultimas transacoes", "últimos gastos", "transações recentes", "gastos recentes"],
+        "sql_template": """
+            SELECT t.date, t.description, t.amount
+            FROM "transaction" t
+            JOIN pdf_extractable p ON t.pdf_id = p.id
+            JOIN card c ON p.card_id = c.id
+            WHERE c.user_id = :user_id
+            AND (:start_date IS NULL OR t.date >= :start_date)
+            AND (:end_date IS NULL OR t.date <= :end_date)
+            AND (:min_amount IS NULL OR t.amount >= :min_amount)
+            AND t.amount > 0.01
+            ORDER BY t.date DESC, t.amount DESC
+            LIMIT :limit
+        """,
+        "query_type": "list",
+        "default_params": {"limit": 15}
+    },
+
+    "gastos_acima_valor": {
+        "keywords": ["gastos acima", "transações acima", "maior que", "superior a", "mais de"],
+        "sql_template": """
+            SELECT t.date, t.description, t.amount
+            FROM "transaction" t
+            JOIN pdf_extractable p ON t.pdf_id = p.id
+            JOIN card c ON p.card_id = c.id
+            WHERE c.user_id = :user_id
+            AND (:start_date IS NULL OR t.date >= :start_date)
+            AND (:end_date IS NULL OR t.date <= :end_date)
+            AND t.amount >= :min_amount
+            ORDER BY t.amount DESC
+            LIMIT :limit
+        """,
+        "query_type": "list",
+        "default_params": {"limit": 15, "min_amount": 100},
+        "requires": ["amount"],
+        "slot_bonus": {"amount": 1.5}
+    },
+
+    "transacoes_periodo": {
+        "keywords": ["transações", "compras", "gastos do", "movimentação", "atividade"],
+        "sql_template": """
+            SELECT t.date, t.description, t.amount, t.merchant, t.category
+            FROM "transaction" t
+            JOIN pdf_extractable p ON t.pdf_id = p.id
+            JOIN card c ON p.card_id = c.id
+            WHERE c.user_id = :user_id
+            AND (:start_date IS NULL OR t.date >= :start_date)
+            AND (:end_date IS NULL OR t.date <= :end_date)
+            AND (:min_amount IS NULL OR t.amount >= :min_amount)
+            AND t.amount > 0.01
+            ORDER BY t.date DESC, t.amount DESC
+            LIMIT :limit
+        """,
+        "query_type": "list",
+        "default_params": {"limit": 20},
+        "weight": 0.5,
+        "slot_bonus": {"period": 1.0}
+    },
+
+    # Category-specific queries
+    "gastos_delivery": {
+        "keywords": ["delivery", "entrega", "ifood", "uber eats", "rappi", "99 food"],
+        "sql_template": """
+            SELECT t.date, t.description, t.amount, t.merchant
+            FROM "transaction" t
+            JOIN pdf_extractable p ON t.pdf_id = p.id
+            JOIN card c ON p.card_id = c.id
+            WHERE c.user_id = :user_id
+            AND (:start_date IS NULL OR t.date >= :start_date)
+            AND (:end_date IS NULL OR t.date <= :end_date)
+            AND (:min_amount IS NULL OR t.amount >= :min_amount)
+            AND t.category = 'food_delivery'
+            AND t.amount > 0.01
+            ORDER BY t.amount DESC
+            LIMIT :limit
+        """,
+        "query_type": "list",
+        "default_params": {"limit": 15},
+        "weight": 2.5,
+        "slots": ["category"],
+        "subsumes": ["maiores_gastos", "transacoes_periodo", "gastos_acima_valor"]
+    },
+
+    "gastos_supermercado": {
+        "keywords": ["supermercado", "mercado", "groceries", "compras do mês", "feira"],
+        "sql_template": """
+            SELECT t.date, t.description, t.amount, t.merchant
+            FROM "transaction" t
+            JOIN pdf_extractable p ON t.pdf_id = p.id
+            JOIN card c ON p.card_id = c.id
+            WHERE c.user_id = :user_id
+            AND (:start_date IS NULL OR t.date >= :start_date)
+            AND (:end_date IS NULL OR t.date <= :end_date)
+            AND (:min_amount IS NULL OR t.amount >= :min_amount)
+            AND t.category = 'groceries'
+            AND t.amount > 0.01
+            ORDER BY t.amount DESC
+            LIMIT :limit
+        """,
+        "query_type": "list",
+        "default_params": {"limit": 15},
+        "weight": 2.5,
+        "slots": ["category"],
+        "subsumes": ["maiores_gastos", "transacoes_periodo", "gastos_acima_valor"]
+    },
+
+    "gastos_transporte": {
+        "keywords": ["transporte", "uber", "taxi", "99", "combustível", "gasolina"],
+        "sql_template": """
+            SELECT t.date, t.description, t.amount, t.merchant, t.category
+            FROM "transaction" t
+            JOIN pdf_extractable p ON t.pdf_id = p.id
+            JOIN card c ON p.card_id = c.id
+            WHERE c.user_id = :user_id
+            AND (:start_date IS NULL OR t.date >= :start_date)
+            AND (:end_date IS NULL OR t.date <= :end_date)
+            AND (:min_amount IS NULL OR t.amount >= :min_amount)
+            AND (t.category = 'transport' OR t.category = 'fuel')
+            AND t.amount > 0.01
+            ORDER BY t.amount DESC
+            LIMIT :limit
+        """,
+        "query_type": "list",
+        "default_params": {"limit": 15},
+        "weight": 2.5,
+        "slots": ["category"],
+        "subsumes": ["maiores_gastos", "transacoes_periodo", "gastos_acima_valor"]
+    },
+
+    "gastos_assinaturas": {
+        "keywords": ["assinaturas", "netflix", "spotify", "mensalidade", "planos"],
+        "sql_template": """
+            SELECT t.date, t.description, t.amount, t.merchant
+            FROM "transaction" t
+            JOIN pdf_extractable p ON t.pdf_id = p.id
+            JOIN card c ON p.card_id = c.id
+            WHERE c.user_id = :user_id
+            AND (:start_date IS NULL OR t.date >= :start_date)
+            AND (:end_date IS NULL OR t.date <= :end_date)
+            AND (:min_amount IS NULL OR t.amount >= :min_amount)
+            AND t.category = 'subscriptions'
+            AND t.amount > 0.01
+            ORDER BY t.amount DESC
+            LIMIT :limit
+        """,
+        "query_type": "list",
+        "default_params": {"limit": 15},
+        "weight": 2.5,
+        "slots": ["category"],
+        "subsumes": ["maiores_gastos", "transacoes_periodo", "gastos_acima_valor"]
+    },
+
+    "total_por_categoria": {
+        "keywords": ["total por categoria", "gastos por tipo", "categorias de gasto"],
+        "sql_template": """
+            SELECT 
+                t.category,
+                SUM(t.amount) as total_gasto,
+                COUNT(*) as num_transacoes,
+                AVG(t.amount) as gasto_medio
+            FROM "transaction" t
+            JOIN pdf_extractable p ON t.pdf_id = p.id
+            JOIN card c ON p.card_id = c.id
+            WHERE c.user_id = :user_id
+            AND (:start_date IS NULL OR t.date >= :start_date)
+            AND (:end_date IS NULL OR t.date <= :end_date)
+            AND (:min_amount IS NULL OR t.amount >= :min_amount)
+            AND t.amount > 0.01
+            AND t.category IS NOT NULL
+            GROUP BY t.category
+            ORDER BY total_gasto DESC
+        """,
+        "query_type": "aggregation",
+        "default_params": {}
+    }
+}
+
+# Mapping of Portuguese terms to standardized periods
+PORTUGUESE_TERMS: Dict[str, str] = {
+    # Períodos temporais
+    "mês passado": "last_month",
+    "último mês": "last_month",
+    "mes passado": "last_month",
+    "mês anterior": "last_month",
+
+    "este mês": "this_month",
+    "neste mês": "this_month",
+    "mês atual": "this_month",
+    "esse mês": "this_month",
+
+    "últimos 30 dias": "last_30_days",
+    "ultimos 30 dias": "last_30_days",
+    "30 dias": "last_30_days"
+}
+
+# Compiled once per process
+INTENT_MATCHER = IntentMatcher(QUERY_PATTERNS, PORTUGUESE_TERMS)
+
 
 class BrazilianFinancialQueryGenerator:
     """
     Smart query generator optimized for Portuguese and cost efficiency
     """
 
-    def __init__(self, user_id: int, session_factory):
+    def __init__(self, user_id: int, session_factory, llm_factory=None):
         self.user_id = user_id
         self.session_factory = session_factory
+        self.llm_factory = llm_factory
 
         # Cached query patterns to avoid API calls
         self.query_patterns = self._initialize_query_patterns()
@@ -24,8 +282,9 @@ class BrazilianFinancialQueryGenerator:
         # Portuguese financial terms mapping
         self.portuguese_terms = self._initialize_portuguese_terms()
 
-        # Query cache to avoid regenerating similar queries
-        self.query_cache = {}
+        # Query cache to avoid regenerating similar queries (bounded, plans
+        # for relative periods like "este mês" go stale so they expire)
+        self.query_cache = LRUTTLCache(max_size=256, default_ttl=3600)
 
         # Only use OpenAI for complex queries that can't be pattern-matched
         self.llm = None  # Initialize only when needed
@@ -33,12 +292,12 @@ class BrazilianFinancialQueryGenerator:
     def _get_llm(self):
         """Lazy initialization of LLM to avoid unnecessary API connections"""
         if self.llm is None:
-            from langchain_openai import ChatOpenAI
-            self.llm = ChatOpenAI(
-                temperature=0,
-                model="gpt-3.5-turbo",  # Cheaper than GPT-4
-                max_tokens=300  # Limit tokens to control costs
-            )
+            if self.llm_factory is not None:
+                self.llm = self.llm_factory()
+            else:
+                from .llm_providers import get_provider
+                # Cheaper than GPT-4, tokens limited to control costs
+                self.llm = get_provider().chat("gpt-3.5-turbo", temperature=0, max_tokens=300)
         return self.llm
 
     def _initialize_query_patterns(self) -> Dict[str, Dict]:
@@ -46,200 +305,13 @@ class BrazilianFinancialQueryGenerator:
         Pre-defined query patterns for common Portuguese questions
         This avoids API calls for 80%+ of common queries
         """
-        return {
-            # Gastos/Despesas queries
-            "maiores_gastos": {
-                "keywords": ["maiores gastos", "maiores despesas", "mais gastei", "maior gasto", "gastos mais altos"],
-                "sql_template": """
-                    SELECT t.date, t.description, t.amount
-                    FROM transaction t
-                    JOIN pdf_extractable p ON t.pdf_id = p.id
-                    JOIN card c ON p.card_id = c.id
-                    WHERE c.user_id = :user_id
-                    AND t.amount > 0.01
-                    ORDER BY t.amount DESC
-                    LIMIT {limit}
-                """,
-                "query_type": "list",
-                "default_params": {"limit": 10}
-            },
-
-            "total_gasto": {
-                "keywords": ["quanto gastei", "total gasto", "soma dos gastos", "valor total", "total de gastos"],
-                "sql_template": """
-                    SELECT 
-                        SUM(t.amount) as total_gasto,
-                        COUNT(*) as num_transacoes,
-                        AVG(t.amount) as gasto_medio
-                    FROM transaction t
-                    JOIN pdf_extractable p ON t.pdf_id = p.id
-                    JOIN card c ON p.card_id = c.id
-                    WHERE c.user_id = :user_id
-                    AND t.amount > 0.01
-                """,
-                "query_type": "aggregation",
-                "default_params": {}
-            },
-
-            "ultimas_transacoes": {
-                "keywords": ["últimas transações", "ultimas transacoes", "últimos gastos", "transações recentes", "gastos recentes"],
-                "sql_template": """
-                    SELECT t.date, t.description, t.amount
-                    FROM transaction t
-                    JOIN pdf_extractable p ON t.pdf_id = p.id
-                    JOIN card c ON p.card_id = c.id
-                    WHERE c.user_id = :user_id
-                    AND t.amount > 0.01
-                    ORDER BY t.date DESC, t.amount DESC
-                    LIMIT {limit}
-                """,
-                "query_type": "list",
-                "default_params": {"limit": 15}
-            },
-
-            "gastos_acima_valor": {
-                "keywords": ["gastos acima", "transações acima", "maior que", "superior a", "mais de"],
-                "sql_template": """
-                    SELECT t.date, t.description, t.amount
-                    FROM transaction t
-                    JOIN pdf_extractable p ON t.pdf_id = p.id
-                    JOIN card c ON p.card_id = c.id
-                    WHERE c.user_id = :user_id
-                    AND t.amount >= {min_amount}
-                    ORDER BY t.amount DESC
-                    LIMIT {limit}
-                """,
-                "query_type": "list",
-                "default_params": {"limit": 15, "min_amount": 100}
-            },
-
-            "transacoes_periodo": {
-                "keywords": ["transações", "compras", "gastos do", "movimentação", "atividade"],
-                "sql_template": """
-                    SELECT t.date, t.description, t.amount, t.merchant, t.category
-                    FROM transaction t
-                    JOIN pdf_extractable p ON t.pdf_id = p.id
-                    JOIN card c ON p.card_id = c.id
-                    WHERE c.user_id = :user_id
-                    AND t.amount > 0.01
-                    ORDER BY t.date DESC, t.amount DESC
-                    LIMIT {limit}
-                """,
-                "query_type": "list",
-                "default_params": {"limit": 20}
-            },
-
-            # Category-specific queries
-            "gastos_delivery": {
-                "keywords": ["delivery", "entrega", "ifood", "uber eats", "rappi", "99 food"],
-                "sql_template": """
-                    SELECT t.date, t.description, t.amount, t.merchant
-                    FROM transaction t
-                    JOIN pdf_extractable p ON t.pdf_id = p.id
-                    JOIN card c ON p.card_id = c.id
-                    WHERE c.user_id = :user_id
-                    AND t.category = 'food_delivery'
-                    AND t.amount > 0.01
-                    ORDER BY t.amount DESC
-                    LIMIT {limit}
-                """,
-                "query_type": "list",
-                "default_params": {"limit": 15}
-            },
-
-            "gastos_supermercado": {
-                "keywords": ["supermercado", "mercado", "groceries", "compras do mês", "feira"],
-                "sql_template": """
-                    SELECT t.date, t.description, t.amount, t.merchant
-                    FROM transaction t
-                    JOIN pdf_extractable p ON t.pdf_id = p.id
-                    JOIN card c ON p.card_id = c.id
-                    WHERE c.user_id = :user_id
-                    AND t.category = 'groceries'
-                    AND t.amount > 0.01
-                    ORDER BY t.amount DESC
-                    LIMIT {limit}
-                """,
-                "query_type": "list",
-                "default_params": {"limit": 15}
-            },
-
-            "gastos_transporte": {
-                "keywords": ["transporte", "uber", "taxi", "99", "combustível", "gasolina"],
-                "sql_template": """
-                    SELECT t.date, t.description, t.amount, t.merchant, t.category
-                    FROM transaction t
-                    JOIN pdf_extractable p ON t.pdf_id = p.id
-                    JOIN card c ON p.card_id = c.id
-                    WHERE c.user_id = :user_id
-                    AND (t.category = 'transport' OR t.category = 'fuel')
-                    AND t.amount > 0.01
-                    ORDER BY t.amount DESC
-                    LIMIT {limit}
-                """,
-                "query_type": "list",
-                "default_params": {"limit": 15}
-            },
-
-            "gastos_assinaturas": {
-                "keywords": ["assinaturas", "netflix", "spotify", "mensalidade", "planos"],
-                "sql_template": """
-                    SELECT t.date, t.description, t.amount, t.merchant
-                    FROM transaction t
-                    JOIN pdf_extractable p ON t.pdf_id = p.id
-                    JOIN card c ON p.card_id = c.id
-                    WHERE c.user_id = :user_id
-                    AND t.category = 'subscriptions'
-                    AND t.amount > 0.01
-                    ORDER BY t.amount DESC
-                    LIMIT {limit}
-                """,
-                "query_type": "list",
-                "default_params": {"limit": 15}
-            },
-
-            "total_por_categoria": {
-                "keywords": ["total por categoria", "gastos por tipo", "categorias de gasto"],
-                "sql_template": """
-                    SELECT 
-                        t.category,
-                        SUM(t.amount) as total_gasto,
-                        COUNT(*) as num_transacoes,
-                        AVG(t.amount) as gasto_medio
-                    FROM transaction t
-                    JOIN pdf_extractable p ON t.pdf_id = p.id
-                    JOIN card c ON p.card_id = c.id
-                    WHERE c.user_id = :user_id
-                    AND t.amount > 0.01
-                    AND t.category IS NOT NULL
-                    GROUP BY t.category
-                    ORDER BY total_gasto DESC
-                """,
-                "query_type": "aggregation",
-                "default_params": {}
-            }
-        }
+        return QUERY_PATTERNS
 
     def _initialize_portuguese_terms(self) -> Dict[str, str]:
         """
         Mapping of Portuguese terms to standardized periods
         """
-        return {
-            # Períodos temporais
-            "mês passado": "last_month",
-            "último mês": "last_month",
-            "mes passado": "last_month",
-            "mês anterior": "last_month",
-
-            "este mês": "this_month",
-            "neste mês": "this_month",
-            "mês atual": "this_month",
-            "esse mês": "this_month",
-
-            "últimos 30 dias": "last_30_days",
-            "ultimos 30 dias": "last_30_days",
-            "30 dias": "last_30_days"
-        }
+        return PORTUGUESE_TERMS
 
     def generate_query(self, question: str, context: Dict = None) -> Dict[str, Any]:
         """
@@ -253,9 +325,10 @@ class BrazilianFinancialQueryGenerator:
         cache_key = self._create_cache_key(question_normalized, context)
 
         # Check cache first
-        if cache_key in self.query_cache:
+        cached_result = self.query_cache.get(cache_key)
+        if cached_result is not None:
             logger.info("Using cached query pattern")
-            return self.query_cache[cache_key]
+            return cached_result
 
         # Try pattern matching first (no API call)
         pattern_result = self._match_query_pattern(
@@ -263,17 +336,73 @@ class BrazilianFinancialQueryGenerator:
 
         if pattern_result:
             logger.info("Matched predefined pattern - no API call needed")
-            self.query_cache[cache_key] = pattern_result
+            self.query_cache.set(cache_key, pattern_result)
             return pattern_result
 
+        # Plans generated for any user are shared (SQL only binds :user_id
+        # and the period), context-specific questions are not
+        plan_hash = plan_key(question_normalized) if context is None else None
+        if plan_hash:
+            shared_plan = get_plan(self.session_factory(), plan_hash)
+            if shared_plan:
+                logger.info("Using shared query plan - no API call needed")
+                shared_plan.update({
+                    "api_cost": 0,
+                    "generated_sql": True,
+                    "plan_key": plan_hash,
+                    "pattern_matched": "shared_plan",
+                    "post_processing": {"format_dates": True},
+                    "params": self._plan_params(question_normalized)
+                })
+                self.query_cache.set(cache_key, shared_plan)
+                return shared_plan
+
         # Only use LLM for complex queries that don't match patterns
         logger.info("Using LLM for complex query - API call required")
         llm_result = self._generate_with_llm(question_normalized, context)
 
+        if plan_hash:
+            save_plan(self.session_factory(), plan_hash, question_normalized, llm_result)
+            llm_result["plan_key"] = plan_hash
+
         # Cache the result
-        self.query_cache[cache_key] = llm_result
+        if not llm_result.get("error"):
+            self.query_cache.set(cache_key, llm_result)
         return llm_result
 
+    def _plan_params(self, question: str) -> Dict[str, Any]:
+        """Bound parameters of an LLM-generated plan"""
+        period_info = self._extract_period_from_question(question)
+        return {
+            "user_id": self.user_id,
+            "start_date": period_info["start_date"],
+            "end_date": period_info["end_date"]
+        }
+
+    def match_pattern(self, question: str, context: Dict = None,
+                      min_confidence: float = MIN_INTENT_CONFIDENCE) -> Optional[Dict[str, Any]]:
+        """
+        Return the query plan of a predefined pattern, or None (never calls the LLM).
+        A lower `min_confidence` accepts best-effort matches, which are not cached.
+        """
+        question_normalized = self._normalize_question(question)
+        cache_key = self._create_cache_key(question_normalized, context)
+
+        cached_result = self.query_cache.get(cache_key)
+        if cached_result is not None:
+            # LLM and shared plans are cached too, but only predefined
+            # patterns may skip the agent
+            if cached_result.get("api_cost", 0) == 0 and not cached_result.get("generated_sql"):
+                return cached_result
+            if min_confidence >= MIN_INTENT_CONFIDENCE:
+                return None
+
+        pattern_result = self._match_query_pattern(
+            question_normalized, context, min_confidence)
+        if pattern_result and pattern_result["confidence"] >= MIN_INTENT_CONFIDENCE:
+            self.query_cache.set(cache_key, pattern_result)
+        return pattern_result
+
     def _normalize_question(self, question: str) -> str:
         """
         Normalize Portuguese question for better pattern matching
@@ -295,7 +424,8 @@ class BrazilianFinancialQueryGenerator:
 
         return normalized
 
-    def _match_query_pattern(self, question: str, context: Dict = None) -> Optional[Dict[str, Any]]:
+    def _match_query_pattern(self, question: str, context: Dict = None,
+                             min_confidence: float = MIN_INTENT_CONFIDENCE) -> Optional[Dict[str, Any]]:
         """
         Match question against predefined patterns (no API cost)
         """
@@ -306,24 +436,28 @@ class BrazilianFinancialQueryGenerator:
         # Extract value information
         value_info = self._extract_value_from_question(question)
 
-        # Match against patterns
-        for pattern_name, pattern_config in self.query_patterns.items():
-            for keyword in pattern_config["keywords"]:
-                if keyword in question:
-                    # Build query from pattern
-                    query_result = self._build_query_from_pattern(
-                        pattern_config,
-                        period_info,
-                        value_info,
-                        context
-                    )
+        # Scored intent selection (one Aho-Corasick pass over all keywords)
+        match = INTENT_MATCHER.match(question, amount=value_info["min_amount"])
+        if match is None:
+            return None
 
-                    query_result["pattern_matched"] = pattern_name
-                    query_result["api_cost"] = 0  # No API call
+        if match.confidence < min_confidence:
+            logger.info(
+                f"Low-confidence intent '{match.intent}' ({match.confidence:.2f}), escalating")
+            return None
 
-                    return query_result
+        query_result = self._build_query_from_pattern(
+            self.query_patterns[match.intent],
+            period_info,
+            value_info,
+            context
+        )
 
-        return None
+        query_result["pattern_matched"] = match.intent
+        query_result["confidence"] = round(match.confidence, 2)
+        query_result["api_cost"] = 0  # No API call
+
+        return query_result
 
     def _extract_period_from_question(self, question: str) -> Dict[str, Any]:
         """
@@ -333,7 +467,7 @@ class BrazilianFinancialQueryGenerator:
 
         # Check for specific periods
         for term, period in self.portuguese_terms.items():
-            if term in question:
+            if normalize_text(term) in question:
                 if period in ["last_month", "this_month", "last_30_days"]:
                     period_info["period"] = period
                     start_date, end_date = self._parse_relative_date(period)
@@ -373,31 +507,26 @@ class BrazilianFinancialQueryGenerator:
     def _build_query_from_pattern(self, pattern_config: Dict, period_info: Dict,
                                   value_info: Dict, context: Dict = None) -> Dict[str, Any]:
         """
-        Build SQL query from matched pattern
+        Build SQL query from matched pattern (values are bound, never formatted in)
         """
-
-        # Start with base SQL template
-        sql_template = pattern_config["sql_template"]
-        params = pattern_config["default_params"].copy()
+        params = {
+            "user_id": self.user_id,
+            "start_date": period_info["start_date"],
+            "end_date": period_info["end_date"],
+            "min_amount": None
+        }
+        params.update(pattern_config["default_params"])
 
         # Add value filters
         if value_info["min_amount"]:
             params["min_amount"] = value_info["min_amount"]
 
-        # Format SQL with parameters
-        sql_query = sql_template.format(**params)
-
         return {
-            "sql_query": sql_query,
+            "sql_query": pattern_config["sql_template"],
             "query_type": pattern_config["query_type"],
             "expected_format": "table" if pattern_config["query_type"] == "list" else "summary",
-            "post_processing": {
-                "filter_dates": period_info["start_date"] is not None,
-                "period_start": period_info["start_date"],
-                "period_end": period_info["end_date"],
-                "min_amount": value_info.get("min_amount")
-            },
-            "params": {"user_id": self.user_id}
+            "post_processing": {"format_dates": True},
+            "params": params
         }
 
     def _generate_with_llm(self, question: str, context: Dict = None) -> Dict[str, Any]:
@@ -406,22 +535,7 @@ class BrazilianFinancialQueryGenerator:
         """
 
         # Simplified prompt to reduce token usage
-        prompt = f"""
-        Pergunta: {question}
-        
-        Gere SQL PostgreSQL para dados financeiros.
-        
-        Tabelas:
-        - transaction (date VARCHAR, description, amount, pdf_id)
-        - pdf_extractable (card_id)
-        - card (user_id)
-        
-        Sempre usar: WHERE c.user_id = :user_id
-        
-        IMPORTANTE: Responda APENAS com JSON válido, sem explicações ou texto adicional.
-        
-        {{"sql_query": "SELECT...", "query_type": "list", "expected_format": "table"}}
-        """
+        prompt = get_text_prompt("sql_generation").format(question=question)
 
         try:
             llm = self._get_llm()
@@ -475,10 +589,22 @@ class BrazilianFinancialQueryGenerator:
                 }
 
             result = json.loads(content)
+            # Never trust generated SQL: read-only, user-scoped, LIMIT-capped
+            result["sql_query"] = validate_sql(result.get("sql_query") or "")
             result["api_cost"] = 1  # Mark as API call
-            result["post_processing"] = {"filter_dates": False}
-            result["params"] = {"user_id": self.user_id}
+            result["generated_sql"] = True
+            result["post_processing"] = {"format_dates": True}
+            result["params"] = self._plan_params(question)
             return result
+        except SQLGuardError as e:
+            logger.warning(f"Generated SQL rejected: {e}")
+            return {
+                "sql_query": None,
+                "query_type": "error",
+                "error": f"Consulta rejeitada: {str(e)}",
+                "guard_rejected": True,
+                "api_cost": 1
+            }
         except json.JSONDecodeError as e:
             logger.error(
                 f"JSON parsing failed. Content: {content if 'content' in locals() else 'No content'}")
@@ -498,9 +624,11 @@ class BrazilianFinancialQueryGenerator:
                 "api_cost": 1
             }
 
-    def execute_smart_query(self, question: str, context: Dict = None) -> Dict[str, Any]:
+    def execute_smart_query(self, question: str, context: Dict = None,
+                            data_version: Optional[int] = None) -> Dict[str, Any]:
         """
-        Execute query with post-processing for Portuguese dates
+        Execute query with post-processing for Portuguese dates.
+        `data_version` saves a lookup when the caller already knows it.
         """
 
         query_plan = self.generate_query(question, context)
@@ -508,37 +636,77 @@ class BrazilianFinancialQueryGenerator:
         if query_plan.get("error"):
             return {"error": query_plan["error"]}
 
+        return self._execute_plan(query_plan, question, context, data_version)
+
+    def execute_pattern_only(self, question: str, context: Dict = None,
+                             data_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Best-effort answer from the predefined patterns, low-confidence
+        matches included, without any LLM call. None when no keyword matches.
+        """
+        query_plan = self.match_pattern(question, context, min_confidence=0.0)
+        if query_plan is None:
+            return None
+        return self._execute_plan(query_plan, question, context, data_version)
+
+    def _execute_plan(self, query_plan: Dict[str, Any], question: str,
+                      context: Dict = None, data_version: Optional[int] = None) -> Dict[str, Any]:
+        """Run a query plan and post-process its rows (cached per data version)"""
+        sql_query = query_plan.get("sql_query")
+        if not sql_query:
+            return {"error": "Não foi possível gerar consulta SQL"}
+
+        params = query_plan.get("params", {})
+        if data_version is None:
+            data_version = get_data_version(self.user_id)
+
+        # Same template and parameters on unchanged data: skip the database
+        processed_result = sql_result_cache.get(self.user_id, sql_query, params, data_version)
+        if processed_result is None:
+            processed_result = self._run_plan(query_plan, question, context)
+            if isinstance(processed_result, dict):
+                return processed_result
+            sql_result_cache.set(self.user_id, sql_query, params, data_version, processed_result)
+
+        return {
+            "data": processed_result,
+            "query_type": query_plan.get("query_type"),
+            "format": query_plan.get("expected_format"),
+            "sql_used": sql_query,
+            "api_cost": query_plan.get("api_cost", 0),
+            "pattern_matched": query_plan.get("pattern_matched", "llm_generated"),
+            "total_results": len(processed_result)
+        }
+
+    def _run_plan(self, query_plan: Dict[str, Any], question: str, context: Dict = None):
+        """Execute a plan's SQL; returns the processed rows or an error dict"""
+        sql_query = query_plan["sql_query"]
         try:
             session = self.session_factory()
-            sql_query = query_plan.get("sql_query")
 
-            if sql_query:
-                # Execute query
+            # Execute query (LLM-generated SQL only inside the guard)
+            if query_plan.get("generated_sql"):
+                result = execute_guarded(
+                    session, sql_query, query_plan.get("params", {}))
+            else:
                 result = session.execute(
                     text(sql_query),
                     query_plan.get("params", {})
                 ).fetchall()
 
-                # Apply post-processing for Portuguese dates
-                processed_result = self._post_process_results(
-                    result,
-                    query_plan.get("post_processing", {})
-                )
-
-                return {
-                    "data": processed_result,
-                    "query_type": query_plan.get("query_type"),
-                    "format": query_plan.get("expected_format"),
-                    "sql_used": sql_query,
-                    "api_cost": query_plan.get("api_cost", 0),
-                    "pattern_matched": query_plan.get("pattern_matched", "llm_generated"),
-                    "total_results": len(processed_result)
-                }
-            else:
-                return {"error": "Não foi possível gerar consulta SQL"}
+            # Apply post-processing for Portuguese dates
+            return self._post_process_results(
+                result,
+                query_plan.get("post_processing", {})
+            )
 
         except Exception as e:
             logger.error(f"Query execution failed: {e}")
+            if query_plan.get("plan_key") and 'session' in locals():
+                # Don't hand a broken plan to other users
+                mark_failed(session, query_plan["plan_key"], str(e))
+                self.query_cache.delete(
+                    self._create_cache_key(self._normalize_question(question), context))
             return {"error": f"Erro na execução: {str(e)}"}
         finally:
             if 'session' in locals():
@@ -546,7 +714,7 @@ class BrazilianFinancialQueryGenerator:
 
     def _post_process_results(self, results: List, processing_config: Dict) -> List[Dict]:
         """
-        Post-process results including Portuguese date filtering
+        Post-process results (period and amount filters already ran in SQL)
         """
         if not results:
             return []
@@ -555,40 +723,24 @@ class BrazilianFinancialQueryGenerator:
         for row in results:
             row_dict = dict(row._mapping)
 
-            # Apply date filtering if specified
-            if processing_config.get("filter_dates") and "date" in row_dict:
-                date_str = row_dict["date"]
-                parsed_date = self._parse_portuguese_date(date_str)
-
+            # Format date for display
+            if processing_config.get("format_dates") and row_dict.get("date"):
+                parsed_date = self._parse_date(row_dict["date"])
                 if parsed_date:
-                    start_date = processing_config.get("period_start")
-                    end_date = processing_config.get("period_end")
-
-                    if start_date and end_date:
-                        if isinstance(start_date, str):
-                            start_date = datetime.strptime(
-                                start_date, "%Y-%m-%d").date()
-                        if isinstance(end_date, str):
-                            end_date = datetime.strptime(
-                                end_date, "%Y-%m-%d").date()
-
-                        if not (start_date <= parsed_date <= end_date):
-                            continue  # Skip this result
-
-                    # Format date for display
                     row_dict["date_formatted"] = parsed_date.strftime(
                         "%d/%m/%Y")
 
-            # Apply amount filtering
-            min_amount = processing_config.get("min_amount")
-            if min_amount and "amount" in row_dict:
-                if float(row_dict["amount"]) < min_amount:
-                    continue
-
             processed.append(row_dict)
 
         return processed
 
+    def _parse_date(self, date_str: str):
+        """Parse a stored ISO date (YYYY-MM-DD), falling back to the Portuguese format"""
+        try:
+            return datetime.strptime(date_str[:10], "%Y-%m-%d").date()
+        except (TypeError, ValueError):
+            return self._parse_portuguese_date(date_str)
+
     def _parse_portuguese_date(self, date_str: str, year: int = 2025):
         """Parse Portuguese date format"""
         portuguese_months = {
@@ -620,7 +772,8 @@ class BrazilianFinancialQueryGenerator:
 
     def get_query_stats(self) -> Dict[str, Any]:
         """Get statistics about query performance and API usage"""
-        if not self.query_cache:
+        cached_results = self.query_cache.values()
+        if not cached_results:
             return {
                 "total_queries_cached": 0,
                 "api_queries": 0,
@@ -628,8 +781,8 @@ class BrazilianFinancialQueryGenerator:
                 "api_cost_savings": "0%"
             }
 
-        total_queries = len(self.query_cache)
-        api_queries = sum(1 for result in self.query_cache.values()
+        total_queries = len(cached_results)
+        api_queries = sum(1 for result in cached_results
                           if result.get("api_cost", 0) > 0)
 
         return {
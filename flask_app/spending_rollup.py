@@ -0,0 +1,122 @@
+import calendar
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import func
+
+from .models import db, SpendingRollup
+
+logger = logging.getLogger(__name__)
+
+
+def _month_of(date_str: Optional[str]) -> Optional[str]:
+    """Extract the "YYYY-MM" month from an ISO transaction date"""
+    if not date_str or len(date_str) < 7:
+        return None
+    month = date_str[:7]
+    try:
+        datetime.strptime(month, '%Y-%m')
+    except ValueError:
+        return None
+    return month
+
+
+def apply_transactions(user_id: int, transactions: Iterable, sign: int = 1) -> int:
+    """
+    Add (sign=1) or remove (sign=-1) transactions from the user's rollup.
+
+    Only the months touched by the given transactions are loaded, so the
+    cost is proportional to the statement size, not to the user's history.
+    The caller is responsible for committing the session.
+    """
+    deltas = defaultdict(lambda: [0.0, 0])
+    for t in transactions:
+        month = _month_of(t.date)
+        if not month:
+            continue
+        delta = deltas[(month, t.category or '', t.merchant or '')]
+        delta[0] += sign * float(t.amount or 0)
+        delta[1] += sign
+
+    if not deltas:
+        return 0
+
+    months = {month for month, _, _ in deltas}
+    existing = {
+        (row.month, row.category, row.merchant): row
+        for row in db.session.query(SpendingRollup).filter(
+            SpendingRollup.user_id == user_id,
+            SpendingRollup.month.in_(months)
+        ).all()
+    }
+
+    for (month, category, merchant), (amount, count) in deltas.items():
+        row = existing.get((month, category, merchant))
+        if row is None:
+            if sign < 0:
+                continue
+            row = SpendingRollup(
+                user_id=user_id,
+                month=month,
+                category=category,
+                merchant=merchant,
+                total_amount=0.0,
+                transaction_count=0
+            )
+            db.session.add(row)
+
+        row.total_amount = (row.total_amount or 0.0) + amount
+        row.transaction_count = (row.transaction_count or 0) + count
+        if row.transaction_count <= 0:
+            db.session.delete(row)
+
+    logger.info(
+        f"Spending rollup updated for user {user_id}: {len(deltas)} buckets")
+    return len(deltas)
+
+
+def has_rollup(user_id: int) -> bool:
+    """True when the user has at least one rollup bucket"""
+    return db.session.query(SpendingRollup.id).filter(
+        SpendingRollup.user_id == user_id
+    ).first() is not None
+
+
+def month_range(start_date: Optional[datetime],
+                end_date: Optional[datetime]) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """
+    Return the (start_month, end_month) covered by a date range when it is
+    aligned to whole months, or None when the range cuts a month in half
+    and can't be answered from monthly buckets.
+    """
+    if start_date and start_date.day != 1:
+        return None
+    if end_date:
+        last_day = calendar.monthrange(end_date.year, end_date.month)[1]
+        if end_date.day != last_day:
+            return None
+
+    return (
+        start_date.strftime('%Y-%m') if start_date else None,
+        end_date.strftime('%Y-%m') if end_date else None
+    )
+
+
+def spending_by_category(user_id: int, start_month: Optional[str] = None,
+                         end_month: Optional[str] = None) -> Dict[str, float]:
+    """Total spending per category for a range of months, read from the rollup"""
+    query = db.session.query(
+        SpendingRollup.category,
+        func.sum(SpendingRollup.total_amount)
+    ).filter(SpendingRollup.user_id == user_id)
+    if start_month:
+        query = query.filter(SpendingRollup.month >= start_month)
+    if end_month:
+        query = query.filter(SpendingRollup.month <= end_month)
+
+    return {
+        category: float(total or 0)
+        for category, total in query.group_by(SpendingRollup.category).all()
+    }
@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+from typing import Any, Dict, List
+
+import sqlglot
+from sqlalchemy import text
+from sqlglot import exp
+from sqlglot.dialects.postgres import Postgres
+
+logger = logging.getLogger(__name__)
+
+
+class _BoundPostgres(Postgres):
+    """PostgreSQL that keeps :name placeholders for SQLAlchemy text()"""
+
+    class Generator(Postgres.Generator):
+        def placeholder_sql(self, expression: exp.Placeholder) -> str:
+            return f":{expression.name}" if expression.this else "?"
+
+# Tables generated SQL may read
+ALLOWED_TABLES = {'transaction', 'pdf_extractable', 'card'}
+
+# Foreign keys that tie transactions to the user's cards:
+# (table, column) = (table, column). Every table alias must reach the
+# filtered card alias through ON conditions over these edges.
+FK_EDGES = {
+    (('transaction', 'pdf_id'), ('pdf_extractable', 'id')),
+    (('pdf_extractable', 'card_id'), ('card', 'id')),
+}
+
+# SQL functions generated SQL may call (no pg_sleep, dblink, set_config...)
+ALLOWED_FUNCTIONS = {
+    exp.Sum, exp.Count, exp.Avg, exp.Min, exp.Max, exp.Round, exp.Abs,
+    exp.Floor, exp.Ceil, exp.Greatest, exp.Least, exp.Coalesce, exp.Nullif,
+    exp.Case, exp.If, exp.Cast, exp.TryCast, exp.Lower, exp.Upper, exp.Trim,
+    exp.Substring, exp.Left, exp.Right, exp.Length, exp.Concat, exp.GroupConcat,
+    exp.Extract, exp.DateTrunc, exp.TimestampTrunc, exp.TimeToStr,
+    exp.CurrentDate, exp.CurrentTimestamp,
+}
+
+# Placeholders generated SQL may bind
+ALLOWED_PARAMS = {'user_id', 'start_date', 'end_date'}
+
+MAX_LIMIT = int(os.getenv('SQL_GUARD_MAX_LIMIT', 100))
+MAX_PLAN_COST = float(os.getenv('SQL_GUARD_MAX_PLAN_COST', 10000))
+STATEMENT_TIMEOUT_MS = int(os.getenv('SQL_GUARD_STATEMENT_TIMEOUT_MS', 3000))
+
+
+class SQLGuardError(ValueError):
+    """Generated SQL rejected by the guard"""
+
+
+def _conjuncts(condition) -> List[exp.Expression]:
+    if isinstance(condition, exp.And):
+        return _conjuncts(condition.this) + _conjuncts(condition.expression)
+    if isinstance(condition, exp.Paren):
+        return _conjuncts(condition.this)
+    return [condition]
+
+
+def _user_filtered_alias(node, card_aliases):
+    """Card alias constrained by `node` to user_id = :user_id, if any"""
+    if not isinstance(node, exp.EQ):
+        return None
+    for column, value in ((node.this, node.expression), (node.expression, node.this)):
+        if (isinstance(column, exp.Column) and column.name == 'user_id' and
+                column.table in card_aliases and
+                isinstance(value, exp.Placeholder) and value.name == 'user_id'):
+            return column.table
+    return None
+
+
+def _alias_graph(select: exp.Select, aliases: Dict[str, str]) -> Dict[str, set]:
+    """Aliases linked by foreign key equalities in the JOIN ... ON conditions"""
+    graph = {alias: set() for alias in aliases}
+    for join in select.args.get('joins') or []:
+        if join.side or join.kind not in ('', 'INNER'):
+            raise SQLGuardError(f"Apenas INNER JOIN é permitido: {join.sql()}")
+        on = join.args.get('on')
+        if on is None:
+            raise SQLGuardError(f"Join sem condição não permitido: {join.sql()}")
+        for eq in _conjuncts(on):
+            if not (isinstance(eq, exp.EQ) and isinstance(eq.this, exp.Column) and
+                    isinstance(eq.expression, exp.Column)):
+                continue
+            left, right = eq.this, eq.expression
+            if left.table not in aliases or right.table not in aliases:
+                continue
+            edge = ((aliases[left.table], left.name), (aliases[right.table], right.name))
+            if edge in FK_EDGES or edge[::-1] in FK_EDGES:
+                graph[left.table].add(right.table)
+                graph[right.table].add(left.table)
+    return graph
+
+
+def validate_sql(sql: str, max_limit: int = MAX_LIMIT) -> str:
+    """
+    Check LLM-generated SQL and return a normalized, LIMIT-capped version.
+
+    Accepts a single read-only SELECT over the financial tables, filtered
+    with card.user_id = :user_id in the top-level WHERE, in which every
+    table alias is inner-joined back to that card through its foreign
+    keys; anything else raises SQLGuardError.
+    """
+    try:
+        statements = [s for s in sqlglot.parse(sql, read='postgres') if s is not None]
+    except sqlglot.errors.ParseError as e:
+        raise SQLGuardError(f"SQL inválido: {e}")
+
+    if len(statements) != 1:
+        raise SQLGuardError("Apenas uma consulta é permitida")
+
+    select = statements[0]
+    if not isinstance(select, exp.Select):
+        raise SQLGuardError("Apenas consultas SELECT são permitidas")
+
+    # No writes, locks, set operations, CTEs or subqueries anywhere
+    for node in select.walk():
+        if isinstance(node, (exp.Insert, exp.Update, exp.Delete, exp.Drop, exp.Create,
+                             exp.Alter, exp.Command, exp.Union, exp.Intersect,
+                             exp.Except, exp.With, exp.Lock, exp.Into)):
+            raise SQLGuardError(f"Operação não permitida: {node.key}")
+        if isinstance(node, exp.Select) and node is not select:
+            raise SQLGuardError("Subconsultas não são permitidas")
+        if isinstance(node, exp.Placeholder) and node.name not in ALLOWED_PARAMS:
+            raise SQLGuardError(f"Parâmetro não permitido: :{node.name}")
+
+        # AND/OR are Func nodes in sqlglot too
+        if (isinstance(node, exp.Func) and not isinstance(node, exp.Connector) and
+                type(node) not in ALLOWED_FUNCTIONS):
+            name = node.name if isinstance(node, exp.Anonymous) else node.sql_name()
+            raise SQLGuardError(f"Função não permitida: {name}")
+
+    aliases = {}
+    for table in select.find_all(exp.Table):
+        if table.name not in ALLOWED_TABLES:
+            raise SQLGuardError(f"Tabela não permitida: {table.name}")
+        if table.alias_or_name in aliases:
+            raise SQLGuardError(f"Alias repetido: {table.alias_or_name}")
+        aliases[table.alias_or_name] = table.name
+
+    card_aliases = {alias for alias, name in aliases.items() if name == 'card'}
+    if not card_aliases:
+        raise SQLGuardError("A consulta deve filtrar pela tabela card")
+
+    where = select.args.get('where')
+    filtered = set()
+    if where is not None:
+        filtered = {_user_filtered_alias(c, card_aliases) for c in _conjuncts(where.this)}
+        filtered.discard(None)
+    if len(filtered) != 1:
+        raise SQLGuardError("Filtro obrigatório card.user_id = :user_id ausente")
+
+    # Every row source must belong to the filtered card
+    graph = _alias_graph(select, aliases)
+    reached, pending = set(filtered), list(filtered)
+    while pending:
+        for neighbour in graph[pending.pop()] - reached:
+            reached.add(neighbour)
+            pending.append(neighbour)
+    unlinked = sorted(set(aliases) - reached)
+    if unlinked:
+        raise SQLGuardError(
+            f"{aliases[unlinked[0]]} {unlinked[0]} deve ser ligada ao cartão do usuário "
+            f"por chave estrangeira")
+
+    limit = select.args.get('limit')
+    limit_value = None
+    if limit is not None:
+        value = limit.expression
+        if not (isinstance(value, exp.Literal) and value.is_int):
+            raise SQLGuardError("LIMIT deve ser um número")
+        limit_value = int(value.this)
+    if limit_value is None or limit_value > max_limit:
+        select = select.limit(max_limit)
+
+    return select.sql(dialect=_BoundPostgres, identify=True)
+
+
+def execute_guarded(session, sql: str, params: Dict[str, Any],
+                    max_plan_cost: float = MAX_PLAN_COST,
+                    timeout_ms: int = STATEMENT_TIMEOUT_MS) -> List:
+    """
+    Run validated SQL.
+
+    On PostgreSQL it runs on its own connection inside a read-only
+    transaction with a statement_timeout, and is rejected when EXPLAIN
+    estimates a total cost above max_plan_cost. Other databases (SQLite in
+    tests) just execute it on the session.
+    """
+    engine = session.get_bind()
+    if engine.dialect.name != 'postgresql':
+        return session.execute(text(sql), params).fetchall()
+
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            conn.execute(text("SET TRANSACTION READ ONLY"))
+            conn.execute(text(f"SET LOCAL statement_timeout = {int(timeout_ms)}"))
+
+            plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            cost = plan[0]['Plan']['Total Cost']
+            if cost > max_plan_cost:
+                raise SQLGuardError(
+                    f"Consulta muito cara (custo estimado {cost:.0f})")
+
+            return conn.execute(text(sql), params).fetchall()
+        finally:
+            # Read-only: nothing to commit
+            transaction.rollback()
@@ -0,0 +1,73 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from .cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def _compact(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Rows as one column tuple plus value tuples (keys stored once)"""
+    columns = tuple(rows[0].keys()) if rows else ()
+    if any(tuple(row.keys()) != columns for row in rows):
+        return {'columns': None, 'rows': [dict(row) for row in rows]}
+    return {'columns': columns, 'rows': [tuple(row.values()) for row in rows]}
+
+
+def _expand(compact: Dict[str, Any]) -> List[Dict[str, Any]]:
+    columns = compact['columns']
+    if columns is None:
+        return [dict(row) for row in compact['rows']]
+    return [dict(zip(columns, row)) for row in compact['rows']]
+
+
+def _weigh(compact: Dict[str, Any]) -> int:
+    """Approximate size in bytes of a cached result"""
+    return len(json.dumps([compact['columns'], compact['rows']], default=str))
+
+
+class SQLResultCache:
+    """
+    Post-processed rows of smart query executions, keyed by SQL text,
+    bound parameters and the user's data version. An upload or deletion
+    bumps the version, so cached results never outlive the data they
+    were read from. Bounded by total size, least recently used first.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, max_entries: int = 10000,
+                 default_ttl: float = 3600):
+        self._cache = LRUTTLCache(max_size=max_entries, default_ttl=default_ttl,
+                                  max_weight=max_bytes, weigher=_weigh)
+
+    @staticmethod
+    def _key(user_id, sql: str, params: Dict[str, Any], data_version: int) -> str:
+        sql_hash = hashlib.md5(sql.encode()).hexdigest()
+        bound = json.dumps(params or {}, sort_keys=True, default=str)
+        return f"{user_id}:{data_version}:{sql_hash}:{hashlib.md5(bound.encode()).hexdigest()}"
+
+    def get(self, user_id, sql: str, params: Dict[str, Any],
+            data_version: int) -> Optional[List[Dict[str, Any]]]:
+        compact = self._cache.get(self._key(user_id, sql, params, data_version))
+        return _expand(compact) if compact is not None else None
+
+    def set(self, user_id, sql: str, params: Dict[str, Any], data_version: int,
+            rows: List[Dict[str, Any]]):
+        self._cache.set(self._key(user_id, sql, params, data_version), _compact(rows))
+
+    def clear(self, user_id=None) -> int:
+        if user_id is None:
+            count = len(self._cache)
+            self._cache.clear()
+            return count
+        prefix = f"{user_id}:"
+        return self._cache.delete_where(lambda key: key.startswith(prefix))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self._cache.get_stats()
+
+
+sql_result_cache = SQLResultCache(
+    max_bytes=int(os.getenv('JULIUS_SQL_CACHE_BYTES', 32 * 1024 * 1024)))
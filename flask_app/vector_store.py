@@ -1,22 +1,56 @@
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
+import faiss
+import hashlib
+import numpy as np
 import os
+import shutil
 import logging
 from flask import has_app_context
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from langchain.docstore.document import Document
-from .models import db, PDFExtractable, Transaction, Card
+from .models import db, PDFExtractable, Transaction, Card, EmbeddedDocument
+from .llm_providers import get_provider
+from .llm_limits import BreakerEmbeddings, llm_breaker
 
 logger = logging.getLogger(__name__)
 
+# Vector size of embedding models that don't report it
+EMBEDDING_SIZES = {
+    'text-embedding-ada-002': 1536,
+    'text-embedding-3-small': 1536,
+    'text-embedding-3-large': 3072,
+}
+
+
+def _store_path(user_id) -> str:
+    return f"vectorstores/user_{user_id}"
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
 
 class FinancialVectorStore:
-    def __init__(self, user_id):
+    """
+    Per-user FAISS index of statement summaries and transactions.
+
+    Vectors are stored in an IndexIDMap under the id of their
+    EmbeddedDocument row, which also keeps the hash of the embedded text:
+    a sync embeds only new or changed documents and removes the vectors
+    of deleted ones.
+    """
+
+    def __init__(self, user_id, embeddings=None):
         self.user_id = user_id
-        self.save_path = f"vectorstores/user_{user_id}"
+        self.save_path = _store_path(user_id)
         os.makedirs(os.path.dirname(self.save_path), exist_ok=True)
-        self.embeddings = OpenAIEmbeddings()
+        # Sync and retrieval calls fail fast while the LLM circuit is open
+        self.embeddings = BreakerEmbeddings(
+            embeddings or get_provider().embeddings(), llm_breaker)
+        # Without a usable index on disk every tracked document is re-checked
+        self._full_sync = False
         self.vectorstore = self._load_or_create_store()
         self._session = None
 
@@ -35,92 +69,177 @@ class FinancialVectorStore:
                 self._session = Session()
             return self._session
 
+    def _embedding_size(self) -> int:
+        size = (getattr(self.embeddings, 'size', None) or
+                getattr(self.embeddings, 'dimensions', None) or
+                EMBEDDING_SIZES.get(getattr(self.embeddings, 'model', None)))
+        return size or len(self.embeddings.embed_query("extrato"))
+
+    def _empty_store(self):
+        index = faiss.IndexIDMap(faiss.IndexFlatL2(self._embedding_size()))
+        return FAISS(self.embeddings, index, InMemoryDocstore(), {})
+
     def _load_or_create_store(self):
         try:
             if os.path.exists(self.save_path):
-                return FAISS.load_local(
+                store = FAISS.load_local(
                     self.save_path,
                     self.embeddings,
                     allow_dangerous_deserialization=True
                 )
-
-            # Create empty index
-            return FAISS.from_texts(
-                texts=[""],
-                embedding=self.embeddings,
-                metadatas=[{"type": "dummy"}]
-            )
+                if isinstance(store.index, faiss.IndexIDMap):
+                    return store
+                # Written by the old append-only update (positional ids,
+                # duplicated documents): rebuilt by the next sync
+                logger.info(f"Discarding legacy vector store of user {self.user_id}")
         except Exception as e:
             logger.error(f"Vector store initialization failed: {str(e)}")
-            return FAISS.from_texts([""], self.embeddings)
+
+        self._full_sync = True
+        return self._empty_store()
+
+    def _build_documents(self, session, pdfs):
+        """Summary and transaction documents of the given statements, by doc key"""
+        documents = {}
+        for pdf in pdfs:
+            summary_doc = "\n".join([
+                f"Statement Period: {pdf.statement_period_start} to {pdf.statement_period_end}",
+                f"Total Purchases: R${pdf.total_purchases}",
+                f"Categories: {pdf.summary_json}",
+                f"Next Payment Due: {pdf.next_closing_date}",
+            ])
+            documents[f"summary:{pdf.id}"] = Document(
+                page_content=summary_doc,
+                metadata={
+                    "type": "summary",
+                    "pdf_id": pdf.id,
+                    "card_id": pdf.card_id
+                }
+            )
+
+        pdf_ids = [pdf.id for pdf in pdfs]
+        transactions = session.query(Transaction).filter(
+            Transaction.pdf_id.in_(pdf_ids)).all() if pdf_ids else []
+        for t in transactions:
+            transaction_doc = "\n".join([
+                f"Transaction Date: {t.date}",
+                f"Description: {t.description}",
+                f"Amount: R${t.amount}",
+            ])
+            documents[f"transaction:{t.id}"] = Document(
+                page_content=transaction_doc,
+                metadata={
+                    "type": "transaction",
+                    "transaction_id": t.id,
+                    "date": str(t.date),
+                    "amount": float(t.amount),
+                    "pdf_id": t.pdf_id
+                }
+            )
+        return documents
+
+    def _remove_vectors(self, ids):
+        mapping = self.vectorstore.index_to_docstore_id
+        ids = [i for i in ids if i in mapping]
+        if not ids:
+            return
+        self.vectorstore.index.remove_ids(np.array(ids, dtype=np.int64))
+        self.vectorstore.docstore.delete([mapping.pop(i) for i in ids])
+
+    def _add_vectors(self, rows):
+        """Embed (row, document) pairs in one call, under the rows' ids"""
+        vectors = self.embeddings.embed_documents([doc.page_content for _, doc in rows])
+        self.vectorstore.index.add_with_ids(
+            np.array(vectors, dtype=np.float32),
+            np.array([row.id for row, _ in rows], dtype=np.int64))
+        self.vectorstore.docstore.add({row.doc_key: doc for row, doc in rows})
+        self.vectorstore.index_to_docstore_id.update({row.id: row.doc_key for row, _ in rows})
 
     def update_user_data(self, pdf_id=None):
+        """
+        Sync the index with the user's statements (only `pdf_id` when given).
+        Returns the number of documents embedded or removed; nothing is
+        embedded when the data did not change.
+        """
+        session = self._get_session()
         try:
-            """Update vector store with latest financial data"""
-            session = self._get_session()
-
-            # Fetch all PDFs for user
             pdfs = session.query(PDFExtractable).join(Card).filter(
-                Card.user_id == self.user_id
-            ).all()
-
-            if not pdfs:
-                logger.info(f"No PDFs found for user {self.user_id}")
-                return 0
-
-            documents = []
-            for pdf in pdfs:
-                # Skip if specific PDF is requested and doesn't match
-                if pdf_id and pdf.id != pdf_id:
+                Card.user_id == self.user_id)
+            tracked = session.query(EmbeddedDocument).filter(
+                EmbeddedDocument.user_id == self.user_id)
+            full_sync = pdf_id is None or self._full_sync
+            if not full_sync:
+                # A deleted statement has no PDF left: only its vectors go
+                pdfs = pdfs.filter(PDFExtractable.id == pdf_id)
+                tracked = tracked.filter(EmbeddedDocument.pdf_id == pdf_id)
+
+            documents = self._build_documents(session, pdfs.all())
+            tracked = {row.doc_key: row for row in tracked.all()}
+            indexed = self.vectorstore.index_to_docstore_id
+
+            stale = [row for key, row in tracked.items() if key not in documents]
+            pending = []
+            for key, doc in documents.items():
+                content_hash = _content_hash(doc.page_content)
+                row = tracked.get(key)
+                if row is None:
+                    row = EmbeddedDocument(user_id=self.user_id, doc_key=key,
+                                           pdf_id=doc.metadata["pdf_id"],
+                                           content_hash=content_hash)
+                    session.add(row)
+                elif row.content_hash == content_hash and indexed.get(row.id) == key:
                     continue
+                row.content_hash = content_hash
+                pending.append((row, doc))
+
+            # Vectors of changed documents are replaced under the same id
+            remove_ids = [row.id for row in stale] + [row.id for row, _ in pending if row.id]
+            if full_sync:
+                # Left behind by a sync whose commit failed
+                known = {row.id for row in tracked.values()}
+                remove_ids += [i for i in indexed if i not in known]
 
-                # Create document for PDF summary
-                summary_doc = f"""
-                Statement Period: {pdf.statement_period_start} to {pdf.statement_period_end}
-                Total Purchases: R${pdf.total_purchases}
-                Categories: {pdf.summary_json}
-                Next Payment Due: {pdf.next_closing_date}
-                """
-                documents.append(Document(
-                    page_content=summary_doc,
-                    metadata={
-                        "type": "summary",
-                        "pdf_id": pdf.id,
-                        "card_id": pdf.card_id
-                    }
-                ))
-
-                # Add transactions
-                transactions = session.query(
-                    Transaction).filter_by(pdf_id=pdf.id).all()
-                for t in transactions:
-                    transaction_doc = f"""
-                    Transaction Date: {t.date}
-                    Description: {t.description}
-                    Amount: R${t.amount}
-                    """
-                    documents.append(Document(
-                        page_content=transaction_doc,
-                        metadata={
-                            "type": "transaction",
-                            "transaction_id": t.id,
-                            "date": str(t.date),
-                            "amount": float(t.amount),
-                            "pdf_id": pdf.id
-                        }
-                    ))
-
-            if not documents:
-                logger.warning(
-                    f"No documents generated for user {self.user_id}")
+            if not remove_ids and not pending:
                 return 0
 
-            if documents:
-                self.vectorstore.add_documents(documents)
-                self.vectorstore.save_local(self.save_path)
+            self._remove_vectors(remove_ids)
+            for row in stale:
+                session.delete(row)
+            session.flush()  # ids of the new rows
+            if pending:
+                self._add_vectors(pending)
+
+            self.vectorstore.save_local(self.save_path)
+            session.commit()
+            self._full_sync = False
 
-            return len(documents)
+            logger.info(
+                f"Embedding sync for user {self.user_id}: {len(pending)} embedded, "
+                f"{len(stale)} removed, {self.vectorstore.index.ntotal} indexed")
+            return len(pending) + len(stale)
 
         except Exception as e:
+            session.rollback()
+            # The in-memory index may be ahead of the rolled back rows
+            self.vectorstore = self._load_or_create_store()
             logger.exception(f"Error updating user data: {str(e)}")
             return 0
+
+
+def remove_pdf_embeddings(user_id, pdf_id):
+    """Drop the vectors of a deleted statement (no embedding calls)"""
+    save_path = _store_path(user_id)
+    if not os.path.exists(save_path):
+        return 0
+    store = FinancialVectorStore(user_id)
+    if store._full_sync:
+        # Legacy or unreadable index: a sync would re-embed the whole
+        # corpus, so the file goes and the next ingest rebuilds it
+        shutil.rmtree(save_path, ignore_errors=True)
+        session = store._get_session()
+        session.query(EmbeddedDocument).filter(
+            EmbeddedDocument.user_id == user_id,
+            EmbeddedDocument.pdf_id == pdf_id).delete()
+        session.commit()
+        return 0
+    return store.update_user_data(pdf_id)
@@ -39,6 +39,7 @@ def app():
         username = db.Column(db.String(80), unique=True, nullable=False)
         email = db.Column(db.String(120), unique=True, nullable=False)
         password = db.Column(db.String(256), nullable=False)
+        data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
         
         def __repr__(self):
             return f'<User {self.username}>'
@@ -99,7 +100,113 @@ def app():
         
         def __repr__(self):
             return f'<Transaction {self.description}>'
+
+    class SpendingRollup(db.Model):
+        __tablename__ = 'spending_rollup'
+        id = db.Column(db.Integer, primary_key=True)
+        user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+        month = db.Column(db.String(7), nullable=False)
+        category = db.Column(db.String(50), nullable=False, default='')
+        merchant = db.Column(db.String(200), nullable=False, default='')
+        total_amount = db.Column(db.Float, nullable=False, default=0.0)
+        transaction_count = db.Column(db.Integer, nullable=False, default=0)
+        updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+    class Budget(db.Model):
+        __tablename__ = 'budget'
+        id = db.Column(db.Integer, primary_key=True)
+        user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+        category = db.Column(db.String(50), nullable=False)
+        month = db.Column(db.String(7), nullable=False)
+        amount = db.Column(db.Float, nullable=False)
+        created_at = db.Column(db.DateTime, server_default=db.func.now())
+        updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+    class CategorySpendingStats(db.Model):
+        __tablename__ = 'category_spending_stats'
+        id = db.Column(db.Integer, primary_key=True)
+        user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+        category = db.Column(db.String(50), nullable=False)
+        count = db.Column(db.Integer, nullable=False, default=0)
+        mean = db.Column(db.Float, nullable=False, default=0.0)
+        m2 = db.Column(db.Float, nullable=False, default=0.0)
+        updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+    class SpendingAlert(db.Model):
+        __tablename__ = 'spending_alert'
+        id = db.Column(db.Integer, primary_key=True)
+        user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+        alert_type = db.Column(db.String(30), nullable=False)
+        severity = db.Column(db.String(10), nullable=False)
+        message = db.Column(db.String(300), nullable=False)
+        amount = db.Column(db.Float)
+        category = db.Column(db.String(50))
+        date = db.Column(db.String(20))
+        transaction_id = db.Column(db.Integer)
+        created_at = db.Column(db.DateTime, server_default=db.func.now())
     
+    class QueryPlan(db.Model):
+        __tablename__ = 'query_plan'
+        id = db.Column(db.Integer, primary_key=True)
+        question_hash = db.Column(db.String(32), nullable=False, unique=True)
+        question = db.Column(db.Text, nullable=False)
+        sql_query = db.Column(db.Text, nullable=True)
+        query_type = db.Column(db.String(20), nullable=True)
+        expected_format = db.Column(db.String(20), nullable=True)
+        status = db.Column(db.String(20), nullable=False)
+        error = db.Column(db.String(300), nullable=True)
+        prompt_version = db.Column(db.Integer, nullable=True)
+        hit_count = db.Column(db.Integer, nullable=False, default=0)
+        created_at = db.Column(db.DateTime, server_default=db.func.now())
+        last_used_at = db.Column(db.DateTime, server_default=db.func.now())
+
+    class ConversationSession(db.Model):
+        __tablename__ = 'conversation_session'
+        id = db.Column(db.Integer, primary_key=True)
+        user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+        session_id = db.Column(db.String(50), nullable=False, unique=True)
+        is_active = db.Column(db.Boolean, default=True, nullable=False)
+        created_at = db.Column(db.DateTime, server_default=db.func.now())
+        updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+        summary = db.Column(db.Text)
+        summary_message_id = db.Column(db.Integer)
+
+    class ConversationMessage(db.Model):
+        __tablename__ = 'conversation_message'
+        id = db.Column(db.Integer, primary_key=True)
+        session_id = db.Column(db.String(50), db.ForeignKey('conversation_session.session_id'), nullable=False)
+        message_type = db.Column(db.String(20), nullable=False)
+        content = db.Column(db.Text, nullable=False)
+        query_type = db.Column(db.String(50))
+        optimization_level = db.Column(db.String(20))
+        response_time_ms = db.Column(db.Integer)
+        cost_estimate = db.Column(db.Float)
+        prompt_tokens = db.Column(db.Integer)
+        completion_tokens = db.Column(db.Integer)
+        llm_calls = db.Column(db.Integer)
+        model_name = db.Column(db.String(50))
+        tool_latency_ms = db.Column(db.Text)
+        created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+    class UserFinancialProfile(db.Model):
+        __tablename__ = 'user_financial_profile'
+        id = db.Column(db.Integer, primary_key=True)
+        user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True)
+        profile_json = db.Column(db.Text)
+        digest = db.Column(db.Text)
+        data_version = db.Column(db.Integer, nullable=False, default=0)
+        updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+    class EmbeddedDocument(db.Model):
+        __tablename__ = 'embedded_document'
+        id = db.Column(db.Integer, primary_key=True)
+        user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+        doc_key = db.Column(db.String(64), nullable=False)
+        pdf_id = db.Column(db.Integer, nullable=False, index=True)
+        content_hash = db.Column(db.String(64), nullable=False)
+        updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+        __table_args__ = (db.UniqueConstraint('user_id', 'doc_key'),)
+
     # ✅ 5. INICIALIZA OUTRAS EXTENSÕES
     JWTManager(app)
     CORS(app)
@@ -140,9 +247,71 @@ def app():
     flask_app.routes.julius.User = User
     flask_app.routes.julius.db = db
 
+    import flask_app.conversation_memory
+    flask_app.conversation_memory.ConversationSession = ConversationSession
+    flask_app.conversation_memory.ConversationMessage = ConversationMessage
+    flask_app.conversation_memory.db = db
+    # Summaries run in background threads; tests call update() directly
+    flask_app.conversation_memory.conversation_summarizer.enabled = False
+
+    import flask_app.cache_warming
+    flask_app.cache_warming.ConversationMessage = ConversationMessage
+    flask_app.cache_warming.db = db
+
+    import flask_app.julius_metrics
+    flask_app.julius_metrics.ConversationSession = ConversationSession
+    flask_app.julius_metrics.ConversationMessage = ConversationMessage
+    flask_app.julius_metrics.db = db
+
     import flask_app.routes.dashboard
     flask_app.routes.dashboard.User = User
+    flask_app.routes.dashboard.Card = Card
+    flask_app.routes.dashboard.PDFExtractable = PDFExtractable
+    flask_app.routes.dashboard.Transaction = Transaction
+    flask_app.routes.dashboard.SpendingRollup = SpendingRollup
     flask_app.routes.dashboard.db = db
+
+    import flask_app.spending_rollup
+    flask_app.spending_rollup.SpendingRollup = SpendingRollup
+    flask_app.spending_rollup.db = db
+
+    import flask_app.budgets
+    flask_app.budgets.Budget = Budget
+    flask_app.budgets.SpendingAlert = SpendingAlert
+    flask_app.budgets.db = db
+
+    import flask_app.alert_engine
+    flask_app.alert_engine.CategorySpendingStats = CategorySpendingStats
+    flask_app.alert_engine.SpendingAlert = SpendingAlert
+    flask_app.alert_engine.db = db
+
+    import flask_app.query_plan_cache
+    flask_app.query_plan_cache.QueryPlan = QueryPlan
+
+    import flask_app.financial_profile
+    flask_app.financial_profile.Card = Card
+    flask_app.financial_profile.PDFExtractable = PDFExtractable
+    flask_app.financial_profile.Transaction = Transaction
+    flask_app.financial_profile.SpendingRollup = SpendingRollup
+    flask_app.financial_profile.UserFinancialProfile = UserFinancialProfile
+    flask_app.financial_profile.db = db
+
+    import flask_app.vector_store
+    flask_app.vector_store.Card = Card
+    flask_app.vector_store.PDFExtractable = PDFExtractable
+    flask_app.vector_store.Transaction = Transaction
+    flask_app.vector_store.EmbeddedDocument = EmbeddedDocument
+    flask_app.vector_store.db = db
+
+    import flask_app.response_cache
+    flask_app.response_cache.User = User
+    flask_app.response_cache.db = db
+
+    import flask_app.ingest_pipeline
+    flask_app.ingest_pipeline.db = db
+
+    import flask_app.julius_pool
+    flask_app.julius_pool.db = db
     
     # ✅ 8. CRIA TABELAS
     with app.app_context():
@@ -167,6 +336,11 @@ def db(app):
     """Fornece transação isolada - usa a MESMA instância do app"""
     # ✅ USA a mesma instância já registrada no app
     db = app.extensions['sqlalchemy']
+
+    # Every test starts at data_version 0: results cached by another test
+    # would look current
+    from flask_app.sql_result_cache import sql_result_cache
+    sql_result_cache.clear()
     
     with app.app_context():
         connection = db.engine.connect()
@@ -0,0 +1,262 @@
+def _create_statement(db, transactions):
+    """Create a card and a PDF for the test user with the given transactions"""
+    from flask_app.routes.auth import User, Card
+    from flask_app.routes.statements import PDFExtractable, Transaction
+
+    user = User.query.filter_by(email='test@example.com').first()
+
+    card = Card(
+        user_id=user.id,
+        number="1111 2222 3333 4444",
+        expiration_date="12/25",
+        card_type="credito"
+    )
+    db.session.add(card)
+    db.session.flush()
+
+    pdf = PDFExtractable(card_id=card.id, file_name="extrato.pdf")
+    db.session.add(pdf)
+    db.session.flush()
+
+    created = [Transaction(pdf_id=pdf.id, **t) for t in transactions]
+    db.session.add_all(created)
+    db.session.commit()
+    return user, created
+
+
+MERCHANT_TRANSACTIONS = [
+    dict(date="2024-01-05", description="Ifood *Pizza", amount=80.0,
+         category="food_delivery", merchant="iFood"),
+    dict(date="2024-01-20", description="Ifood *Burger", amount=45.0,
+         category="food_delivery", merchant="iFood"),
+    dict(date="2024-01-12", description="Uber Trip", amount=30.0,
+         category="transport", merchant="Uber"),
+    dict(date="2024-02-03", description="Carrefour", amount=250.0,
+         category="groceries", merchant="Carrefour"),
+    dict(date="2024-02-15", description="Uber Trip", amount=25.0,
+         category="transport", merchant="Uber"),
+]
+
+
+def test_get_top_merchants_from_transactions(client, db, auth_headers):
+    """Test top merchants aggregated from raw transactions"""
+    with client.application.app_context():
+        _create_statement(db, MERCHANT_TRANSACTIONS)
+
+    response = client.get('/dashboard/merchants', headers=auth_headers)
+
+    assert response.status_code == 200
+    data = response.json
+    assert [m['merchant'] for m in data] == ["Carrefour", "iFood", "Uber"]
+    assert data[1]['total_spent'] == 125.0
+    assert data[1]['transaction_count'] == 2
+    assert data[1]['average_transaction'] == 62.5
+
+    # Range that cuts a month in half
+    response = client.get(
+        '/dashboard/merchants?start_date=2024-01-10&end_date=2024-01-31', headers=auth_headers)
+    data = response.json
+    assert [m['merchant'] for m in data] == ["iFood", "Uber"]
+    assert data[0]['total_spent'] == 45.0
+
+
+def test_get_top_merchants_from_rollup(client, db, auth_headers):
+    """Test top merchants served from the spending rollup"""
+    with client.application.app_context():
+        from flask_app.spending_rollup import apply_transactions
+
+        user, created = _create_statement(db, MERCHANT_TRANSACTIONS)
+        apply_transactions(user.id, created)
+        db.session.commit()
+
+    response = client.get(
+        '/dashboard/merchants?start_date=2024-01-01&end_date=2024-01-31&limit=1', headers=auth_headers)
+
+    assert response.status_code == 200
+    data = response.json
+    assert len(data) == 1
+    assert data[0]['merchant'] == "iFood"
+    assert data[0]['total_spent'] == 125.0
+
+    response = client.get(
+        '/dashboard/merchants?category=transport', headers=auth_headers)
+    data = response.json
+    assert len(data) == 1
+    assert data[0]['merchant'] == "Uber"
+    assert data[0]['transaction_count'] == 2
+
+
+def test_spending_rollup_removes_deleted_transactions(client, db, auth_headers):
+    """Test that removing transactions drops empty rollup buckets"""
+    with client.application.app_context():
+        from flask_app.spending_rollup import apply_transactions, has_rollup
+
+        user, created = _create_statement(db, MERCHANT_TRANSACTIONS[:2])
+        apply_transactions(user.id, created)
+        db.session.commit()
+        assert has_rollup(user.id)
+
+        apply_transactions(user.id, created, sign=-1)
+        db.session.commit()
+        assert not has_rollup(user.id)
+
+
+def test_get_top_merchants_invalid_date(client, auth_headers):
+    """Test top merchants with a malformed date"""
+    response = client.get(
+        '/dashboard/merchants?start_date=01/2024', headers=auth_headers)
+    assert response.status_code == 400
+
+
+def test_get_spending_alerts(client, db, auth_headers):
+    """Test alerts raised incrementally for newly ingested transactions"""
+    with client.application.app_context():
+        from flask_app.alert_engine import evaluate_new_transactions
+
+        history = [
+            dict(date=f"2024-01-{day:02d}", description="Ifood", amount=amount,
+                 category="food_delivery", merchant="iFood")
+            for day, amount in zip(range(1, 8), [48.0, 52.0, 50.0, 47.0, 55.0, 49.0, 51.0])
+        ]
+        user, created = _create_statement(db, history)
+        assert evaluate_new_transactions(user.id, created) == []
+
+        from flask_app.routes.statements import Transaction
+        new_transactions = [
+            Transaction(pdf_id=created[0].pdf_id, date="2024-02-10", description="Ifood Festa",
+                        amount=400.0, category="food_delivery", merchant="iFood"),
+            Transaction(pdf_id=created[0].pdf_id, date="2024-02-12", description="Notebook",
+                        amount=4500.0, category="shopping_online", merchant="Amazon"),
+            Transaction(pdf_id=created[0].pdf_id, date="2024-02-13", description="Estorno",
+                        amount=-4500.0, category="shopping_online", merchant="Amazon"),
+        ]
+        db.session.add_all(new_transactions)
+        db.session.commit()
+        evaluate_new_transactions(user.id, new_transactions)
+
+    response = client.get('/dashboard/alerts', headers=auth_headers)
+
+    assert response.status_code == 200
+    alerts = response.json['alerts']
+    by_type = {alert['type']: alert for alert in alerts}
+    assert len(alerts) == 2
+
+    assert by_type['unusual_spending']['category'] == "food_delivery"
+    assert by_type['unusual_spending']['amount'] == 400.0
+    assert by_type['unusual_spending']['severity'] == "high"
+
+    assert by_type['large_transaction']['amount'] == 4500.0
+    assert by_type['large_transaction']['date'] == "2024-02-12"
+
+
+def test_set_and_compare_budgets(client, db, auth_headers):
+    """Test bulk budget upsert and budget vs actual from the rollup"""
+    with client.application.app_context():
+        from flask_app.spending_rollup import apply_transactions
+
+        user, created = _create_statement(db, MERCHANT_TRANSACTIONS)
+        apply_transactions(user.id, created)
+        db.session.commit()
+
+    monthly_transport = [40.0] * 12
+    monthly_transport[0] = 20.0
+    response = client.put('/dashboard/budget', headers=auth_headers, json={
+        "year": 2024,
+        "budgets": {"food_delivery": 150.0, "transport": monthly_transport,
+                    "groceries": 0.0}
+    })
+    assert response.status_code == 200
+    assert response.json['saved'] == 36
+
+    response = client.get(
+        '/dashboard/budget?start_date=2024-01-01&end_date=2024-01-31', headers=auth_headers)
+
+    assert response.status_code == 200
+    data = response.json
+    categories = {c['category']: c for c in data['categories']}
+    assert categories['food_delivery']['actual'] == 125.0
+    assert categories['food_delivery']['status'] == "on_track"
+    assert categories['transport']['actual'] == 30.0
+    assert categories['transport']['status'] == "over"
+    assert categories['groceries']['status'] == "under"  # zero budget, nothing spent
+    assert data['total_budget'] == 170.0
+    assert data['total_spent'] == 155.0
+
+    # Updating the same year replaces the amounts instead of duplicating them
+    response = client.put('/dashboard/budget', headers=auth_headers, json={
+        "year": 2024, "budgets": {"transport": 100.0, "food_delivery": None}
+    })
+    assert response.status_code == 200
+    response = client.get(
+        '/dashboard/budget?start_date=2024-01-01&end_date=2024-01-31', headers=auth_headers)
+    data = response.json
+    categories = {c['category']: c for c in data['categories']}
+    assert categories['transport']['budget'] == 100.0
+    assert categories['transport']['status'] == "under"
+    assert 'food_delivery' not in categories
+    assert data['total_spent'] == 30.0  # unbudgeted spending left out
+
+
+def test_set_budget_invalid_payload(client, auth_headers):
+    """Test bulk budget upsert validation"""
+    response = client.put('/dashboard/budget', headers=auth_headers, json={
+        "year": 2024, "budgets": {"groceries": [100.0, 200.0]}
+    })
+    assert response.status_code == 400
+
+    for year in [True, 1850, 10000, "2024"]:
+        response = client.put('/dashboard/budget', headers=auth_headers, json={
+            "year": year, "budgets": {"groceries": 100.0}
+        })
+        assert response.status_code == 400
+
+
+def test_budget_exceeded_alert(client, db, auth_headers):
+    """Test budget breaches raised once per month and category"""
+    with client.application.app_context():
+        from flask_app.alert_engine import evaluate_new_transactions
+        from flask_app.budgets import set_year_budgets
+        from flask_app.spending_rollup import apply_transactions
+
+        user, created = _create_statement(db, MERCHANT_TRANSACTIONS)
+        set_year_budgets(user.id, 2024, {"food_delivery": 100.0})
+        apply_transactions(user.id, created)
+        db.session.commit()
+
+        alerts = evaluate_new_transactions(user.id, created)
+        assert [a.alert_type for a in alerts] == ['budget_exceeded']
+        assert alerts[0].amount == 125.0
+
+        # The same month/category is not alerted twice
+        assert evaluate_new_transactions(user.id, created[:1]) == []
+
+
+def test_budget_exceeded_alert_dropped_with_its_statement(client, db, auth_headers):
+    """Test that deleting statements re-checks the budget breaches they caused"""
+    with client.application.app_context():
+        from flask_app.alert_engine import evaluate_new_transactions
+        from flask_app.budgets import set_year_budgets
+        from flask_app.spending_rollup import apply_transactions
+
+        user, first = _create_statement(db, MERCHANT_TRANSACTIONS)
+        set_year_budgets(user.id, 2024, {"food_delivery": 100.0})
+        apply_transactions(user.id, first)
+        db.session.commit()
+        assert len(evaluate_new_transactions(user.id, first)) == 1
+
+        _, second = _create_statement(db, [
+            dict(date="2024-01-20", description="Ifood *Sushi", amount=110.0,
+                 category="food_delivery", merchant="iFood")])
+        apply_transactions(user.id, second)
+        db.session.commit()
+        evaluate_new_transactions(user.id, second)
+        first_pdf, second_pdf = first[0].pdf_id, second[0].pdf_id
+
+    # Still over budget without the first statement (R$ 110 of R$ 100)
+    assert client.delete(f'/pdf/{first_pdf}', headers=auth_headers).status_code == 200
+    alerts = client.get('/dashboard/alerts', headers=auth_headers).json['alerts']
+    assert [a['type'] for a in alerts] == ['budget_exceeded']
+
+    assert client.delete(f'/pdf/{second_pdf}', headers=auth_headers).status_code == 200
+    alerts = client.get('/dashboard/alerts', headers=auth_headers).json['alerts']
+    assert alerts == []
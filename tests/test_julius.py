@@ -0,0 +1,1236 @@
+import json
+import pytest
+from datetime import datetime
+from unittest.mock import patch
+
+
+class FakeJulius:
+    def __init__(self, user_id, optimization_level):
+        self.user_id = user_id
+        self.optimization_level = optimization_level
+
+
+def test_julius_pool_reuses_instances():
+    """Test that the pool builds one instance per user and level"""
+    from flask_app.julius_pool import JuliusPool
+
+    pool = JuliusPool(max_size=4, idle_ttl=60, factory=FakeJulius, version=lambda user_id: 0)
+
+    first = pool.get(1, "aggressive")
+    assert pool.get("1", "aggressive") is first
+    assert pool.get(1, "quality") is not first
+    assert pool.stats['misses'] == 2
+    assert pool.stats['hits'] == 1
+
+
+def test_julius_pool_lru_and_idle_eviction():
+    """Test LRU eviction, idle TTL and per-user invalidation"""
+    from flask_app.julius_pool import JuliusPool
+
+    pool = JuliusPool(max_size=2, idle_ttl=60, factory=FakeJulius, version=lambda user_id: 0)
+
+    with patch('flask_app.julius_pool.time.time', return_value=1000.0):
+        user_1 = pool.get(1)
+        pool.get(2)
+        pool.get(1)  # user 1 becomes the most recently used
+        pool.get(3)  # evicts user 2
+        assert len(pool) == 2
+        assert pool.get(1) is user_1
+
+    with patch('flask_app.julius_pool.time.time', return_value=1100.0):
+        assert pool.get(1) is not user_1  # idle for longer than the TTL
+        assert len(pool) == 1
+
+    assert pool.invalidate(1) == 1
+    assert len(pool) == 0
+
+
+def test_julius_pool_rebuilds_on_new_data():
+    """Test that data version changes and invalidations during a build are never served stale"""
+    from flask_app.julius_pool import JuliusPool
+
+    versions = {'1': 0}
+    pool = JuliusPool(max_size=4, idle_ttl=60, factory=FakeJulius,
+                      version=lambda user_id: versions[str(user_id)])
+
+    first = pool.get(1)
+    versions['1'] = 1  # bumped by another worker
+    second = pool.get(1)
+    assert second is not first
+    assert pool.get(1) is second
+
+    def build_during_upload(user_id, optimization_level):
+        pool.invalidate(user_id)  # the upload finishes while this builds
+        return FakeJulius(user_id, optimization_level)
+
+    pool._factory = build_during_upload
+    built = pool.get(1, "quality")
+    assert built is not None
+    assert len(pool) == 0  # served once, never pooled
+
+
+def test_conversation_history_does_not_build_agent(client, db, auth_headers):
+    """Test that history and clear never construct JuliusAI"""
+    with patch('flask_app.julius_ai.JuliusAI.__init__', side_effect=AssertionError("built")):
+        response = client.get('/julius/conversation/history', headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json['messages'] == []
+        session_id = response.json['session_id']
+        assert session_id
+
+        response = client.post('/julius/conversation/clear', headers=auth_headers,
+                               json={"session_id": session_id})
+        assert response.status_code == 200
+        assert response.json['success'] is True
+
+
+def test_prompt_registry_loads_vendored_prompts():
+    """Test that agent prompts load from disk without any network call"""
+    from flask_app.prompt_registry import get_chat_prompt, get_text_prompt
+
+    prompt = get_chat_prompt("julius_router")
+    assert prompt.input_variables == ['input']
+    assert get_chat_prompt("julius_router") is prompt
+
+    sql_prompt = get_text_prompt("sql_generation").format(question="quanto gastei?")
+    assert "quanto gastei?" in sql_prompt
+    assert '"sql_query"' in sql_prompt
+    assert "SmartPortugueseQuery" in get_text_prompt("julius_context")
+
+    with pytest.raises(KeyError):
+        get_text_prompt("does_not_exist")
+
+
+def _exercise_response_cache(cache):
+    assert cache.get(1, "abc") is None
+    cache.set(1, "abc", {"response": "R$ 100,00"})
+    cache.set(2, "abc", {"response": "R$ 5,00"})
+    assert cache.get(1, "abc") == {"response": "R$ 100,00"}
+
+    # Only the invalidated user loses their answers
+    assert cache.invalidate_user(1) == 1
+    assert cache.get(1, "abc") is None
+    assert cache.get(2, "abc") == {"response": "R$ 5,00"}
+
+    stats = cache.get_stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 2
+
+
+def test_response_cache_memory_backend():
+    """Test the process-shared response cache with the in-memory backend"""
+    from flask_app.response_cache import ResponseCache, MemoryBackend
+
+    _exercise_response_cache(ResponseCache(MemoryBackend()))
+
+
+def test_response_cache_redis_backend():
+    """Test the process-shared response cache with a Redis backend"""
+    fakeredis = pytest.importorskip("fakeredis")
+    from flask_app.response_cache import ResponseCache, RedisBackend
+
+    _exercise_response_cache(ResponseCache(RedisBackend(fakeredis.FakeRedis())))
+
+
+def test_delete_statement_bumps_data_version(client, db, auth_headers):
+    """Test that changing a user's statements invalidates cached answers"""
+    from test_dashboard import _create_statement, MERCHANT_TRANSACTIONS
+    from flask_app.response_cache import get_data_version
+
+    with client.application.app_context():
+        user, created = _create_statement(db, MERCHANT_TRANSACTIONS)
+        user_id, pdf_id = user.id, created[0].pdf_id
+        assert get_data_version(user_id) == 0
+
+    response = client.delete(f'/pdf/{pdf_id}', headers=auth_headers)
+    assert response.status_code == 200
+
+    with client.application.app_context():
+        # Once with the deleted rows, once after the index was rewritten
+        assert get_data_version(user_id) == 2
+
+
+def test_lru_ttl_cache_eviction_and_expiry():
+    """Test O(1) LRU eviction, TTL expiry and statistics"""
+    from flask_app.cache import LRUTTLCache
+
+    cache = LRUTTLCache(max_size=2, default_ttl=60)
+
+    with patch('flask_app.cache.time.time', return_value=1000.0):
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1
+        cache.set("c", 3)  # evicts "b", the least recently used
+        assert cache.get("b") is None
+        cache.set("short", 4, ttl=5)  # evicts "a"
+
+    with patch('flask_app.cache.time.time', return_value=1010.0):
+        assert cache.get("short") is None
+        assert cache.get("c") == 3
+
+    stats = cache.get_stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 2
+    assert stats['evictions'] == 2
+    assert stats['expirations'] == 1
+
+
+def test_semantic_cache_reuses_paraphrases():
+    """Test that paraphrased questions hit the semantic cache on the same data"""
+    from flask_app.semantic_cache import SemanticCache
+
+    cache = SemanticCache(threshold=0.9)
+    answer = {"response": "Você gastou R$ 1.234,00 este mês"}
+    cache.add(1, "aggressive", 3, "quanto gastei esse mês", answer)
+
+    assert cache.lookup(1, "aggressive", 3, "qual foi meu gasto este mês?") == answer
+
+    # Different period, different user, level or data version: no reuse
+    assert cache.lookup(1, "aggressive", 3, "quanto gastei no mês passado") is None
+    assert cache.lookup(1, "aggressive", 3, "quanto gastei com uber") is None
+    assert cache.lookup(2, "aggressive", 3, "quanto gastei esse mês") is None
+    assert cache.lookup(1, "quality", 3, "quanto gastei esse mês") is None
+    assert cache.lookup(1, "aggressive", 4, "quanto gastei esse mês") is None
+    assert cache.get_stats()['hits'] == 1
+
+
+def _build_julius(user_id, agent_output="Resposta do agente"):
+    """JuliusAI on the fake provider, vector store and agent replaced by mocks"""
+    from unittest.mock import MagicMock
+    from flask_app.julius_ai import JuliusAI
+    from flask_app.llm_providers import FakeProvider
+
+    agent = MagicMock()
+    agent.invoke.return_value = {"output": agent_output}
+
+    with patch('flask_app.julius_ai.FinancialVectorStore'), \
+            patch('flask_app.julius_ai.FinancialQueryExecutor'), \
+            patch.object(JuliusAI, '_create_agent', return_value=agent):
+        return JuliusAI(user_id, provider=FakeProvider())
+
+
+def test_pattern_questions_bypass_the_agent(client, db, auth_headers):
+    """Test that pattern matches are answered without calling the LLM agent"""
+    from flask_app.routes.auth import User
+    from flask_app.conversation_memory import ConversationMemory
+
+    with client.application.app_context():
+        user_id = User.query.filter_by(email='test@example.com').first().id
+        ai = _build_julius(user_id)
+        ai.smart_query_generator.execute_smart_query = lambda question, **kwargs: {
+            "data": [{"date": "2024-01-05", "description": "Ifood", "amount": 80.0}],
+            "query_type": "list",
+            "pattern_matched": "maiores_gastos"
+        }
+
+        result = ai.ask_with_context("Quais foram meus maiores gastos?")
+        assert result['query_type'] == 'pattern:maiores_gastos'
+        assert "R$ 80.00 - Ifood" in result['response']
+        ai.agent.invoke.assert_not_called()
+
+        result = ai.ask_with_context("Me dê uma estratégia para economizar")
+        assert result['query_type'] == 'agent'
+        assert result['response'] == "Resposta do agente"
+        assert ai.agent.invoke.call_count == 1
+
+        history = ConversationMemory(user_id, result['session_id']).get_history()
+        assert [m['query_type'] for m in history if m['message_type'] == 'assistant'] == [
+            'pattern:maiores_gastos', 'agent']
+
+
+def test_intent_matcher_scores_and_escalates():
+    """Test scored intent selection and escalation of ambiguous questions"""
+    from flask_app.smart_query_generator import BrazilianFinancialQueryGenerator
+
+    generator = BrazilianFinancialQueryGenerator(1, session_factory=None)
+
+    plan = generator.match_pattern("Maiores gastos com delivery")
+    assert plan["pattern_matched"] == "gastos_delivery"
+    assert plan["confidence"] == 1.0
+
+    plan = generator.match_pattern("últimas transações do mês passado")
+    assert plan["pattern_matched"] == "ultimas_transacoes"
+    assert plan["params"]["start_date"] is not None
+
+    assert generator.match_pattern("gastos acima de 500")["pattern_matched"] == "gastos_acima_valor"
+
+    # Category patterns honour the amount slot too
+    plan = generator.match_pattern("transações acima de 100 com uber")
+    assert plan["pattern_matched"] == "gastos_transporte"
+    assert plan["params"]["min_amount"] == 100.0
+
+    # A category the chosen pattern can't honour: escalate
+    assert generator.match_pattern("quanto gastei com ifood") is None
+    assert generator.match_pattern("me dê uma estratégia para economizar") is None
+
+
+def test_smart_query_filters_period_in_sql(client, db, auth_headers):
+    """Test that periods and amounts are bound parameters applied by the database"""
+    from test_dashboard import _create_statement
+    from flask_app.smart_query_generator import BrazilianFinancialQueryGenerator
+    from flask_app.utils import parse_relative_date
+
+    start, end = parse_relative_date("last_month")
+    with client.application.app_context():
+        user, _ = _create_statement(db, [
+            dict(date=start, description="Mercado", amount=150.0, category="groceries"),
+            dict(date=end, description="Uber Trip", amount=40.0, category="transport"),
+            dict(date="2020-01-10", description="Antiga", amount=500.0, category="groceries"),
+        ])
+        generator = BrazilianFinancialQueryGenerator(user.id, lambda: db.session)
+
+        plan = generator.match_pattern("gastos do mês passado")
+        assert "{" not in plan["sql_query"]
+        assert plan["params"]["start_date"] == start
+
+        result = generator.execute_smart_query("gastos do mês passado")
+        assert [row["description"] for row in result["data"]] == ["Uber Trip", "Mercado"]
+        assert result["data"][1]["date_formatted"] == datetime.strptime(
+            start, "%Y-%m-%d").strftime("%d/%m/%Y")
+
+        result = generator.execute_smart_query("gastos acima de 100")
+        assert [row["amount"] for row in result["data"]] == [500.0, 150.0]
+
+
+class FakeSQLLLM:
+    def __init__(self, sql):
+        self.sql = sql
+
+    def invoke(self, prompt):
+        from types import SimpleNamespace
+        return SimpleNamespace(content=json.dumps(
+            {"sql_query": self.sql, "query_type": "list", "expected_format": "table"}))
+
+
+GENERATED_SQL = (
+    "SELECT t.date, t.description, t.amount FROM transaction t "
+    "JOIN pdf_extractable p ON t.pdf_id = p.id JOIN card c ON p.card_id = c.id "
+    "WHERE c.user_id = :user_id ORDER BY t.amount DESC LIMIT 1000")
+
+
+def test_sql_guard_rejects_unsafe_sql():
+    """Test the read-only, user-scoped and LIMIT rules for generated SQL"""
+    from flask_app.sql_guard import validate_sql, SQLGuardError
+
+    assert validate_sql(GENERATED_SQL).endswith("LIMIT 100")
+    # Another alias of a table is fine when it is tied to the same card
+    validate_sql(GENERATED_SQL.replace("WHERE", "JOIN transaction t2 ON t2.pdf_id = p.id WHERE"))
+
+    for sql in [
+        "DELETE FROM card",
+        "SELECT 1; DROP TABLE card",
+        'SELECT password FROM "user"',
+        GENERATED_SQL.replace("WHERE c.user_id = :user_id", "WHERE c.user_id = :user_id OR 1 = 1"),
+        GENERATED_SQL.replace("ON t.pdf_id = p.id", "ON 1 = 1"),
+        GENERATED_SQL.replace("LIMIT 1000", 'UNION SELECT password, 1, 1 FROM "user"'),
+        # Extra aliases not joined to the filtered card by foreign key
+        GENERATED_SQL.replace("SELECT t.date", "SELECT t2.date").replace(
+            "WHERE", "JOIN transaction t2 ON t2.id = t2.id WHERE"),
+        GENERATED_SQL.replace("WHERE c.user_id", "JOIN card c2 ON c2.id = c2.id WHERE c2.user_id"),
+        GENERATED_SQL.replace("JOIN pdf_extractable p", "LEFT JOIN pdf_extractable p"),
+        GENERATED_SQL.replace("SELECT t.date", "SELECT pg_sleep(10), t.date"),
+    ]:
+        with pytest.raises(SQLGuardError):
+            validate_sql(sql)
+
+
+def test_sql_guard_keeps_postgres_functions():
+    """Test that the normalized SQL is still PostgreSQL (no generic dialect rewrites)"""
+    from flask_app.sql_guard import validate_sql
+
+    sql = validate_sql(GENERATED_SQL.replace(
+        "SELECT t.date, t.description, t.amount",
+        "SELECT TO_CHAR(DATE_TRUNC('month', t.date), 'YYYY-MM') AS mes, "
+        "STRING_AGG(t.description, ', ') AS descricoes, SUM(t.amount) AS total"
+    ).replace("ORDER BY t.amount DESC", "GROUP BY 1 ORDER BY 1"))
+    assert "TO_CHAR(DATE_TRUNC('MONTH', \"t\".\"date\"), 'YYYY-MM')" in sql
+    assert "STRING_AGG(" in sql
+    assert '"c"."user_id" = :user_id' in sql
+    for rewritten in ("TIME_TO_STR", "TIMESTAMP_TRUNC", "GROUP_CONCAT"):
+        assert rewritten not in sql
+
+
+def test_llm_generated_sql_runs_through_the_guard(client, db, auth_headers):
+    """Test that generated SQL is validated before it is executed"""
+    from test_dashboard import _create_statement, MERCHANT_TRANSACTIONS
+    from flask_app.smart_query_generator import BrazilianFinancialQueryGenerator
+
+    with client.application.app_context():
+        user, _ = _create_statement(db, MERCHANT_TRANSACTIONS)
+        generator = BrazilianFinancialQueryGenerator(user.id, lambda: db.session)
+
+        generator.llm = FakeSQLLLM('SELECT password FROM "user"')
+        result = generator.execute_smart_query("qual a senha dos usuários?")
+        assert "rejeitada" in result["error"]
+
+        generator.llm = FakeSQLLLM(GENERATED_SQL)
+        result = generator.execute_smart_query("qual foi a compra mais cara de todas?")
+        assert result["pattern_matched"] == "llm_generated"
+        assert result["data"][0]["amount"] == 250.0
+
+
+def test_llm_plans_are_shared_between_users(client, db, auth_headers):
+    """Test that a question planned for one user is reused by the others"""
+    from test_dashboard import _create_statement, MERCHANT_TRANSACTIONS
+    from flask_app.routes.auth import User
+    from flask_app.smart_query_generator import BrazilianFinancialQueryGenerator
+    from flask_app.query_plan_cache import QueryPlan
+
+    question = "qual foi a compra mais cara de todas?"
+    with client.application.app_context():
+        user, _ = _create_statement(db, MERCHANT_TRANSACTIONS)
+        other = User(username='other', email='other@example.com', password='x')
+        db.session.add(other)
+        db.session.commit()
+        user_id, other_id = user.id, other.id
+
+        first = BrazilianFinancialQueryGenerator(user_id, lambda: db.session)
+        first.llm = FakeSQLLLM(GENERATED_SQL)
+        assert first.execute_smart_query(question)["data"][0]["amount"] == 250.0
+
+        second = BrazilianFinancialQueryGenerator(other_id, lambda: db.session)
+        second.llm = FakeSQLLLM('SELECT 1')  # must not be called
+        result = second.execute_smart_query(question)
+        assert result["pattern_matched"] == "shared_plan"
+        assert result["api_cost"] == 0
+        assert result["data"] == []  # bound to the other user's id
+
+        plan = db.session.query(QueryPlan).one()
+        assert plan.status == 'valid'
+        assert plan.hit_count == 1
+
+
+class FailingLLM:
+    def invoke(self, prompt):
+        raise ConnectionError("network down")
+
+
+def test_shared_plans_keep_only_guard_verdicts(client, db, auth_headers):
+    """Test that only guard rejections are stored and stored plans are re-checked"""
+    from test_dashboard import _create_statement, MERCHANT_TRANSACTIONS
+    from flask_app.smart_query_generator import BrazilianFinancialQueryGenerator
+    from flask_app.query_plan_cache import QueryPlan, plan_key, _prompt_version
+
+    with client.application.app_context():
+        user, _ = _create_statement(db, MERCHANT_TRANSACTIONS)
+        generator = BrazilianFinancialQueryGenerator(user.id, lambda: db.session)
+
+        generator.llm = FailingLLM()
+        assert "network down" in generator.execute_smart_query("quanto custou a pizza?")["error"]
+        generator.llm = FakeSQLLLM('SELECT password FROM "user"')
+        generator.execute_smart_query("qual a senha dos usuários?")
+        assert [(p.question, p.status) for p in db.session.query(QueryPlan)] == [
+            ("qual a senha dos usuarios?", "rejected")]
+
+        # Stored under an older, weaker guard: never replayed for another user
+        leaky = GENERATED_SQL.replace("SELECT t.date", "SELECT t2.date").replace(
+            "WHERE", "JOIN transaction t2 ON t2.id = t2.id WHERE")
+        question = "qual foi a compra mais cara de todas?"
+        db.session.add(QueryPlan(question_hash=plan_key(question), question=question,
+                                 sql_query=leaky, status='valid', hit_count=0,
+                                 prompt_version=_prompt_version()))
+        db.session.commit()
+        generator.llm = FakeSQLLLM(GENERATED_SQL)
+        result = generator.execute_smart_query(question)
+        assert result["pattern_matched"] == "llm_generated"
+        assert "t2" not in db.session.query(QueryPlan).filter_by(
+            question=question).one().sql_query
+
+
+def test_sql_results_are_cached_per_data_version(client, db, auth_headers):
+    """Test that repeated queries skip the database until the user's data changes"""
+    from test_dashboard import _create_statement, MERCHANT_TRANSACTIONS
+    from flask_app.response_cache import bump_data_version
+    from flask_app.smart_query_generator import BrazilianFinancialQueryGenerator
+    from flask_app.sql_result_cache import SQLResultCache
+
+    with client.application.app_context():
+        user, _ = _create_statement(db, MERCHANT_TRANSACTIONS)
+        sessions = []
+        generator = BrazilianFinancialQueryGenerator(
+            user.id, lambda: sessions.append(1) or db.session)
+
+        first = generator.execute_smart_query("gastos acima de 100")
+        second = generator.execute_smart_query("gastos acima de 100")
+        assert second["data"] == first["data"]
+        assert len(sessions) == 1
+
+        bump_data_version(user.id)
+        generator.execute_smart_query("gastos acima de 100")
+        assert len(sessions) == 2
+
+    rows = [{'description': 'Mercado', 'amount': 150.0}] * 10
+    cache = SQLResultCache(max_bytes=300)
+    cache.set(1, "SELECT 1", {}, 0, rows)
+    assert cache.get(1, "SELECT 1", {}, 0) == rows
+    cache.set(1, "SELECT 2", {}, 0, rows)
+    assert cache.get(1, "SELECT 1", {}, 0) is None  # evicted by size
+    assert cache.get_stats()["weight"] <= 300
+    cache.set(1, "SELECT 3", {}, 0, rows * 10)
+    assert cache.get(1, "SELECT 3", {}, 0) is None  # heavier than the whole cache
+
+
+def _read_sse(body):
+    events = []
+    for frame in body.decode().strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in frame.splitlines())
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+def test_ask_stream_emits_route_tokens_and_saves_answer(client, db, auth_headers):
+    """Test the SSE endpoint for a pattern question and an agent question"""
+    from flask_app.routes.auth import User
+    from flask_app.conversation_memory import ConversationMemory
+
+    with client.application.app_context():
+        user_id = User.query.filter_by(email='test@example.com').first().id
+    ai = _build_julius(user_id)
+    ai.clear_cache()  # process-wide caches outlive other tests
+    ai.smart_query_generator.execute_smart_query = lambda question, **kwargs: {
+        "data": [{"date": "2024-01-05", "description": "Ifood", "amount": 80.0}],
+        "query_type": "list",
+        "pattern_matched": "maiores_gastos"
+    }
+
+    def agent_invoke(inputs, config=None):
+        import uuid
+        for handler in config["callbacks"]:
+            for token in ["Econom", "ize ", "mais"]:
+                handler.on_llm_new_token(token, run_id=uuid.uuid4())
+        return {"output": "Economize mais"}
+    ai.agent.invoke.side_effect = agent_invoke
+
+    with patch('flask_app.routes.julius.julius_pool.get', return_value=ai):
+        response = client.post('/julius/ask/stream', headers=auth_headers,
+                               json={"question": "Quais foram meus maiores gastos?"})
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        events = _read_sse(response.data)
+        assert [name for name, _ in events] == ['session', 'route', 'tool', 'done']
+        assert events[1][1]['query_type'] == 'pattern:maiores_gastos'
+        assert "R$ 80.00 - Ifood" in events[2][1]['output']
+        session_id = events[0][1]['session_id']
+
+        response = client.post('/julius/ask/stream', headers=auth_headers,
+                               json={"question": "Me dê uma estratégia para economizar",
+                                     "session_id": session_id})
+        events = _read_sse(response.data)
+        assert events[1] == ('route', {'query_type': 'agent', 'complexity': 'complex'})
+        assert ''.join(data['text'] for name, data in events if name == 'token') == "Economize mais"
+        assert events[-1][1]['response'] == "Economize mais"
+
+    with client.application.app_context():
+        history = ConversationMemory(user_id, session_id).get_history()
+        assert [m['query_type'] for m in history if m['message_type'] == 'assistant'] == [
+            'pattern:maiores_gastos', 'agent']
+
+
+class FakeOpenAIServer:
+    """Local stand-in for the OpenAI chat completions API (streamed answers)"""
+
+    def __init__(self, delay=0.2, answer="Olá"):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.delay = delay
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                import time
+                self.rfile.read(int(self.headers['Content-Length']))
+                with lock:
+                    server.requests += 1
+                    server.active += 1
+                    server.max_active = max(server.max_active, server.active)
+                try:
+                    time.sleep(server.delay)
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/event-stream')
+                    self.end_headers()
+                    for content in [answer, None]:
+                        chunk = {
+                            "id": "chatcmpl-1", "object": "chat.completion.chunk",
+                            "created": 0, "model": "gpt-3.5-turbo",
+                            "choices": [{"index": 0,
+                                         "delta": {"content": content} if content else {},
+                                         "finish_reason": None if content else "stop"}]
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    usage = {
+                        "id": "chatcmpl-1", "object": "chat.completion.chunk",
+                        "created": 0, "model": "gpt-3.5-turbo", "choices": [],
+                        "usage": {"prompt_tokens": 12, "completion_tokens": 3,
+                                  "total_tokens": 15}
+                    }
+                    self.wfile.write(f"data: {json.dumps(usage)}\n\n".encode())
+                    self.wfile.write(b"data: [DONE]\n\n")
+                finally:
+                    with lock:
+                        server.active -= 1
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def test_llm_limiter_bounds_concurrent_calls():
+    """Test that outbound LLM calls never exceed the limiter against a fake server"""
+    from concurrent.futures import ThreadPoolExecutor
+    from langchain_openai import ChatOpenAI
+    from flask_app.llm_limits import ConcurrencyLimiter, limited_http_client
+
+    limiter = ConcurrencyLimiter(max_concurrent=2, timeout=10)
+    with FakeOpenAIServer(delay=0.2) as server:
+        llm = ChatOpenAI(model="gpt-3.5-turbo", api_key="test", base_url=server.base_url,
+                         streaming=True, max_retries=0,
+                         http_client=limited_http_client(limiter))
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            answers = list(pool.map(lambda _: llm.invoke("oi").content, range(6)))
+
+    assert answers == ["Olá"] * 6
+    assert server.requests == 6
+    assert server.max_active == 2
+    stats = limiter.get_stats()
+    assert stats['acquired'] == 6
+    assert stats['queued'] >= 4
+    assert stats['in_flight'] == 0
+    assert stats['max_waiting'] >= 1
+
+
+def test_llm_deadline_stops_calls_and_frees_the_slot():
+    """Test that a thread's LLM deadline bounds the HTTP call and later calls"""
+    import time
+    from langchain_openai import ChatOpenAI
+    from flask_app.llm_limits import ConcurrencyLimiter, limited_http_client, llm_deadline
+
+    limiter = ConcurrencyLimiter(max_concurrent=1, timeout=10)
+    with FakeOpenAIServer(delay=2.0) as server:
+        llm = ChatOpenAI(model="gpt-3.5-turbo", api_key="test", base_url=server.base_url,
+                         streaming=True, max_retries=0,
+                         http_client=limited_http_client(limiter))
+        start = time.monotonic()
+        with llm_deadline(0.3):
+            with pytest.raises(Exception):
+                llm.invoke("oi")
+            assert time.monotonic() - start < 1.5
+            assert limiter.get_stats()['in_flight'] == 0
+
+            # Past the deadline nothing goes out
+            with pytest.raises(Exception):
+                llm.invoke("oi")
+        assert server.requests == 1
+
+
+def test_identical_concurrent_questions_share_one_agent_run(client, db, auth_headers):
+    """Test that concurrent identical questions are coalesced into one agent call"""
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from flask_app.routes.auth import User
+
+    with client.application.app_context():
+        user_id = User.query.filter_by(email='test@example.com').first().id
+    ai = _build_julius(user_id)
+    ai.clear_cache()
+    # Profile rebuilds would write from every thread on the one test connection
+    ai._get_profile_digest = lambda data_version=None: ''
+
+    coalesced_before = ai.llm_flight.get_stats()['coalesced']
+
+    def slow_agent(inputs, config=None):
+        # Hold the run until the other three requests joined it
+        deadline = time.time() + 5
+        while (ai.llm_flight.get_stats()['coalesced'] - coalesced_before < 3 and
+               time.time() < deadline):
+            time.sleep(0.01)
+        return {"output": "Resposta única"}
+    ai.agent.invoke.side_effect = slow_agent
+
+    def ask(_):
+        with client.application.app_context():
+            response = ai.ask("Me dê uma estratégia para economizar")
+            return response, ai._get_last_query_type()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(ask, range(4)))
+
+    assert ai.agent.invoke.call_count == 1
+    assert {response for response, _ in results} == {"Resposta única"}
+    assert sorted(query_type for _, query_type in results) == [
+        'agent'] + ['agent:coalesced'] * 3
+
+
+def test_ask_with_context_batches_conversation_writes(client, db, auth_headers):
+    """Test that a turn resolves the session once and commits both messages together"""
+    from sqlalchemy import event
+    from flask_app.routes.auth import User
+    from flask_app.conversation_memory import ConversationMemory
+
+    with client.application.app_context():
+        user_id = User.query.filter_by(email='test@example.com').first().id
+        ai = _build_julius(user_id, agent_output="Resposta do agente")
+        ai.clear_cache()
+        session_id = ai.ask_with_context("Me dê uma estratégia para economizar")['session_id']
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            with patch.object(db.session, 'commit', wraps=db.session.commit) as commit:
+                result = ai.ask_with_context("Como posso planejar melhor?", session_id=session_id)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        assert result['session_id'] == session_id
+        assert commit.call_count == 1
+        assert sum('FROM conversation_session' in s for s in statements) == 1
+        assert sum('FROM conversation_message' in s for s in statements) == 1
+
+        history = ConversationMemory(user_id, session_id).get_history()
+        assert [(m['message_type'], m['content']) for m in history][-2:] == [
+            ('user', "Como posso planejar melhor?"), ('assistant', "Resposta do agente")]
+
+
+class FakeSummaryLLM:
+    def __init__(self, summary):
+        self.summary = summary
+        self.prompts = []
+
+    def invoke(self, prompt):
+        from unittest.mock import MagicMock
+        self.prompts.append(prompt)
+        return MagicMock(content=self.summary)
+
+
+def test_conversation_context_uses_rolling_summary_and_budget(client, db, auth_headers):
+    """Test that old turns are folded into the session summary and context stays bounded"""
+    from flask_app.routes.auth import User
+    from flask_app.conversation_memory import (
+        ConversationMemory, ConversationSummarizer, estimate_tokens)
+
+    with client.application.app_context():
+        user_id = User.query.filter_by(email='test@example.com').first().id
+        memory = ConversationMemory(user_id)
+        session_id = memory.get_or_create_session()
+        for turn in range(6):
+            memory.stage_message('user', f"Pergunta {turn} sobre gastos com mercado")
+            memory.stage_message('assistant', f"Resposta {turn}: " + "detalhe " * 40)
+        memory.flush()
+
+        summarizer = ConversationSummarizer(keep_turns=2)
+        llm = FakeSummaryLLM("Usuário acompanha gastos com mercado.")
+        assert summarizer.update(session_id, llm) is True
+        assert "Pergunta 0 sobre gastos" in llm.prompts[0]
+        assert "Pergunta 4" not in llm.prompts[0]  # recent turns stay verbatim
+        assert summarizer.update(session_id, llm) is False  # nothing new to fold
+
+        context = ConversationMemory(user_id, session_id).build_context(
+            turns=2, token_budget=150)
+        assert context.startswith("Resumo da conversa: Usuário acompanha gastos com mercado.")
+        assert "Pergunta 5" in context
+        assert "Pergunta 3" not in context
+        assert estimate_tokens(context) <= 150 + 10
+
+
+def test_usage_callbacks_are_saved_and_aggregated(client, db, auth_headers):
+    """Test that real token usage and tool latency reach the message row and /julius/metrics"""
+    import uuid
+    from langchain_openai import ChatOpenAI
+    from flask_app.routes.auth import User
+
+    with client.application.app_context():
+        user_id = User.query.filter_by(email='test@example.com').first().id
+    ai = _build_julius(user_id)
+    ai.clear_cache()
+    ai.smart_query_generator.execute_smart_query = lambda question, **kwargs: {
+        "data": [{"date": "2024-01-05", "description": "Ifood", "amount": 80.0}],
+        "query_type": "list",
+        "pattern_matched": "maiores_gastos"
+    }
+
+    with FakeOpenAIServer(delay=0, answer="Economize") as server:
+        llm = ChatOpenAI(model="gpt-3.5-turbo", api_key="test", base_url=server.base_url,
+                         streaming=True, stream_usage=True, max_retries=0)
+
+        def agent_invoke(inputs, config=None):
+            tool_run = uuid.uuid4()
+            for handler in config["callbacks"]:
+                handler.on_tool_start({"name": "SmartPortugueseQuery"}, "gastos",
+                                      run_id=tool_run)
+                handler.on_tool_end("ok", run_id=tool_run)
+            return {"output": llm.invoke("oi", config=config).content}
+        ai.agent.invoke.side_effect = agent_invoke
+
+        with client.application.app_context():
+            result = ai.ask_with_context("Me dê uma estratégia para economizar")
+            ai.ask_with_context("Quais foram meus maiores gastos?")
+
+    assert result['query_type'] == 'agent'
+    assert result['response'] == "Economize"
+
+    response = client.get('/julius/metrics', headers=auth_headers)
+    assert response.status_code == 200
+    metrics = response.json['metrics']
+    assert metrics['total_answers'] == 2
+    assert metrics['routing']['agent']['count'] == 1
+    assert metrics['routing']['pattern']['count'] == 1
+    assert metrics['tokens']['prompt_tokens'] == 12
+    assert metrics['tokens']['completion_tokens'] == 3
+    assert metrics['tokens']['llm_calls'] == 1
+    assert metrics['tokens']['cost'] == pytest.approx((12 * 0.0005 + 3 * 0.0015) / 1000)
+    assert metrics['models'] == {'gpt-3.5-turbo': 1}
+    assert metrics['tool_latency_ms']['SmartPortugueseQuery']['count'] == 1
+    assert metrics['latency_ms']['p95'] is not None
+
+    for days in ('abc', '0', '-1', '365'):
+        response = client.get(f'/julius/metrics?days={days}', headers=auth_headers)
+        assert response.status_code == 400
+
+
+def test_percentile_interpolates():
+    """Test the percentile helper used by /julius/metrics"""
+    from flask_app.julius_metrics import percentile
+
+    assert percentile([], 50) is None
+    assert percentile([10], 95) == 10
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile(list(range(1, 101)), 95) == pytest.approx(95.05)
+
+
+def test_incomplete_provider_fails_at_instantiation():
+    """Test that a provider missing embeddings() can't be instantiated"""
+    from flask_app.llm_providers import FakeJuliusChatModel, LLMProvider
+
+    class ChatOnlyProvider(LLMProvider):
+        def _create_chat(self, model, temperature, max_tokens):
+            return FakeJuliusChatModel(model_name=model)
+
+    with pytest.raises(TypeError):
+        ChatOnlyProvider()
+
+
+def test_fake_provider_runs_the_real_agent_offline(client, db, auth_headers, tmp_path, monkeypatch):
+    """Test a full router run (one completion choosing a tool) on the fake provider"""
+    from flask_app.routes.auth import User
+    from flask_app.julius_ai import JuliusAI
+    from flask_app.llm_providers import FakeProvider
+
+    monkeypatch.chdir(tmp_path)  # vector store files
+    with client.application.app_context():
+        user_id = User.query.filter_by(email='test@example.com').first().id
+        ai = JuliusAI(user_id, provider=FakeProvider(prompt_tokens=100, completion_tokens=10))
+        ai.clear_cache()
+        ai.smart_query_generator.execute_smart_query = lambda question, **kwargs: {
+            "data": [{"date": "2024-01-05", "description": "Ifood", "amount": 80.0}],
+            "query_type": "list",
+            "pattern_matched": "maiores_gastos"
+        }
+
+        result = ai.ask_with_context("Me dê uma estratégia para economizar")
+
+    assert result['query_type'] == 'agent'
+    assert "R$ 80.00 - Ifood" in result['response']
+    usage = ai.cost_stats
+    assert usage['llm_cheap_queries'] == 1
+    assert usage['total_api_cost'] == pytest.approx((100 * 0.0005 + 10 * 0.0015) / 1000)
+    assert ai._get_last_usage()['llm_calls'] == 1
+    assert set(ai._get_last_usage()['tool_latency_ms']) == {'SmartPortugueseQuery'}
+
+
+def test_router_turns_tool_errors_into_answers():
+    """Test that invalid tool arguments and tool failures don't escape the router"""
+    from langchain.tools import StructuredTool
+    from pydantic import BaseModel
+    from flask_app.julius_router import FunctionCallingRouter
+    from flask_app.llm_providers import FakeJuliusChatModel
+    from flask_app.prompt_registry import get_chat_prompt
+
+    class StrictInput(BaseModel):
+        question: str
+        limit: int  # never sent by the model
+
+    def failing(question: str) -> str:
+        raise RuntimeError("database down")
+
+    for tool in (
+            StructuredTool.from_function(func=lambda question, limit: "ok", name="SmartPortugueseQuery",
+                                         description="Consulta", args_schema=StrictInput),
+            StructuredTool.from_function(func=failing, name="SmartPortugueseQuery",
+                                         description="Consulta")):
+        router = FunctionCallingRouter(FakeJuliusChatModel(), [tool], get_chat_prompt("julius_router"))
+        result = router.invoke({"input": "Pergunta: quanto gastei?"})
+        assert result["tool"] == "SmartPortugueseQuery"
+        assert "erro" in result["output"]
+
+
+def test_router_ignores_cached_llm_plans():
+    """Test that shared/LLM plans in the query cache never take the pattern route"""
+    from flask_app.smart_query_generator import BrazilianFinancialQueryGenerator
+
+    generator = BrazilianFinancialQueryGenerator(1, session_factory=None)
+    question = "me de uma estrategia para economizar"
+    key = generator._create_cache_key(generator._normalize_question(question), None)
+    generator.query_cache.set(key, {"sql_query": "SELECT 1", "api_cost": 0,
+                                    "generated_sql": True, "pattern_matched": "shared_plan"})
+
+    assert generator.match_pattern(question) is None
+    assert generator.match_pattern("Quais foram meus maiores gastos?")["pattern_matched"] == "maiores_gastos"
+
+
+def test_financial_profile_digest_is_built_and_injected(client, db, auth_headers):
+    """Test the precomputed profile (subscriptions, installments, limits) reaches the agent"""
+    from test_dashboard import _create_statement
+    from flask_app.financial_profile import get_profile_digest, refresh_profile
+    from flask_app.response_cache import bump_data_version
+    from flask_app.spending_rollup import apply_transactions
+
+    with client.application.app_context():
+        user, transactions = _create_statement(db, [
+            dict(date="2024-01-10", description="Netflix", amount=39.9,
+                 category="subscriptions", merchant="Netflix"),
+            dict(date="2024-02-10", description="Netflix", amount=39.9,
+                 category="subscriptions", merchant="Netflix"),
+            dict(date="2024-03-10", description="Netflix", amount=44.9,
+                 category="subscriptions", merchant="Netflix"),
+            dict(date="2024-02-15", description="Mercado", amount=300.0,
+                 category="groceries", merchant="Mercado"),
+            dict(date="2024-02-20", description="Notebook 1/6", amount=500.0,
+                 category="shopping", merchant="Loja", is_installment=True,
+                 installment_info="1/6"),
+            dict(date="2024-03-20", description="Notebook 2/6", amount=500.0,
+                 category="shopping", merchant="Loja", is_installment=True,
+                 installment_info="2/6"),
+        ])
+        from flask_app.routes.auth import Card
+        card = Card.query.filter_by(user_id=user.id).first()
+        card.name, card.available_limit, card.used_limit = "Nubank", 1500.0, 3500.0
+        apply_transactions(user.id, transactions)
+        db.session.commit()
+
+        row = refresh_profile(user.id)
+        profile = json.loads(row.profile_json)
+        assert profile['monthly_totals'] == {'2024-01': 39.9, '2024-02': 839.9, '2024-03': 544.9}
+        assert profile['top_categories'][0]['name'] == 'shopping'
+        assert [s['merchant'] for s in profile['subscriptions']] == ['Netflix']
+        assert profile['installments'] == [{'name': 'Loja', 'amount': 500.0, 'current': 2,
+                                            'total': 6, 'remaining': 4, 'remaining_amount': 2000.0}]
+        assert "Assinaturas recorrentes: Netflix" in row.digest
+        assert "Loja 2/6" in row.digest
+        assert "Cartão Nubank: limite usado R$ 3500.00, disponível R$ 1500.00" in row.digest
+
+        # The digest goes into the agent input
+        ai = _build_julius(user.id)
+        ai.clear_cache()
+        ai.ask_with_context("Me dê uma estratégia para economizar")
+        agent_input = ai.agent.invoke.call_args[0][0]["input"]
+        assert "Perfil financeiro do usuário:" in agent_input
+        assert "Assinaturas recorrentes: Netflix" in agent_input
+
+        # Stale after a data change: rebuilt on read
+        db.session.delete(transactions[0])
+        apply_transactions(user.id, [transactions[0]], sign=-1)
+        bump_data_version(user.id)
+        db.session.commit()
+        digest = get_profile_digest(user.id)
+        assert "2024-01" not in digest
+        assert "Assinaturas recorrentes" not in digest
+
+
+def test_llm_failures_open_the_breaker_and_degrade(client, db, auth_headers, tmp_path, monkeypatch):
+    """Test degraded answers on LLM errors, an open circuit and a spent latency budget"""
+    import time
+    from test_dashboard import _create_statement
+    from flask_app.julius_ai import JuliusAI
+    from flask_app.llm_limits import CircuitBreaker
+    from flask_app.llm_providers import FakeProvider
+    from flask_app.spending_rollup import apply_transactions
+
+    monkeypatch.chdir(tmp_path)  # vector store files
+    with client.application.app_context():
+        user, transactions = _create_statement(db, [
+            dict(date="2024-01-05", description="Ifood *Pizza", amount=80.0,
+                 category="food_delivery", merchant="iFood"),
+        ])
+        user_id = user.id
+        apply_transactions(user_id, transactions)
+        db.session.commit()
+
+        provider = FakeProvider(error="503 Service Unavailable")
+        ai = JuliusAI(user_id, provider=provider)
+        ai.smart_query_generator.session_factory = lambda: db.session
+        ai.clear_cache()
+        ai.llm_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+
+        # Escalated by the router, answered from the best pattern when the LLM fails
+        question = "quanto gastei com ifood"
+        for _ in range(2):
+            result = ai.ask_with_context(question)
+            assert result['degraded'] and result['degraded_reason'] == 'llm_error'
+        assert result['query_type'] == 'degraded:pattern'
+        assert "modo simplificado" in result['response']
+        assert "R$ 80.00" in result['response']
+        assert ai.llm_breaker.state == 'open'
+
+        # Open circuit: the LLM is not called at all
+        result = ai.ask_with_context(question)
+        assert result['degraded_reason'] == 'circuit_open'
+        assert ai.llm_breaker.get_stats()['rejected'] == 1
+
+        # Trial call after the reset timeout closes the circuit again
+        for llm in provider._llms.values():
+            llm.error = None
+        ai.llm_breaker.reset_timeout = 0
+        result = ai.ask_with_context("Me dê uma estratégia para economizar")
+        assert result['query_type'] == 'agent' and not result['degraded']
+        assert ai.llm_breaker.state == 'closed'
+
+        # Slow LLM: the answer comes within the budget, from the profile
+        ai = _build_julius(user_id)
+        ai.clear_cache()
+        ai.latency_budget = 0.2
+        ai.agent.invoke.side_effect = lambda *args, **kwargs: time.sleep(1) or {"output": "tarde"}
+        start = time.time()
+        result = ai.ask_with_context("Me dê uma estratégia para economizar")
+        assert time.time() - start < 0.8
+        assert result['degraded_reason'] == 'latency_budget'
+        assert result['query_type'] == 'degraded:profile'
+        assert "Gastos mensais: 2024-01 R$ 80.00" in result['response']
+
+
+def test_failed_post_ingest_stage_does_not_break_the_next(client, db, monkeypatch):
+    """Test that a stage failing on the database leaves a usable session to the next stages"""
+    from flask_app import ingest_pipeline
+    from flask_app.routes.auth import User
+
+    def failing_stage(user_id, pdf_id, transactions):
+        # Duplicate email: the flush fails and the session needs a rollback
+        db.session.add_all([User(username=name, email='dup@example.com', password='x')
+                            for name in ('first', 'second')])
+        db.session.flush()
+
+    def counting_stage(user_id, pdf_id, transactions):
+        return db.session.query(User).count()
+
+    monkeypatch.setattr(ingest_pipeline, '_POST_INGEST_STAGES',
+                        [('failing', failing_stage), ('counting', counting_stage)])
+    with client.application.app_context():
+        results = ingest_pipeline.run_post_ingest(1, 1, [])
+        assert results == {'failing': None, 'counting': 0}
+
+
+def test_post_ingest_warming_serves_first_questions_from_cache(client, db, auth_headers, monkeypatch):
+    """Test that frequent and canonical pattern questions are answered before they're asked"""
+    from test_dashboard import _create_statement
+    from flask_app.cache_warming import frequent_questions, warm_user_caches
+    from flask_app.conversation_memory import ConversationMemory
+    from flask_app.ingest_pipeline import _POST_INGEST_STAGES
+    from flask_app.julius_pool import julius_pool
+
+    stages = [name for name, _ in _POST_INGEST_STAGES]
+    assert stages.index('cache_warming') > stages.index('julius_pool')
+
+    with client.application.app_context():
+        user, _ = _create_statement(db, [
+            dict(date="2024-01-05", description="Ifood *Pizza", amount=80.0,
+                 category="food_delivery", merchant="iFood"),
+            dict(date="2024-01-06", description="Mercado", amount=120.0,
+                 category="groceries", merchant="Mercado"),
+        ])
+        user_id = user.id
+
+        memory = ConversationMemory(user_id)
+        memory.get_or_create_session()
+        for question in ["Quais foram meus maiores gastos?"] * 3 + ["Me dê uma estratégia para economizar"] * 2:
+            memory.stage_message('user', question)
+        memory.flush()
+        assert frequent_questions(limit=2) == [
+            "Quais foram meus maiores gastos?", "Me dê uma estratégia para economizar"]
+
+        ai = _build_julius(user_id)
+        ai.smart_query_generator.session_factory = lambda: db.session
+        ai.clear_cache()
+        monkeypatch.setattr(julius_pool, '_factory', lambda uid, level: ai)
+        julius_pool.invalidate(user_id)
+
+        warmed = warm_user_caches(user_id, limit=2)
+        assert warmed >= 2  # agent-only questions are skipped
+
+        executed = []
+        original = ai.smart_query_generator.execute_smart_query
+        ai.smart_query_generator.execute_smart_query = lambda *args, **kwargs: executed.append(args) or original(*args, **kwargs)
+
+        result = ai.ask_with_context("Quais foram meus maiores gastos?")
+        assert result['query_type'] == 'cache'
+        assert "R$ 120.00 - Mercado" in result['response']
+        result = ai.ask_with_context("quanto gastei")
+        assert result['query_type'] == 'cache'
+        assert "R$ 200.00" in result['response']
+        # Natural phrasings never asked before
+        result = ai.ask_with_context("Quais foram os meus maiores gastos no mês passado?")
+        assert result['query_type'] == 'semantic_cache'
+        result = ai.ask_with_context("Quanto eu gastei este mês?")
+        assert result['query_type'] == 'semantic_cache'
+        assert executed == []
+        ai.agent.invoke.assert_not_called()
+
+        julius_pool.invalidate(user_id)
+
+
+def test_embedding_sync_is_incremental(client, db, auth_headers, tmp_path, monkeypatch):
+    """Test that syncs embed only new or changed documents and drop deleted statements"""
+    from test_dashboard import _create_statement, MERCHANT_TRANSACTIONS
+    from flask_app.llm_providers import FakeEmbeddings, FakeProvider
+    import flask_app.vector_store as vector_store
+
+    embedded = []
+
+    class CountingEmbeddings(FakeEmbeddings):
+        def embed_documents(self, texts):
+            embedded.append(len(texts))
+            return super().embed_documents(texts)
+
+    monkeypatch.chdir(tmp_path)  # vector store files
+    monkeypatch.setattr('flask_app.llm_providers._default_provider',
+                        FakeProvider(embedding_size=16))
+    embeddings = CountingEmbeddings(size=16)
+    with client.application.app_context():
+        user, created = _create_statement(db, MERCHANT_TRANSACTIONS)
+        user_id, pdf_id, changed_id = user.id, created[0].pdf_id, created[1].id
+
+        store = vector_store.FinancialVectorStore(user_id, embeddings=embeddings)
+        assert store.vectorstore.index.ntotal == 0  # no placeholder document
+        assert store.update_user_data(pdf_id) == 6
+        assert embedded == [6]
+
+        # Full resync from disk on unchanged data: no embedding call
+        store = vector_store.FinancialVectorStore(user_id, embeddings=embeddings)
+        assert store.update_user_data() == 0
+        assert embedded == [6]
+
+        created[1].description = "Ifood *Sushi"
+        db.session.commit()
+        assert store.update_user_data() == 1
+        assert embedded == [6, 1]
+        assert store.vectorstore.index.ntotal == 6
+        assert "Sushi" in store.vectorstore.docstore.search(
+            f"transaction:{changed_id}").page_content
+
+    response = client.delete(f'/pdf/{pdf_id}', headers=auth_headers)
+    assert response.status_code == 200
+
+    with client.application.app_context():
+        store = vector_store.FinancialVectorStore(user_id, embeddings=embeddings)
+        assert store.vectorstore.index.ntotal == 0
+        assert db.session.query(vector_store.EmbeddedDocument).count() == 0
+        assert embedded == [6, 1]
+
+
+def test_embedding_failures_open_the_breaker(client, db, auth_headers, tmp_path, monkeypatch):
+    """Test that failing sync and retrieval embeddings count against the LLM breaker"""
+    from test_dashboard import _create_statement, MERCHANT_TRANSACTIONS
+    from flask_app.llm_limits import CircuitBreaker, CircuitOpenError
+    from flask_app.llm_providers import FakeEmbeddings
+    import flask_app.vector_store as vector_store
+
+    calls = []
+
+    class FailingEmbeddings(FakeEmbeddings):
+        def embed_documents(self, texts):
+            calls.append(len(texts))
+            raise RuntimeError("embeddings API down")
+
+        def embed_query(self, text):
+            calls.append(1)
+            raise RuntimeError("embeddings API down")
+
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    monkeypatch.setattr(vector_store, 'llm_breaker', breaker)
+    monkeypatch.chdir(tmp_path)  # vector store files
+    with client.application.app_context():
+        user, created = _create_statement(db, MERCHANT_TRANSACTIONS)
+        store = vector_store.FinancialVectorStore(user.id, embeddings=FailingEmbeddings(size=16))
+
+        assert store.update_user_data(created[0].pdf_id) == 0
+        with pytest.raises(RuntimeError):
+            store.vectorstore.similarity_search("gastos com ifood")
+        assert breaker.state == 'open'
+
+        # Open: fails fast without reaching the embeddings client
+        with pytest.raises(CircuitOpenError):
+            store.vectorstore.similarity_search("gastos com ifood")
+        assert calls == [6, 1]
+        assert breaker.get_stats()['rejected'] == 1
+
+
+def test_pdf_delete_discards_legacy_store_without_embedding(client, db, auth_headers,
+                                                            tmp_path, monkeypatch):
+    """Test that deleting a PDF drops a legacy index instead of re-embedding the corpus"""
+    import os
+    from langchain_community.vectorstores import FAISS
+    from test_dashboard import _create_statement, MERCHANT_TRANSACTIONS
+    from flask_app.llm_providers import FakeEmbeddings, FakeProvider
+    import flask_app.vector_store as vector_store
+
+    embedded = []
+
+    class CountingEmbeddings(FakeEmbeddings):
+        def embed_documents(self, texts):
+            embedded.append(len(texts))
+            return super().embed_documents(texts)
+
+    monkeypatch.chdir(tmp_path)  # vector store files
+    embeddings = CountingEmbeddings(size=16)
+    provider = FakeProvider(embedding_size=16)
+    monkeypatch.setattr(provider, 'embeddings', lambda *args, **kwargs: embeddings)
+    monkeypatch.setattr('flask_app.vector_store.get_provider', lambda: provider)
+    with client.application.app_context():
+        user, created = _create_statement(db, MERCHANT_TRANSACTIONS)
+        user_id, pdf_id = user.id, created[0].pdf_id
+
+    # Written by the old append-only update: flat index, positional ids
+    save_path = vector_store._store_path(user_id)
+    FAISS.from_texts(["Statement Period: legado"], FakeEmbeddings(size=16)).save_local(save_path)
+
+    response = client.delete(f'/pdf/{pdf_id}', headers=auth_headers)
+    assert response.status_code == 200
+    assert embedded == []
+    assert not os.path.exists(save_path)
+
+
+def test_pdf_delete_survives_index_cleanup_failures(client, db, auth_headers, monkeypatch):
+    """Test that a committed delete answers 200 when the vector store or pool cleanup fails"""
+    from test_dashboard import _create_statement, MERCHANT_TRANSACTIONS
+    from flask_app.routes.statements import PDFExtractable
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("FAISS index unreadable")
+
+    monkeypatch.setattr('flask_app.routes.statements.remove_pdf_embeddings', broken)
+    monkeypatch.setattr('flask_app.routes.statements.invalidate_user', broken)
+    with client.application.app_context():
+        _, created = _create_statement(db, MERCHANT_TRANSACTIONS)
+        pdf_id = created[0].pdf_id
+
+    response = client.delete(f'/pdf/{pdf_id}', headers=auth_headers)
+    assert response.status_code == 200
+    with client.application.app_context():
+        assert db.session.get(PDFExtractable, pdf_id) is None